@@ -13,6 +13,7 @@ import { RecommendationLog } from '../../database/entities/recommendation-log.en
 import { UserBehavior } from '../../database/entities/user-behavior.entity';
 import { Product } from '../../database/entities/product.entity';
 import { Category } from '../../database/entities/category.entity';
+import { UploadModule } from '../upload/upload.module';
 
 @Module({
   imports: [
@@ -23,6 +24,7 @@ import { Category } from '../../database/entities/category.entity';
       Product,
       Category,
     ]),
+    UploadModule,
   ],
   controllers: [AiController],
   providers: [
@@ -0,0 +1,204 @@
+import { ChildProcessWithoutNullStreams, spawn } from 'child_process';
+import * as fs from 'fs';
+import { join } from 'path';
+
+/**
+ * 图片交给推理进程的方式（环境变量 PYTORCH_IMAGE_HANDOFF）：
+ * - shm：写入 /dev/shm（内存文件系统）后只传文件名，Linux 默认
+ * - base64：图片字节 base64 后放在请求 JSON 中，其他平台默认
+ * - path：只传文件路径，由推理进程从磁盘读取
+ */
+const SHM_DIR = '/dev/shm';
+const IMAGE_HANDOFF =
+  process.env.PYTORCH_IMAGE_HANDOFF || (process.platform === 'linux' && fs.existsSync(SHM_DIR) ? 'shm' : 'base64');
+
+/**
+ * 推理进程主动丢弃的请求（过载或已超过截止时间），也包括本端等待超时
+ * 这类错误说明推理进程正忙，调用方不应再启动单次调用进程重试
+ */
+export class InferenceShedError extends Error {
+  constructor(message: string, readonly reason: string) {
+    super(message);
+  }
+}
+
+interface PendingRequest {
+  resolve: (value: any) => void;
+  reject: (reason: any) => void;
+  timer: NodeJS.Timeout;
+}
+
+/**
+ * 常驻的 PyTorch 推理进程（infer_pytorch.py --serve）
+ * - 进程只启动一次，模型只加载一次，之后通过 stdin/stdout 按行收发 JSON
+ * - 每个请求带自增 id，响应按 id 对应回调用方，支持并发请求
+ * - 进程意外退出后，下一次调用会自动重新拉起
+ * - 每个请求带 timeoutMs，推理进程在截止时间之后不再处理该请求；
+ *   排队已满或请求过期时推理进程立即返回 shed，本端以 InferenceShedError 快速失败
+ */
+export class PyTorchWorker {
+  private child: ChildProcessWithoutNullStreams | null = null;
+  private ready: Promise<void> | null = null;
+  private pending = new Map<number, PendingRequest>();
+  private nextId = 1;
+  private nextShmId = 1;
+  private buffer = '';
+
+  constructor(
+    private readonly pythonPath: string,
+    private readonly scriptPath: string,
+    private readonly cwd: string,
+    private readonly requestTimeoutMs = 30000,
+    private readonly startupTimeoutMs = 120000,
+  ) {}
+
+  /**
+   * 发送一个识别请求，返回与单次调用模式相同结构的结果
+   * - 结果中的 timings 为推理进程内各阶段耗时（毫秒），见 inference_metrics.py
+   * - 提供 image（图片内容）时直接交给推理进程，不再让它从 imagePath 读取磁盘文件
+   */
+  async infer(imagePath: string, image?: Buffer): Promise<any> {
+    await this.start();
+    const request = { timings: true, timeoutMs: this.requestTimeoutMs };
+    if (!image || IMAGE_HANDOFF === 'path') {
+      return this.send({ ...request, image: imagePath });
+    }
+    if (IMAGE_HANDOFF === 'base64') {
+      return this.send({ ...request, imageBase64: image.toString('base64') });
+    }
+
+    // 共享内存文件在响应返回（或超时）后删除
+    const shmName = `fish-${process.pid}-${this.nextShmId++}.img`;
+    const shmPath = join(SHM_DIR, shmName);
+    await fs.promises.writeFile(shmPath, image);
+    try {
+      return await this.send({ ...request, shm: shmName });
+    } finally {
+      fs.promises.unlink(shmPath).catch(() => undefined);
+    }
+  }
+
+  stop() {
+    if (this.child) {
+      this.child.kill();
+      this.child = null;
+    }
+    this.ready = null;
+  }
+
+  private start(): Promise<void> {
+    if (this.ready) {
+      return this.ready;
+    }
+
+    this.ready = new Promise<void>((resolve, reject) => {
+      console.log('[推理进程] 启动常驻推理进程:', this.scriptPath);
+      const child = spawn(this.pythonPath, [this.scriptPath, '--serve'], {
+        cwd: this.cwd,
+      });
+      this.child = child;
+      this.buffer = '';
+
+      const startupTimer = setTimeout(() => {
+        reject(new Error('常驻推理进程启动超时'));
+        this.stop();
+      }, this.startupTimeoutMs);
+
+      child.stdout.on('data', (chunk: Buffer) => {
+        this.buffer += chunk.toString();
+        let newline = this.buffer.indexOf('\n');
+        while (newline >= 0) {
+          const line = this.buffer.slice(0, newline).trim();
+          this.buffer = this.buffer.slice(newline + 1);
+          newline = this.buffer.indexOf('\n');
+          if (!line.startsWith('{')) {
+            continue;
+          }
+
+          let message: any;
+          try {
+            message = JSON.parse(line);
+          } catch (e) {
+            console.error('[推理进程] 无法解析输出:', line);
+            continue;
+          }
+
+          if (message.ready) {
+            clearTimeout(startupTimer);
+            console.log('[推理进程] 常驻推理进程已就绪');
+            resolve();
+          } else if (message.id !== undefined) {
+            this.settle(message);
+          } else if (message.error) {
+            clearTimeout(startupTimer);
+            reject(new Error(message.error));
+          }
+        }
+      });
+
+      child.stdin.on('error', (err) => {
+        console.error('[推理进程] 写入请求失败:', err.message);
+      });
+
+      child.stderr.on('data', (chunk: Buffer) => {
+        console.error('[推理进程] stderr:', chunk.toString());
+      });
+
+      const onExit = (reason: string) => {
+        clearTimeout(startupTimer);
+        if (this.child === child) {
+          this.child = null;
+          this.ready = null;
+        }
+        const error = new Error(`常驻推理进程已退出: ${reason}`);
+        reject(error);
+        for (const [id, request] of this.pending) {
+          clearTimeout(request.timer);
+          request.reject(error);
+          this.pending.delete(id);
+        }
+      };
+
+      child.on('error', (err) => onExit(err.message));
+      child.on('exit', (code, signal) => onExit(`code=${code} signal=${signal}`));
+    });
+
+    return this.ready;
+  }
+
+  private send(payload: Record<string, any>): Promise<any> {
+    return new Promise((resolve, reject) => {
+      if (!this.child) {
+        return reject(new Error('常驻推理进程未运行'));
+      }
+
+      const id = this.nextId++;
+      const timer = setTimeout(() => {
+        this.pending.delete(id);
+        reject(new InferenceShedError(`推理请求超时 (${this.requestTimeoutMs}ms)`, 'timeout'));
+      }, this.requestTimeoutMs);
+
+      this.pending.set(id, { resolve, reject, timer });
+      this.child.stdin.write(JSON.stringify({ id, ...payload }) + '\n');
+    });
+  }
+
+  private settle(message: any) {
+    const request = this.pending.get(message.id);
+    if (!request) {
+      return;
+    }
+    this.pending.delete(message.id);
+    clearTimeout(request.timer);
+
+    if (message.shed) {
+      request.reject(new InferenceShedError(message.error, message.shed));
+    } else if (message.error) {
+      request.reject(new Error(message.error));
+    } else {
+      const result = { ...message };
+      delete result.id;
+      request.resolve(result);
+    }
+  }
+}
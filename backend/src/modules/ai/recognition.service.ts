@@ -1,11 +1,13 @@
-import { Injectable } from '@nestjs/common';
+import { Injectable, OnModuleDestroy } from '@nestjs/common';
 import { InjectRepository } from '@nestjs/typeorm';
-import { Repository } from 'typeorm';
+import { In, Repository } from 'typeorm';
 import { ImageRecognition } from '../../database/entities/image-recognition.entity';
 import { Product } from '../../database/entities/product.entity';
 import { execFile } from 'child_process';
-import { join } from 'path';
+import { basename, join } from 'path';
 import { getFishNameCN } from './fish-name-mapper';
+import { InferenceShedError, PyTorchWorker } from './pytorch-worker';
+import { UploadService } from '../upload/upload.service';
 
 // 获取backend目录的绝对路径
 function getBackendDir(): string {
@@ -45,23 +47,83 @@ function getBackendDir(): string {
 }
 
 @Injectable()
-export class RecognitionService {
+export class RecognitionService implements OnModuleDestroy {
+  // 常驻推理进程，首次识别时启动
+  private pytorchWorker: PyTorchWorker | null = null;
+
   constructor(
     @InjectRepository(ImageRecognition)
     private recognitionRepository: Repository<ImageRecognition>,
     @InjectRepository(Product)
     private productRepository: Repository<Product>,
+    private uploadService: UploadService,
   ) { }
 
+  onModuleDestroy() {
+    this.pytorchWorker?.stop();
+  }
+
+  /**
+   * 优先通过常驻推理进程识别（模型只加载一次），失败时回退到单次调用
+   * - 设置环境变量 PYTORCH_SERVE=false 可关闭常驻模式
+   * - 推理进程过载或请求超时时不回退到单次调用（再启动一个进程只会更慢），
+   *   直接抛出，由 recognize 使用兜底结果
+   */
+  private async runPyTorchInference(imagePath: string, image?: Buffer): Promise<any> {
+    if (process.env.PYTORCH_SERVE === 'false') {
+      return this.runPyTorchInferenceOnce(imagePath, image);
+    }
+
+    try {
+      return await this.getPyTorchWorker().infer(imagePath, image);
+    } catch (error) {
+      if (error instanceof InferenceShedError) {
+        console.error(`[识别服务] 推理服务繁忙（${error.reason}），跳过识别:`, error.message);
+        throw error;
+      }
+      console.error('[识别服务] 常驻推理进程识别失败，回退到单次调用:', error.message);
+      return this.runPyTorchInferenceOnce(imagePath, image);
+    }
+  }
+
+  private getPyTorchWorker(): PyTorchWorker {
+    if (!this.pytorchWorker) {
+      const { pythonPath, scriptPath, trainingDir } = this.getPyTorchPaths();
+      // PYTORCH_TIMEOUT_MS：单个识别请求的超时时间，推理进程会丢弃超过该时间仍未处理的请求
+      const timeoutMs = Number(process.env.PYTORCH_TIMEOUT_MS) || undefined;
+      this.pytorchWorker = new PyTorchWorker(pythonPath, scriptPath, trainingDir, timeoutMs);
+    }
+    return this.pytorchWorker;
+  }
+
+  /**
+   * 推理脚本相关路径
+   * - 训练脚本在 src 目录下（开发环境）或 dist/src 目录下（生产环境）
+   *   但实际脚本文件始终在 src 目录下
+   * - 使用Conda环境中的Python（Windows路径），可以通过环境变量PYTHON_PATH配置
+   */
+  private getPyTorchPaths() {
+    const backendDir = getBackendDir();
+    const trainingDir = join(backendDir, 'src', 'modules', 'ai', 'training');
+    const scriptPath = join(trainingDir, 'infer_pytorch.py');
+    const pythonPath = process.env.PYTHON_PATH ||
+      (process.platform === 'win32'
+        ? 'D:\\Anaconda\\envs\\pytorch\\python.exe'
+        : 'python');
+    return { backendDir, trainingDir, scriptPath, pythonPath };
+  }
+
   /**
    * 调用基于 PyTorch 的推理脚本进行识别
    * - 脚本：backend/src/modules/ai/training/infer_pytorch.py
    * - 输出：一行 JSON（见 infer_pytorch.py 说明）
    *
+   * - 提供 image（图片内容）时通过 stdin 传给脚本（--image -），不再读取磁盘文件
+   *
    * 注意：需要在启动后端前激活包含 PyTorch 的 Conda 环境，
    * 确保 `python` 命令可用且已安装 torch / torchvision。
    */
-  private runPyTorchInference(imagePath: string): Promise<any> {
+  private runPyTorchInferenceOnce(imagePath: string, image?: Buffer): Promise<any> {
     return new Promise((resolve, reject) => {
       const backendDir = getBackendDir();
 
@@ -100,9 +162,9 @@ export class RecognitionService {
         absoluteImagePath = join(backendDir, imagePath);
       }
 
-      // 检查文件是否存在
+      // 检查文件是否存在（图片内容已在内存中时不需要文件）
       const fs = require('fs');
-      const fileExists = fs.existsSync(absoluteImagePath);
+      const fileExists = !!image || fs.existsSync(absoluteImagePath);
 
       console.log('[识别服务] PyTorch识别参数:', {
         pythonPath,
@@ -111,6 +173,7 @@ export class RecognitionService {
         originalImagePath: imagePath,
         absoluteImagePath,
         fileExists,
+        fromMemory: !!image,
         backendDir,
         cwd: trainingDir,
         __dirname,
@@ -128,9 +191,9 @@ export class RecognitionService {
         throw error;
       }
 
-      execFile(
+      const child = execFile(
         pythonPath,
-        [scriptPath, '--image', absoluteImagePath],
+        [scriptPath, '--image', image ? '-' : absoluteImagePath, '--timings'],
         {
           maxBuffer: 10 * 1024 * 1024,
           cwd: trainingDir,
@@ -163,7 +226,28 @@ export class RecognitionService {
           }
         },
       );
+      if (image) {
+        child.stdin?.on('error', () => undefined);
+        child.stdin?.end(image);
+      }
+    });
+  }
+
+  /**
+   * 按相似度顺序取出视觉相似的商品（已删除的商品直接跳过）
+   */
+  private async findVisuallySimilarProducts(similar?: { productId: number }[]): Promise<Product[]> {
+    const ids = (similar || []).map(item => item.productId);
+    if (ids.length === 0) {
+      return [];
+    }
+
+    const products = await this.productRepository.find({
+      where: { id: In(ids) },
+      relations: ['category'],
     });
+    const productsById = new Map(products.map(p => [p.id, p]));
+    return ids.map(id => productsById.get(id)).filter((p): p is Product => !!p);
   }
 
   async recognize(userId: number, imageUrl: string) {
@@ -201,8 +285,15 @@ export class RecognitionService {
         fileExists: require('fs').existsSync(localImagePath),
       });
 
-      // 调用 PyTorch 脚本进行识别
-      const pyResult = await this.runPyTorchInference(localImagePath);
+      // 调用 PyTorch 脚本进行识别；刚上传的图片直接使用内存中的内容，不再从磁盘读取
+      const uploadedImage = this.uploadService.getRecentUpload(basename(localImagePath));
+      const inferenceStart = Date.now();
+      const { timings, ...pyResult } = await this.runPyTorchInference(localImagePath, uploadedImage);
+      // 推理进程内各阶段耗时（读取、解码、缩放归一化、前向、后处理、序列化），不写入识别记录
+      console.log('[识别服务] 识别耗时(ms):', {
+        total: Date.now() - inferenceStart,
+        ...timings,
+      });
 
       // 将英文类别名转换为中文
       const fishNameEN = pyResult.fishName ?? 'unknown';
@@ -249,20 +340,27 @@ export class RecognitionService {
     let recommendedProducts: Product[] = [];
     try {
       const fishName = recognitionResult.fishName;
-      console.log('[识别服务] 搜索推荐商品，鱼类名称:', fishName);
-
-      // 使用模糊搜索查找相关商品
-      recommendedProducts = await this.productRepository
-        .createQueryBuilder('product')
-        .leftJoinAndSelect('product.category', 'category')
-        .where('product.name LIKE :keyword', { keyword: `%${fishName}%` })
-        .orWhere('product.description LIKE :keyword', { keyword: `%${fishName}%` })
-        .orderBy('product.stock', 'DESC') // 优先显示有库存的
-        .addOrderBy('product.price', 'ASC') // 价格从低到高
-        .limit(6) // 最多返回6个推荐商品
-        .getMany();
-
-      console.log('[识别服务] 找到商品数量:', recommendedProducts.length);
+
+      // 推理进程加载了商品向量索引时（embed_products.py），结果中的 similar 为视觉最相似的商品
+      recommendedProducts = await this.findVisuallySimilarProducts(recognitionResult.result?.similar);
+      if (recommendedProducts.length > 0) {
+        console.log('[识别服务] 视觉相似商品数量:', recommendedProducts.length);
+      } else {
+        console.log('[识别服务] 搜索推荐商品，鱼类名称:', fishName);
+
+        // 使用模糊搜索查找相关商品
+        recommendedProducts = await this.productRepository
+          .createQueryBuilder('product')
+          .leftJoinAndSelect('product.category', 'category')
+          .where('product.name LIKE :keyword', { keyword: `%${fishName}%` })
+          .orWhere('product.description LIKE :keyword', { keyword: `%${fishName}%` })
+          .orderBy('product.stock', 'DESC') // 优先显示有库存的
+          .addOrderBy('product.price', 'ASC') // 价格从低到高
+          .limit(6) // 最多返回6个推荐商品
+          .getMany();
+
+        console.log('[识别服务] 找到商品数量:', recommendedProducts.length);
+      }
 
       // 如果没找到，尝试搜索备选结果
       if (recommendedProducts.length === 0 && recognitionResult.result?.alternatives) {
@@ -0,0 +1,466 @@
+"""
+推理性能基准测试
+
+用法：
+    python bench_inference.py run --output bench.json          # 完整测试，结果写入 JSON
+    python bench_inference.py run --output bench.json --threads 1,4 --batch-sizes 1,8 --runs 50
+    python bench_inference.py compare bench_baseline.json bench.json     # 对比两次结果
+    python bench_inference.py compare bench_baseline.json                # 按基线的配置重新测试后对比
+
+测试内容（全部离线完成，不需要网络与真实数据集）：
+1. 按固定随机种子生成手机拍摄分辨率的合成 JPEG（默认 1920x1080、3024x4032、4032x3024、4624x3472），
+   缓存在临时目录中，多次运行使用完全相同的图片；
+2. 单次调用：每种分辨率多次运行 python infer_pytorch.py --image xxx.jpg --timings，
+   统计整个进程的耗时（包含解释器启动与模型加载）、峰值 RSS 以及各阶段耗时的中位数；
+3. 进程内循环：每个线程数单独启动一个子进程，加载一次模型后按不同批大小循环
+   “读取 + 解码 + 预处理 + 批量前向”，统计每批延迟、每秒图片数与峰值 RSS。
+
+每项结果给出 p50 / p95 / p99 延迟（毫秒）、imagesPerSecond 与 peakRssMb。
+compare 逐项对比：延迟或峰值 RSS 增加、吞吐下降超过 --tolerance（默认 15%）时标记为回退，有回退时退出码为 1。
+两次测试的 CPU、核心数、torch 版本或模型版本不同时会给出提示，此时的对比仅供参考。
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+
+DEFAULT_RESOLUTIONS = "1920x1080,3024x4032,4032x3024,4624x3472"
+DEFAULT_BATCH_SIZES = "1,4,8"
+DEFAULT_TOLERANCE = 0.15
+# 延迟变化小于该值（毫秒）时不算回退，避免极短耗时上的抖动被误报
+DEFAULT_MIN_DELTA_MS = 2.0
+IMAGE_SEED = 20240601
+JPEG_QUALITY = 90
+IMAGE_DIR = os.path.join(tempfile.gettempdir(), "fish_bench_images")
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+INFER_SCRIPT = os.path.join(SCRIPT_DIR, "infer_pytorch.py")
+
+# 越大越差的指标与越小越差的指标
+HIGHER_IS_WORSE = ("p50Ms", "p95Ms", "p99Ms", "peakRssMb")
+LOWER_IS_WORSE = ("imagesPerSecond",)
+
+
+def parse_resolution(text: str):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def parse_ints(text: str):
+    return [int(item) for item in str(text).split(",") if item.strip()]
+
+
+def synthetic_image(width: int, height: int, seed: int):
+    """
+    生成一张接近自然照片统计特性的图片：低分辨率随机色块双三次放大（大面积平滑过渡）+ 轻微噪声，
+    JPEG 压缩后的文件大小与解码开销与手机照片相近（纯噪声图片压缩率过低，纯色图片又过于简单）
+    """
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 256, size=(max(height // 64, 2), max(width // 64, 2), 3), dtype=np.uint8)
+    img = Image.fromarray(coarse).resize((width, height), Image.BICUBIC)
+    pixels = np.asarray(img, dtype=np.int16) + rng.integers(-12, 13, size=(height, width, 3), dtype=np.int16)
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+
+def ensure_images(resolutions, image_dir: str = IMAGE_DIR):
+    """
+    返回每种分辨率对应的合成图片路径；相同分辨率与种子的图片只生成一次
+    """
+    os.makedirs(image_dir, exist_ok=True)
+    paths = {}
+    for index, resolution in enumerate(resolutions):
+        width, height = parse_resolution(resolution)
+        path = os.path.join(image_dir, f"phone_{width}x{height}_{IMAGE_SEED}.jpg")
+        if not os.path.isfile(path):
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            synthetic_image(width, height, IMAGE_SEED + index).save(tmp_path, "JPEG", quality=JPEG_QUALITY)
+            os.replace(tmp_path, path)
+        paths[resolution] = path
+    return paths
+
+
+def summarize(timings_ms, images: int, elapsed_s: float):
+    import numpy as np
+
+    return {
+        "runs": len(timings_ms),
+        "p50Ms": round(float(np.percentile(timings_ms, 50)), 3),
+        "p95Ms": round(float(np.percentile(timings_ms, 95)), 3),
+        "p99Ms": round(float(np.percentile(timings_ms, 99)), 3),
+        "imagesPerSecond": round(images / elapsed_s, 3) if elapsed_s > 0 else 0.0,
+    }
+
+
+def _max_rss_mb(usage):
+    # Linux 上 ru_maxrss 的单位为 KB
+    return round(usage.ru_maxrss / 1024.0, 1)
+
+
+def bench_cli(image_path: str, runs: int, backend: str = None, decoder: str = None):
+    """
+    单次调用：每次启动一个新进程识别一张图片，统计整个进程的耗时与峰值 RSS
+    """
+    import numpy as np
+
+    command = [sys.executable, INFER_SCRIPT, "--image", image_path, "--timings"]
+    if backend:
+        command += ["--backend", backend]
+    if decoder:
+        command += ["--decoder", decoder]
+
+    timings, peak_rss, stages = [], 0.0, {}
+    start_all = time.perf_counter()
+    for _ in range(runs):
+        start = time.perf_counter()
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        output = process.stdout.read()
+        process.stdout.close()
+        # wait4 同时取得该子进程自身的资源使用（峰值 RSS）
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        timings.append((time.perf_counter() - start) * 1000.0)
+        peak_rss = max(peak_rss, _max_rss_mb(usage))
+
+        line = next((line for line in output.splitlines() if line.startswith("{")), "{}")
+        result = json.loads(line)
+        if "error" in result or process.returncode != 0:
+            raise RuntimeError(result.get("error") or f"infer_pytorch.py 退出码 {process.returncode}")
+        for name, ms in result.get("timings", {}).items():
+            stages.setdefault(name, []).append(ms)
+    elapsed = time.perf_counter() - start_all
+
+    row = summarize(timings, runs, elapsed)
+    row["peakRssMb"] = peak_rss
+    row["stagesMs"] = {name: round(float(np.median(values)), 3) for name, values in stages.items()}
+    return row
+
+
+def bench_inprocess(image_paths, threads: int, batch_sizes, runs: int, warmup: int, backend: str = None):
+    """
+    进程内循环（在单独的子进程中调用）：加载一次模型，每个批大小循环 runs 次
+    “读取 + 解码 + 预处理 + 批量前向”，图片按固定顺序轮流取用
+    """
+    import infer_pytorch
+
+    if backend:
+        infer_pytorch.set_backend(backend)
+    infer_pytorch.set_cpu_profile(None, intra_op_threads=threads)
+    infer_pytorch.warmup(infer_pytorch.get_backend())
+
+    rows = []
+    for batch_size in batch_sizes:
+        paths = itertools.cycle(image_paths)
+
+        def run_once():
+            chunk = [next(paths) for _ in range(batch_size)]
+            arrays = [infer_pytorch.preprocess_bytes(infer_pytorch.read_image_bytes(path)) for path in chunk]
+            infer_pytorch.predict_batch(arrays)
+
+        for _ in range(warmup):
+            run_once()
+        timings = []
+        start_all = time.perf_counter()
+        for _ in range(runs):
+            start = time.perf_counter()
+            run_once()
+            timings.append((time.perf_counter() - start) * 1000.0)
+        elapsed = time.perf_counter() - start_all
+
+        row = {"threads": threads, "batchSize": batch_size, **summarize(timings, runs * batch_size, elapsed)}
+        # 峰值 RSS 为进程启动以来的最大值（批大小从小到大测试，对应到该批大小为止的峰值）
+        row["peakRssMb"] = _max_rss_mb(resource.getrusage(resource.RUSAGE_SELF))
+        rows.append(row)
+    return rows
+
+
+def _run_inprocess_worker(image_paths, threads: int, args):
+    command = [
+        sys.executable,
+        os.path.abspath(__file__),
+        "inprocess",
+        "--threads",
+        str(threads),
+        "--batch-sizes",
+        ",".join(str(size) for size in args.batch_sizes),
+        "--runs",
+        str(args.runs),
+        "--warmup",
+        str(args.warmup),
+        "--images",
+        *image_paths,
+    ]
+    if args.backend:
+        command += ["--backend", args.backend]
+    if args.decoder:
+        command += ["--decoder", args.decoder]
+    completed = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    line = next((line for line in reversed(completed.stdout.splitlines()) if line.startswith("{")), None)
+    if completed.returncode != 0 or line is None:
+        message = completed.stderr.strip().splitlines()[-1:] or [f"退出码 {completed.returncode}"]
+        raise RuntimeError(f"进程内测试失败（threads={threads}）: {message[0]}")
+    result = json.loads(line)
+    if "error" in result:
+        raise RuntimeError(result["error"])
+    return result["rows"]
+
+
+def cpu_model():
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def package_version(name: str):
+    from importlib import metadata
+
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def environment(backend: str = None):
+    """
+    影响性能的环境信息，compare 时据此提示两次结果是否可比
+    """
+    import model_artifact
+    import model_store
+    from prefork import available_cores
+
+    model_path = model_artifact.resnet_files()[0]
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu": cpu_model(),
+        "cores": len(available_cores()),
+        "torch": package_version("torch"),
+        "pillow": package_version("pillow"),
+        "backend": backend or os.environ.get("FISH_INFER_BACKEND", "pytorch"),
+        "decoder": os.environ.get("FISH_DECODER", "pil"),
+        "modelVersion": model_store.current_version(),
+        "modelFile": model_store.file_identity(model_path),
+    }
+
+
+def run_suite(args):
+    from cpu_profile import thread_candidates
+    from prefork import available_cores
+
+    resolutions = [item.strip() for item in args.resolutions.split(",") if item.strip()]
+    threads = parse_ints(args.threads) if args.threads else thread_candidates(len(available_cores()))
+    args.batch_sizes = parse_ints(args.batch_sizes)
+
+    print("=" * 60)
+    print("推理性能基准测试")
+    print("=" * 60)
+    images = ensure_images(resolutions)
+    print(f"[INFO] 合成图片: {', '.join(resolutions)}（{IMAGE_DIR}）")
+
+    results = []
+    if args.cli_runs > 0:
+        for resolution, path in images.items():
+            row = {"scenario": "cli", "resolution": resolution}
+            row.update(bench_cli(path, args.cli_runs, args.backend, args.decoder))
+            results.append(row)
+            print(
+                f"  单次调用 {resolution:>10s}  p50 {row['p50Ms']:9.1f} ms  p95 {row['p95Ms']:9.1f} ms  "
+                f"峰值 RSS {row['peakRssMb']:7.1f} MB  阶段 {row['stagesMs']}",
+                flush=True,
+            )
+
+    for count in threads:
+        for row in _run_inprocess_worker(list(images.values()), count, args):
+            row = {"scenario": "inprocess", "resolution": "mixed", **row}
+            results.append(row)
+            print(
+                f"  进程内 threads={row['threads']:<3d} batch={row['batchSize']:<3d} p50 {row['p50Ms']:8.1f} ms  "
+                f"p95 {row['p95Ms']:8.1f} ms  p99 {row['p99Ms']:8.1f} ms  {row['imagesPerSecond']:7.2f} 张/秒  "
+                f"峰值 RSS {row['peakRssMb']:7.1f} MB",
+                flush=True,
+            )
+
+    return {
+        "createdAt": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "environment": environment(args.backend),
+        "config": {
+            "resolutions": resolutions,
+            "threads": threads,
+            "batchSizes": args.batch_sizes,
+            "runs": args.runs,
+            "warmup": args.warmup,
+            "cliRuns": args.cli_runs,
+            "imageSeed": IMAGE_SEED,
+            "backend": args.backend,
+            "decoder": args.decoder,
+        },
+        "results": results,
+    }
+
+
+def result_key(row: dict):
+    return (row["scenario"], row["resolution"], row.get("threads"), row.get("batchSize"))
+
+
+def describe(key):
+    scenario, resolution, threads, batch_size = key
+    if scenario == "cli":
+        return f"单次调用 {resolution}"
+    return f"进程内 threads={threads} batch={batch_size}"
+
+
+def compare_results(baseline: dict, current: dict, tolerance: float, min_delta_ms: float):
+    """
+    返回 (回退列表, 对比行)；每行为 (项目, 指标, 基线值, 当前值, 变化比例, 是否回退)
+    """
+    baseline_rows = {result_key(row): row for row in baseline["results"]}
+    rows, regressions = [], []
+    for row in current["results"]:
+        key = result_key(row)
+        base = baseline_rows.get(key)
+        if base is None:
+            continue
+        for metric in HIGHER_IS_WORSE + LOWER_IS_WORSE:
+            if metric not in base or metric not in row or not base[metric]:
+                continue
+            old, new = float(base[metric]), float(row[metric])
+            change = (new - old) / old
+            if metric in HIGHER_IS_WORSE:
+                regressed = change > tolerance
+                if metric.endswith("Ms") and new - old < min_delta_ms:
+                    regressed = False
+            else:
+                regressed = change < -tolerance
+            item = (describe(key), metric, old, new, change, regressed)
+            rows.append(item)
+            if regressed:
+                regressions.append(item)
+    return regressions, rows
+
+
+def environment_differences(baseline: dict, current: dict):
+    keys = ("cpu", "cores", "torch", "backend", "decoder", "modelFile")
+    old, new = baseline.get("environment", {}), current.get("environment", {})
+    return [(key, old.get(key), new.get(key)) for key in keys if old.get(key) != new.get(key)]
+
+
+def load_json(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_json(path: str, data: dict):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def apply_baseline_config(args, config: dict):
+    """
+    compare 未给出当前结果时，按基线的配置重新测试，保证测试项一一对应
+    """
+    args.resolutions = ",".join(config.get("resolutions", DEFAULT_RESOLUTIONS.split(",")))
+    args.threads = ",".join(str(item) for item in config.get("threads", [])) or None
+    args.batch_sizes = ",".join(str(item) for item in config.get("batchSizes", parse_ints(DEFAULT_BATCH_SIZES)))
+    args.runs = config.get("runs", args.runs)
+    args.warmup = config.get("warmup", args.warmup)
+    args.cli_runs = config.get("cliRuns", args.cli_runs)
+    args.backend = config.get("backend")
+    args.decoder = config.get("decoder")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="推理性能基准测试")
+    parser.add_argument(
+        "command",
+        choices=["run", "compare", "inprocess"],
+        help="run：运行测试；compare：与基线对比；inprocess：内部使用（单个线程数的进程内测试）",
+    )
+    parser.add_argument("files", nargs="*", help="compare 的基线结果与当前结果（省略当前结果时重新测试）")
+    parser.add_argument("--output", help="把测试结果写入 JSON 文件")
+    parser.add_argument("--resolutions", default=DEFAULT_RESOLUTIONS, help="合成图片的分辨率，逗号分隔")
+    parser.add_argument("--threads", default=None, help="进程内测试的线程数，逗号分隔（默认 1、2、4… 直到核心数）")
+    parser.add_argument("--batch-sizes", default=DEFAULT_BATCH_SIZES, help="进程内测试的批大小，逗号分隔")
+    parser.add_argument("--runs", type=int, default=20, help="进程内测试每个配置的批次数")
+    parser.add_argument("--warmup", type=int, default=3, help="进程内测试每个配置的预热批次数")
+    parser.add_argument("--cli-runs", type=int, default=5, help="单次调用每种分辨率的运行次数（0 表示跳过）")
+    parser.add_argument("--backend", default=None, help="推理后端（默认与 infer_pytorch.py 相同）")
+    parser.add_argument("--decoder", default=None, help="JPEG 解码器：pil / torchvision")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="判定回退的相对变化（0.15 表示 15%%）")
+    parser.add_argument("--min-delta-ms", type=float, default=DEFAULT_MIN_DELTA_MS, help="延迟增加小于该值时不算回退")
+    parser.add_argument("--images", nargs="*", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.decoder:
+        os.environ["FISH_DECODER"] = args.decoder
+
+    if args.command == "inprocess":
+        try:
+            rows = bench_inprocess(
+                args.images, int(args.threads), parse_ints(args.batch_sizes), args.runs, args.warmup, args.backend
+            )
+        except Exception as e:
+            print(json.dumps({"error": str(e)}, ensure_ascii=False), flush=True)
+            sys.exit(1)
+        print(json.dumps({"rows": rows}), flush=True)
+        return
+
+    if args.command == "run":
+        try:
+            report = run_suite(args)
+        except (FileNotFoundError, RuntimeError, ValueError) as e:
+            print(f"[ERROR] {e}")
+            sys.exit(1)
+        if args.output:
+            write_json(args.output, report)
+            print(f"[OK] 结果已写入: {os.path.abspath(args.output)}")
+        return
+
+    if not args.files or len(args.files) > 2:
+        parser.error("compare 需要基线结果文件，以及可选的当前结果文件")
+    baseline = load_json(args.files[0])
+    if len(args.files) == 2:
+        current = load_json(args.files[1])
+    else:
+        apply_baseline_config(args, baseline.get("config", {}))
+        try:
+            current = run_suite(args)
+        except (FileNotFoundError, RuntimeError, ValueError) as e:
+            print(f"[ERROR] {e}")
+            sys.exit(1)
+        if args.output:
+            write_json(args.output, current)
+
+    for key, old, new in environment_differences(baseline, current):
+        print(f"[WARN] 测试环境不同：{key} {old} -> {new}，对比仅供参考")
+
+    regressions, rows = compare_results(baseline, current, args.tolerance, args.min_delta_ms)
+    print()
+    print(f"{'项目':<28s} {'指标':<16s} {'基线':>10s} {'当前':>10s} {'变化':>8s}")
+    for name, metric, old, new, change, regressed in rows:
+        marker = "  <-- 回退" if regressed else ""
+        print(f"{name:<28s} {metric:<16s} {old:10.2f} {new:10.2f} {change:+8.1%}{marker}")
+
+    print()
+    if regressions:
+        print(f"[WARN] {len(regressions)} 项指标回退超过 {args.tolerance:.0%}")
+        sys.exit(1)
+    print(f"[OK] 没有超过 {args.tolerance:.0%} 的回退")
+
+
+if __name__ == "__main__":
+    main()
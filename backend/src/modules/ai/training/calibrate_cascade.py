@@ -0,0 +1,205 @@
+"""
+级联推理阈值校准
+
+用法：
+    python train_pytorch.py --arch mobilenet_v3_small   # 先训练并导出小模型
+    python calibrate_cascade.py                         # 默认允许准确率比 ResNet18 低 0.5 个百分点
+    python calibrate_cascade.py --max-accuracy-drop 0   # 不允许任何准确率损失
+    python calibrate_cascade.py --force                 # 即使级联不能降低延迟也写入配置
+
+流程：
+1. 用与训练相同的随机种子划分出验证集；
+2. 小模型（MobileNetV3-Small）与 ResNet18 分别给出验证集上的预测；
+3. 遍历置信度阈值：小模型 top-1 置信度 >= 阈值时采用小模型，否则升级到 ResNet18，
+   计算级联准确率与升级比例；
+4. 测量两个模型的单张图片 p50 延迟，估算级联的平均延迟与节省比例；
+5. 选出满足准确率要求、升级比例最低的阈值，写入 cascade.json 并发布为新的模型版本
+   （见 model_store.py；infer_pytorch.py --cascade 启动时读取，常驻进程会自动加载新版本）。
+   没有阈值满足准确率要求，或选出的阈值预计不能降低延迟时（小模型不够准，几乎每张都要升级），
+   级联只会比单独使用 ResNet18 更慢，此时不写入配置，除非指定 --force。
+"""
+
+import argparse
+import json
+import os
+import time
+
+
+DEFAULT_MAX_ACCURACY_DROP = 0.005
+
+
+def collect_predictions(model, dataloader):
+    """
+    返回 (概率 [N, C], 标签 [N])
+    """
+    import numpy as np
+    import torch
+
+    probs, labels = [], []
+    with torch.no_grad():
+        for inputs, targets in dataloader:
+            probs.append(torch.softmax(model(inputs), dim=1).numpy())
+            labels.append(targets.numpy())
+    return np.concatenate(probs), np.concatenate(labels)
+
+
+def sweep_thresholds(student_probs, teacher_probs, labels, thresholds):
+    """
+    每个阈值下的级联准确率与升级比例
+    """
+    import numpy as np
+
+    student_conf = student_probs.max(axis=1)
+    student_correct = student_probs.argmax(axis=1) == labels
+    teacher_correct = teacher_probs.argmax(axis=1) == labels
+
+    rows = []
+    for threshold in thresholds:
+        escalate = student_conf < threshold
+        correct = np.where(escalate, teacher_correct, student_correct)
+        rows.append(
+            {
+                "threshold": round(float(threshold), 4),
+                "accuracy": float(correct.mean()),
+                "escalationRate": float(escalate.mean()),
+            }
+        )
+    return rows
+
+
+def choose_threshold(rows, teacher_accuracy: float, max_accuracy_drop: float):
+    """
+    在准确率不低于 ResNet18 - max_accuracy_drop 的阈值中，选升级比例最低的，返回 (行, 是否满足要求)
+    都不满足时返回阈值最高的一行（几乎全部升级）与 False
+    """
+    candidates = [row for row in rows if row["accuracy"] >= teacher_accuracy - max_accuracy_drop]
+    if not candidates:
+        return max(rows, key=lambda row: row["threshold"]), False
+    return min(candidates, key=lambda row: (row["escalationRate"], -row["accuracy"])), True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="校准级联推理的置信度阈值")
+    parser.add_argument(
+        "--max-accuracy-drop",
+        type=float,
+        default=DEFAULT_MAX_ACCURACY_DROP,
+        help="相对 ResNet18 允许的最大准确率下降（0.005 表示 0.5 个百分点）",
+    )
+    parser.add_argument("--latency-runs", type=int, default=50, help="测量单张图片延迟的前向次数")
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="没有阈值满足准确率要求或预计不能降低延迟时，仍然写入 cascade.json",
+    )
+    args = parser.parse_args()
+
+    import numpy as np
+
+    import model_store
+    from infer_pytorch import CASCADE_CONFIG_PATH, STUDENT_TORCHSCRIPT_PATH, load_model, load_torchscript
+    from quantize_model import measure_latency
+    from train_pytorch import DATA_DIR, SEED, create_dataloaders, set_seed
+
+    # 两个模型与写入的配置都基于同一个版本目录
+    model_dir = model_store.current_dir()
+    student_path = model_store.model_file(STUDENT_TORCHSCRIPT_PATH, model_dir)
+    if not os.path.isfile(student_path):
+        print(f"[ERROR] 小模型不存在: {student_path}")
+        print("        请先运行 python train_pytorch.py --arch mobilenet_v3_small")
+        return
+
+    print("=" * 60)
+    print("级联推理阈值校准（MobileNetV3-Small -> ResNet18）")
+    print("=" * 60)
+
+    # 与训练时相同的随机种子，保证验证集划分一致
+    set_seed(SEED)
+    _, val_loader, _, _ = create_dataloaders(DATA_DIR)
+    teacher, teacher_idx_to_class = load_model(model_dir)
+    student, student_idx_to_class, _ = load_torchscript(student_path)
+    if student_idx_to_class != teacher_idx_to_class:
+        print("[ERROR] 小模型与 ResNet18 的类别映射不一致，请用同一份数据集重新训练")
+        return
+
+    student_probs, labels = collect_predictions(student, val_loader)
+    teacher_probs, _ = collect_predictions(teacher, val_loader)
+    if len(labels) == 0:
+        print("[ERROR] 验证集为空")
+        return
+
+    student_accuracy = float((student_probs.argmax(axis=1) == labels).mean())
+    teacher_accuracy = float((teacher_probs.argmax(axis=1) == labels).mean())
+    rows = sweep_thresholds(student_probs, teacher_probs, labels, np.arange(0.30, 1.0001, 0.01))
+    best, meets_accuracy = choose_threshold(rows, teacher_accuracy, args.max_accuracy_drop)
+
+    student_p50, _ = measure_latency(student, args.latency_runs)
+    teacher_p50, _ = measure_latency(teacher, args.latency_runs)
+    for row in rows:
+        row["expectedMs"] = student_p50 + row["escalationRate"] * teacher_p50
+        row["latencySaving"] = 1.0 - row["expectedMs"] / teacher_p50 if teacher_p50 > 0 else 0.0
+
+    print(f"验证集: {len(labels)} 张")
+    print(f"MobileNetV3-Small 准确率: {student_accuracy:.4f}, p50 {student_p50:.2f} ms")
+    print(f"ResNet18          准确率: {teacher_accuracy:.4f}, p50 {teacher_p50:.2f} ms")
+    print()
+    print(f"{'阈值':>6s} {'级联准确率':>10s} {'升级比例':>8s} {'预计延迟(ms)':>12s} {'节省':>7s}")
+    for row in rows[::5]:
+        print(
+            f"{row['threshold']:6.2f} {row['accuracy']:10.4f} {row['escalationRate']:8.2%} "
+            f"{row['expectedMs']:12.2f} {row['latencySaving']:7.2%}"
+        )
+
+    print()
+    problems = []
+    if not meets_accuracy:
+        problems.append(
+            f"没有阈值能让级联准确率不低于 ResNet18 - {args.max_accuracy_drop}（{teacher_accuracy - args.max_accuracy_drop:.4f}）"
+        )
+    if best["latencySaving"] <= 0:
+        problems.append(
+            f"阈值 {best['threshold']:.2f} 的升级比例为 {best['escalationRate']:.2%}，"
+            f"预计延迟节省 {best['latencySaving']:.2%}，级联比单独使用 ResNet18 更慢"
+        )
+    if problems:
+        level = "[WARN]" if args.force else "[ERROR]"
+        for problem in problems:
+            print(f"{level} {problem}")
+        if not args.force:
+            print("        未写入 cascade.json，当前版本保持不变；可提高小模型的准确率后重新校准，")
+            print("        或使用 --force 强制写入")
+            return
+
+    config = {
+        "threshold": best["threshold"],
+        "student": os.path.basename(STUDENT_TORCHSCRIPT_PATH),
+        "teacher": "resnet18",
+        "valImages": int(len(labels)),
+        "maxAccuracyDrop": args.max_accuracy_drop,
+        "studentAccuracy": student_accuracy,
+        "teacherAccuracy": teacher_accuracy,
+        "cascadeAccuracy": best["accuracy"],
+        "escalationRate": best["escalationRate"],
+        "studentP50Ms": round(student_p50, 3),
+        "teacherP50Ms": round(teacher_p50, 3),
+        "expectedP50Ms": round(best["expectedMs"], 3),
+        "latencySaving": round(best["latencySaving"], 4),
+        "calibratedAt": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    if model_store.current_dir() != model_dir:
+        print("[ERROR] 校准期间模型版本发生了变化，请重新运行")
+        return
+    with model_store.new_version(skip=[CASCADE_CONFIG_PATH], note="calibrate_cascade.py") as staging:
+        with open(model_store.model_file(CASCADE_CONFIG_PATH, staging), "w", encoding="utf-8") as f:
+            json.dump(config, f, ensure_ascii=False, indent=2)
+
+    print(
+        f"[OK] 选定阈值 {best['threshold']:.2f}：级联准确率 {best['accuracy']:.4f}，"
+        f"升级比例 {best['escalationRate']:.2%}，预计延迟节省 {best['latencySaving']:.2%}"
+    )
+    print(f"     配置已写入模型版本: {model_store.current_version()}")
+    print("     推理时使用: python infer_pytorch.py --cascade --image xxx.jpg")
+
+
+if __name__ == "__main__":
+    main()
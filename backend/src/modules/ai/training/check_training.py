@@ -6,9 +6,12 @@ import os
 import time
 from pathlib import Path
 
-MODEL_DIR = "./models"
-MODEL_PATH = os.path.join(MODEL_DIR, "fish_classifier_resnet18.pth")
-CLASS_INDEX_PATH = os.path.join(MODEL_DIR, "class_to_idx.pt")
+import model_artifact
+
+# 当前模型版本中的文件（没有版本目录时为 ./models 下的文件）：单文件模型中已包含类别映射
+MODEL_FILES = model_artifact.resnet_files()
+MODEL_PATH = MODEL_FILES[0]
+CLASS_INDEX_PATH = MODEL_FILES[-1]
 
 def check_training_status():
     """检查训练状态"""
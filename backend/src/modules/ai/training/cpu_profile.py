@@ -0,0 +1,277 @@
+"""
+CPU 推理执行配置（线程数、内存布局、推理模式等）
+
+PyTorch 默认让 intra-op 线程占满所有核心，同一节点上的多个识别进程会互相争抢；
+默认的 NCHW 布局与 torch.no_grad 也不一定是本机最快的组合。本模块提供可配置的执行配置：
+
+- intra_op_threads / inter_op_threads：线程数（null 表示使用 PyTorch 默认值）
+- channels_last：模型与输入使用 NHWC 内存布局
+- onednn_fusion：开启 TorchScript 的 oneDNN Graph 融合（仅 torchscript / pytorch-int8 后端有效）
+- inference_mode：使用 torch.inference_mode 代替 torch.no_grad
+- compile：对 eager 模型使用 torch.compile（首次前向需要较长编译时间，适合常驻服务）
+
+配置来源（后者覆盖前者）：默认值 -> ./models/cpu_profile.json 中对应后端的配置
+-> 环境变量 FISH_INTRA_OP_THREADS / FISH_INTER_OP_THREADS / FISH_CHANNELS_LAST /
+   FISH_ONEDNN_FUSION / FISH_INFERENCE_MODE / FISH_TORCH_COMPILE
+
+自动调优（在部署机器上运行一次，把最快的配置写入 cpu_profile.json）：
+    python cpu_profile.py autotune --backend pytorch
+    python cpu_profile.py autotune --backend torchscript --batch-size 8
+    python cpu_profile.py show --backend pytorch
+"""
+
+import argparse
+import itertools
+import json
+import os
+import time
+
+
+PROFILE_PATH = os.path.join("./models", "cpu_profile.json")
+
+DEFAULT_PROFILE = {
+    "intra_op_threads": None,
+    "inter_op_threads": None,
+    "channels_last": False,
+    "onednn_fusion": False,
+    "inference_mode": True,
+    "compile": False,
+}
+
+ENV_OVERRIDES = {
+    "intra_op_threads": "FISH_INTRA_OP_THREADS",
+    "inter_op_threads": "FISH_INTER_OP_THREADS",
+    "channels_last": "FISH_CHANNELS_LAST",
+    "onednn_fusion": "FISH_ONEDNN_FUSION",
+    "inference_mode": "FISH_INFERENCE_MODE",
+    "compile": "FISH_TORCH_COMPILE",
+}
+
+
+def _parse_env(key: str, value: str):
+    if key.endswith("_threads"):
+        return int(value) if value.strip() else None
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def read_profiles(path: str = PROFILE_PATH):
+    """
+    读取配置文件，返回 {后端名: 配置}；文件不存在时返回空字典
+    """
+    if not path or not os.path.isfile(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_profile(backend: str, path: str = PROFILE_PATH, overrides: dict = None):
+    """
+    合并默认值、配置文件与环境变量，得到某个后端的执行配置
+    """
+    profile = dict(DEFAULT_PROFILE)
+    saved = read_profiles(path).get(backend, {})
+    profile.update({key: value for key, value in saved.items() if key in DEFAULT_PROFILE})
+
+    for key, env_name in ENV_OVERRIDES.items():
+        value = os.environ.get(env_name)
+        if value is not None:
+            profile[key] = _parse_env(key, value)
+
+    if overrides:
+        profile.update({key: value for key, value in overrides.items() if value is not None})
+    return profile
+
+
+def save_profile(backend: str, profile: dict, path: str = PROFILE_PATH, extra: dict = None):
+    """
+    写入（或更新）某个后端的配置，其他后端的配置保持不变；先写临时文件再替换
+    """
+    profiles = read_profiles(path)
+    entry = {key: profile[key] for key in DEFAULT_PROFILE}
+    if extra:
+        entry.update(extra)
+    profiles[backend] = entry
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(profiles, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def apply_threads(torch, profile: dict):
+    """
+    设置线程数与 oneDNN 融合开关，需在首次前向之前调用
+    """
+    if profile["intra_op_threads"]:
+        torch.set_num_threads(profile["intra_op_threads"])
+    if profile["inter_op_threads"]:
+        try:
+            torch.set_num_interop_threads(profile["inter_op_threads"])
+        except RuntimeError:
+            # inter-op 线程池只能设置一次，且必须在任何并行任务开始之前
+            pass
+    torch.jit.enable_onednn_fusion(bool(profile["onednn_fusion"]))
+
+
+def prepare_model(torch, model, profile: dict, allow_compile: bool = True):
+    """
+    按配置转换模型内存布局，并可选地使用 torch.compile
+    （TorchScript 模型不支持 torch.compile，传 allow_compile=False）
+    """
+    if profile["channels_last"]:
+        model = model.to(memory_format=torch.channels_last)
+    if profile["compile"] and allow_compile:
+        model = torch.compile(model)
+    return model
+
+
+def prepare_input(torch, tensor, profile: dict):
+    if profile["channels_last"]:
+        return tensor.contiguous(memory_format=torch.channels_last)
+    return tensor
+
+
+def grad_mode(torch, profile: dict):
+    """
+    推理时使用的上下文：inference_mode 或 no_grad
+    """
+    return torch.inference_mode() if profile["inference_mode"] else torch.no_grad()
+
+
+def measure(backend, batch_size: int, runs: int, warmup: int = 3):
+    """
+    返回 (p50, p90) 单批前向延迟（毫秒）
+    """
+    import numpy as np
+
+    from infer_pytorch import IMG_SIZE
+
+    rng = np.random.default_rng(0)
+    batch = rng.standard_normal((batch_size, 3, IMG_SIZE, IMG_SIZE)).astype(np.float32)
+    for _ in range(warmup):
+        backend.predict_probs(batch)
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        backend.predict_probs(batch)
+        timings.append((time.perf_counter() - start) * 1000.0)
+    return float(np.percentile(timings, 50)), float(np.percentile(timings, 90))
+
+
+def thread_candidates(max_threads: int):
+    counts = [1]
+    while counts[-1] * 2 < max_threads:
+        counts.append(counts[-1] * 2)
+    if max_threads not in counts:
+        counts.append(max_threads)
+    return counts
+
+
+def autotune(
+    backend_name: str,
+    batch_size: int = 1,
+    runs: int = 30,
+    max_threads: int = None,
+    try_compile: bool = False,
+    path: str = PROFILE_PATH,
+):
+    """
+    在本机上遍历线程数 / channels_last / inference_mode（torchscript 另加 oneDNN 融合、
+    eager 可选 torch.compile），按 p50 延迟选出最快的组合并写入配置文件
+    """
+    import torch
+
+    from infer_pytorch import BACKENDS, OnnxBackend
+
+    if backend_name not in BACKENDS or backend_name == OnnxBackend.name:
+        choices = ", ".join(name for name in BACKENDS if name != OnnxBackend.name)
+        raise ValueError(f"自动调优只支持 PyTorch 后端，可选: {choices}")
+    backend_cls = BACKENDS[backend_name]
+    is_eager = backend_name == "pytorch"
+
+    # inter-op 线程池只能设置一次；单个模型的前向没有 inter-op 并行，固定为 1
+    torch.set_num_interop_threads(1)
+
+    threads = thread_candidates(max_threads or os.cpu_count() or 1)
+    fusion_options = (False,) if is_eager else (False, True)
+    compile_options = (False, True) if (is_eager and try_compile) else (False,)
+
+    results = []
+    for intra, channels_last, inference_mode, fusion, compiled in itertools.product(
+        threads, (False, True), (True, False), fusion_options, compile_options
+    ):
+        profile = dict(
+            DEFAULT_PROFILE,
+            intra_op_threads=intra,
+            inter_op_threads=1,
+            channels_last=channels_last,
+            onednn_fusion=fusion,
+            inference_mode=inference_mode,
+            compile=compiled,
+        )
+        backend = backend_cls(profile=profile)
+        p50, p90 = measure(backend, batch_size, runs)
+        results.append((p50, p90, profile))
+        print(
+            f"  threads={intra:<3d} channels_last={channels_last!s:<5} inference_mode={inference_mode!s:<5} "
+            f"onednn={fusion!s:<5} compile={compiled!s:<5} p50={p50:8.2f}ms p90={p90:8.2f}ms",
+            flush=True,
+        )
+
+    results.sort(key=lambda item: item[0])
+    p50, p90, best = results[0]
+    save_profile(
+        backend_name,
+        best,
+        path,
+        extra={"tuned": {"batch_size": batch_size, "p50_ms": round(p50, 3), "p90_ms": round(p90, 3)}},
+    )
+    return best, p50, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU 推理执行配置")
+    parser.add_argument(
+        "command", choices=["autotune", "show"], help="autotune：本机调优并写入配置；show：查看生效配置"
+    )
+    parser.add_argument("--backend", default="pytorch", help="推理后端：pytorch / torchscript / pytorch-int8")
+    parser.add_argument("--profile", default=PROFILE_PATH, help="配置文件路径")
+    parser.add_argument(
+        "--batch-size", type=int, default=1, help="调优时的批大小（单次调用为 1，常驻服务可按常见批大小设置）"
+    )
+    parser.add_argument("--runs", type=int, default=30, help="每个组合的前向次数")
+    parser.add_argument(
+        "--max-threads",
+        type=int,
+        default=None,
+        help="调优的最大线程数（默认 CPU 核心数，多 worker 部署时应按单 worker 分到的核心数设置）",
+    )
+    parser.add_argument("--try-compile", action="store_true", help="同时尝试 torch.compile（仅 pytorch 后端，编译较慢）")
+    args = parser.parse_args()
+
+    if args.command == "show":
+        print(json.dumps(load_profile(args.backend, args.profile), ensure_ascii=False, indent=2))
+        return
+
+    print("=" * 60)
+    print(f"CPU 推理配置自动调优（后端: {args.backend}, 批大小: {args.batch_size}）")
+    print("=" * 60)
+    try:
+        best, p50, _ = autotune(
+            args.backend, args.batch_size, args.runs, args.max_threads, args.try_compile, args.profile
+        )
+    except (FileNotFoundError, ValueError) as e:
+        print(f"[ERROR] {e}")
+        return
+
+    print()
+    print(f"[OK] 最快配置（p50 = {p50:.2f} ms）已写入: {os.path.abspath(args.profile)}")
+    print(json.dumps(best, ensure_ascii=False, indent=2))
+    print("     infer_pytorch.py 启动时会自动读取该配置")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,107 @@
 """
 创建类别索引文件
+
+按数据目录（ImageFolder 的类别顺序）重新生成类别映射，并发布为新的模型版本：
+- 当前版本有单文件模型（fish_classifier_resnet18.safetensors，见 model_artifact.py）时，
+  推理只读取其中内嵌的类别映射，因此重新保存该文件（权重不变，只替换类别映射）；
+  内嵌了旧类别映射的导出模型（TorchScript / ONNX / INT8）不再继承，需要重新导出
+- 旧格式（.pth + class_to_idx.pt）时写入 class_to_idx.pt
+类别数必须与模型的输出数一致，否则拒绝更新。
 """
 
 import os
-import torch
-from torchvision import datasets
+
+import model_artifact
+import model_store
 
 DATA_DIR = "./data/fish_images"
 MODEL_DIR = "./models"
 CLASS_INDEX_PATH = os.path.join(MODEL_DIR, "class_to_idx.pt")
+MODEL_ARTIFACT_PATH = os.path.join(MODEL_DIR, model_artifact.RESNET_ARTIFACT)
+STUDENT_ARTIFACT_PATH = os.path.join(MODEL_DIR, model_artifact.STUDENT_ARTIFACT)
+# 导出时内嵌了类别映射的文件，类别映射变化后已过时
+EXPORTED_MODEL_PATHS = (
+    os.path.join(MODEL_DIR, "fish_classifier_resnet18_scripted.pt"),
+    os.path.join(MODEL_DIR, "fish_classifier_resnet18.onnx"),
+    os.path.join(MODEL_DIR, "fish_classifier_resnet18_int8.pt"),
+)
+# 单文件模型元数据中由 save_artifact 生成的字段，其余字段（如 convertedFrom）重新保存时保留
+ARTIFACT_FIELDS = (
+    "format",
+    "formatVersion",
+    "arch",
+    "numClasses",
+    "classToIdx",
+    "preprocess",
+    "metrics",
+    "createdAt",
+    "sha256",
+    "dataBytes",
+)
+
+
+def rewrite_artifact(source: str, target: str, class_to_idx: dict):
+    """
+    以新的类别映射重新保存单文件模型（权重、训练指标与其余元数据不变）
+    """
+    state_dict, meta = model_artifact.load_artifact(source)
+    extra = {key: value for key, value in meta.items() if key not in ARTIFACT_FIELDS}
+    extra["classIndexFrom"] = "create_class_index.py"
+    return model_artifact.save_artifact(target, state_dict, meta["arch"], class_to_idx, meta.get("metrics"), extra)
+
 
 def create_class_index():
-    """创建类别索引文件"""
+    """创建类别索引文件，返回发布的版本名；没有发布时返回 None"""
     print("创建类别索引文件...")
-    
+
     if not os.path.exists(DATA_DIR):
         print(f"[ERROR] 数据目录不存在: {DATA_DIR}")
-        return
-    
+        return None
+
+    import torch
+    from torchvision import datasets
+
     # 使用ImageFolder加载数据集以获取类别映射
     dataset = datasets.ImageFolder(DATA_DIR)
     class_to_idx = dataset.class_to_idx
-    
-    os.makedirs(MODEL_DIR, exist_ok=True)
-    torch.save(class_to_idx, CLASS_INDEX_PATH)
-    
-    print(f"[OK] 类别索引文件已创建: {CLASS_INDEX_PATH}")
+
+    model_dir = model_store.current_dir()
+    artifact_path = model_store.model_file(MODEL_ARTIFACT_PATH, model_dir)
+    if not os.path.isfile(artifact_path):
+        # 旧格式：类别映射单独保存在 class_to_idx.pt
+        with model_store.new_version(skip=[CLASS_INDEX_PATH], note="create_class_index.py") as staging:
+            torch.save(class_to_idx, model_store.model_file(CLASS_INDEX_PATH, staging))
+    else:
+        meta = model_artifact.read_metadata(artifact_path)
+        if meta["numClasses"] != len(class_to_idx):
+            print(
+                f"[ERROR] 数据目录有 {len(class_to_idx)} 个类别，当前模型输出 {meta['numClasses']} 个类别，"
+                "类别数变化后需要重新训练（python train_pytorch.py）"
+            )
+            return None
+        if meta["classToIdx"] == class_to_idx:
+            print(f"[OK] 当前模型的类别映射已与数据目录一致，无需更新（版本 {model_store.current_version()}）")
+            return None
+
+        # 推理只读取单文件模型中的类别映射；旧的 class_to_idx.pt 与内嵌旧映射的导出模型不再继承
+        skip = [MODEL_ARTIFACT_PATH, CLASS_INDEX_PATH, *EXPORTED_MODEL_PATHS]
+        with model_store.new_version(skip=skip, note="create_class_index.py") as staging:
+            rewrite_artifact(artifact_path, model_store.model_file(MODEL_ARTIFACT_PATH, staging), class_to_idx)
+
+        dropped = [os.path.basename(path) for path in EXPORTED_MODEL_PATHS
+                   if os.path.isfile(model_store.model_file(path, model_dir))]
+        if dropped:
+            print(f"[WARN] 以下导出模型内嵌旧的类别映射，新版本中已移除: {', '.join(dropped)}")
+            print("       如需使用，重新运行 python export_model.py / python quantize_model.py")
+        student_path = model_store.model_file(STUDENT_ARTIFACT_PATH, model_dir)
+        if os.path.isfile(student_path) and model_artifact.read_metadata(student_path)["classToIdx"] != class_to_idx:
+            print("[WARN] 级联推理的小模型类别映射与新的映射不一致，请重新训练: python train_pytorch.py --arch mobilenet_v3_small")
+
+    version = model_store.current_version()
+    print(f"[OK] 类别索引已更新，模型版本: {version}")
     print(f"类别数: {len(class_to_idx)}")
     print(f"类别: {list(class_to_idx.keys())}")
+    return version
 
 if __name__ == "__main__":
     create_class_index()
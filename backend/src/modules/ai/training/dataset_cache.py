@@ -0,0 +1,264 @@
+"""
+训练集预解码缓存（train_pytorch.py --dataset-cache）
+
+ImageFolder 每个 epoch 都要重新打开、全尺寸解码每一张图片再缩放到 224，CPU 机器上瓶颈在 DataLoader 而不是模型。
+这里一次性把数据集解码并缩放到 CACHE_SIZE x CACHE_SIZE，保存为 uint8 数组文件，训练时直接从内存映射中取：
+
+    <缓存目录>/images.npy      [N, 256, 256, 3] uint8（np.load(mmap_mode="r") 映射，不读入内存）
+    <缓存目录>/labels.npy      [N] int64
+    <缓存目录>/manifest.json   类别映射、缓存尺寸，以及每个文件的相对路径、大小、修改时间
+
+- 图片顺序与 ImageFolder 完全一致，同样的随机种子划分出的训练 / 验证集不变
+- 数据目录中任何文件的增删、大小或修改时间变化都会使缓存失效，下一次训练时自动重建
+- 训练集：随机裁剪 224 + 水平翻转；验证集：缩放到 224（与推理的整图缩放一致）
+  RandomRotation / ColorJitter 在缓存模式下不使用
+- 内存占用与数据集大小无关：样本按需从映射中读取，页缓存由操作系统管理
+
+用法：
+    python dataset_cache.py build             # 预先构建（训练时也会自动构建）
+    python dataset_cache.py status            # 查看缓存是否与数据目录一致
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from image_preprocess import IMG_SIZE, decode_pixels, normalize_into
+
+
+DATA_DIR = "./data/fish_images"
+CACHE_DIR = "./data/fish_images_cache"
+CACHE_SIZE = 256
+MANIFEST_NAME = "manifest.json"
+IMAGES_NAME = "images.npy"
+LABELS_NAME = "labels.npy"
+MANIFEST_VERSION = 1
+BUILD_THREADS = 4
+
+
+def scan_dataset(data_dir: str):
+    """
+    与 ImageFolder 相同的类别与文件顺序，返回 (classes, class_to_idx, [(路径, 类别编号)])
+    """
+    from torchvision.datasets.folder import IMG_EXTENSIONS, find_classes, make_dataset
+
+    classes, class_to_idx = find_classes(data_dir)
+    samples = make_dataset(data_dir, class_to_idx, extensions=IMG_EXTENSIONS)
+    return classes, class_to_idx, samples
+
+
+def file_entries(data_dir: str, samples):
+    """
+    每个文件的 [相对路径, 大小, 修改时间(ns), 类别编号]，用于判断缓存是否过期
+    """
+    entries = []
+    for path, label in samples:
+        stat = os.stat(path)
+        relpath = os.path.relpath(path, data_dir).replace(os.sep, "/")
+        entries.append([relpath, stat.st_size, stat.st_mtime_ns, label])
+    return entries
+
+
+def read_manifest(cache_dir: str):
+    try:
+        with open(os.path.join(cache_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_fresh(manifest: dict, entries, size: int):
+    return (
+        manifest is not None
+        and manifest.get("version") == MANIFEST_VERSION
+        and manifest.get("size") == size
+        and manifest.get("files") == entries
+    )
+
+
+def _decode_into(images: np.ndarray, row: int, path: str, size: int):
+    with open(path, "rb") as f:
+        data = f.read()
+    try:
+        images[row] = decode_pixels(data, size)
+    except Exception as e:
+        raise RuntimeError(f"无法解码图片 {path}: {e}（可运行 python cleanup_dataset.py 清理）")
+
+
+def build_cache(
+    data_dir: str = DATA_DIR, cache_dir: str = CACHE_DIR, size: int = CACHE_SIZE, threads: int = BUILD_THREADS
+):
+    """
+    解码整个数据集写入缓存目录，返回 manifest
+    先写临时文件，全部完成后再替换，最后写 manifest，中途中断不会留下看似有效的缓存
+    """
+    classes, class_to_idx, samples = scan_dataset(data_dir)
+    if not samples:
+        raise RuntimeError(f"数据目录中没有图片: {data_dir}")
+    entries = file_entries(data_dir, samples)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest_path = os.path.join(cache_dir, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    suffix = f".{os.getpid()}.tmp"
+    images_path = os.path.join(cache_dir, IMAGES_NAME)
+    labels_path = os.path.join(cache_dir, LABELS_NAME)
+    shape = (len(samples), size, size, 3)
+    images = np.lib.format.open_memmap(images_path + suffix, mode="w+", dtype=np.uint8, shape=shape)
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=max(threads, 1), thread_name_prefix="cache-decode") as executor:
+            futures = [
+                executor.submit(_decode_into, images, row, path, size) for row, (path, _) in enumerate(samples)
+            ]
+            for future in futures:
+                future.result()
+        images.flush()
+        del images
+        np.save(labels_path + suffix, np.array([label for _, label in samples], dtype=np.int64))
+    except BaseException:
+        for path in (images_path + suffix, labels_path + suffix + ".npy"):
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+
+    os.replace(images_path + suffix, images_path)
+    # np.save 会自动补上 .npy 后缀
+    os.replace(labels_path + suffix + ".npy", labels_path)
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "size": size,
+        "count": len(samples),
+        "classes": classes,
+        "classToIdx": class_to_idx,
+        "builtAt": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "buildSeconds": round(time.perf_counter() - start, 2),
+        "files": entries,
+    }
+    tmp_path = manifest_path + suffix
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, manifest_path)
+    return manifest
+
+
+def ensure_cache(data_dir: str = DATA_DIR, cache_dir: str = CACHE_DIR, size: int = CACHE_SIZE):
+    """
+    缓存与数据目录一致时直接使用，否则重新构建；返回 (manifest, 是否重新构建)
+    """
+    _, _, samples = scan_dataset(data_dir)
+    manifest = read_manifest(cache_dir)
+    if is_fresh(manifest, file_entries(data_dir, samples), size):
+        return manifest, False
+    return build_cache(data_dir, cache_dir, size), True
+
+
+class CachedImageDataset:
+    """
+    从预解码缓存中读取样本的 Dataset，返回 ([3, 224, 224] 归一化张量, 类别编号)
+    train=True 时随机裁剪 + 水平翻转，否则整图缩放到 224
+    数组在第一次取样时才映射，DataLoader 的每个 worker 各自映射一次
+    """
+
+    def __init__(self, cache_dir: str = CACHE_DIR, train: bool = True, out_size: int = IMG_SIZE):
+        self.cache_dir = cache_dir
+        self.train = train
+        self.out_size = out_size
+        manifest = read_manifest(cache_dir)
+        if manifest is None:
+            raise RuntimeError(f"数据集缓存不存在: {cache_dir}，请先运行 python dataset_cache.py build")
+        self.classes = manifest["classes"]
+        self.class_to_idx = manifest["classToIdx"]
+        self.size = manifest["size"]
+        self._count = manifest["count"]
+        self._images = None
+        self._labels = None
+
+    def __len__(self):
+        return self._count
+
+    def _arrays(self):
+        if self._images is None:
+            self._images = np.load(os.path.join(self.cache_dir, IMAGES_NAME), mmap_mode="r")
+            self._labels = np.load(os.path.join(self.cache_dir, LABELS_NAME))
+        return self._images, self._labels
+
+    def __getstate__(self):
+        # 传给 DataLoader worker 时不携带已映射的数组
+        state = dict(self.__dict__)
+        state["_images"] = state["_labels"] = None
+        return state
+
+    def pixels(self, index: int):
+        """
+        [out_size, out_size, 3] 的 uint8 像素
+        """
+        images, _ = self._arrays()
+        image = images[index]
+        if self.train:
+            top, left = np.random.randint(0, self.size - self.out_size + 1, size=2)
+            image = image[top : top + self.out_size, left : left + self.out_size]
+            if np.random.rand() < 0.5:
+                image = image[:, ::-1]
+            return np.ascontiguousarray(image)
+        if self.size == self.out_size:
+            return np.asarray(image)
+        from PIL import Image
+
+        return np.asarray(Image.fromarray(np.asarray(image)).resize((self.out_size, self.out_size), Image.BILINEAR))
+
+    def __getitem__(self, index: int):
+        import torch
+
+        _, labels = self._arrays()
+        out = np.empty((3, self.out_size, self.out_size), dtype=np.float32)
+        normalize_into(self.pixels(index), out)
+        return torch.from_numpy(out), int(labels[index])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="训练集预解码缓存")
+    parser.add_argument("command", choices=["build", "status"])
+    parser.add_argument("--data-dir", default=DATA_DIR, help="按类别分组的图片目录")
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="缓存目录")
+    parser.add_argument("--size", type=int, default=CACHE_SIZE, help="缓存图片的边长（训练时从中随机裁剪 224）")
+    parser.add_argument("--threads", type=int, default=BUILD_THREADS, help="构建时并行解码的线程数")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.data_dir):
+        print(f"[ERROR] 数据目录不存在: {os.path.abspath(args.data_dir)}")
+        return
+    if args.size < IMG_SIZE:
+        parser.error(f"--size 不能小于 {IMG_SIZE}")
+
+    if args.command == "status":
+        _, _, samples = scan_dataset(args.data_dir)
+        manifest = read_manifest(args.cache_dir)
+        if manifest is None:
+            print(f"[INFO] 缓存不存在: {os.path.abspath(args.cache_dir)}")
+        elif is_fresh(manifest, file_entries(args.data_dir, samples), args.size):
+            print(f"[OK] 缓存有效: {manifest['count']} 张, {manifest['size']}px, 构建于 {manifest['builtAt']}")
+        else:
+            print(f"[WARN] 缓存已过期（缓存 {manifest['count']} 张，数据目录 {len(samples)} 张），下次训练时自动重建")
+        return
+
+    try:
+        manifest = build_cache(args.data_dir, args.cache_dir, args.size, args.threads)
+    except RuntimeError as e:
+        print(f"[ERROR] {e}")
+        return
+    size_mb = os.path.getsize(os.path.join(args.cache_dir, IMAGES_NAME)) / (1024 * 1024)
+    print(f"[OK] 已缓存 {manifest['count']} 张图片（{manifest['size']}px, {size_mb:.1f} MB），耗时 {manifest['buildSeconds']}s")
+    print(f"     缓存目录: {os.path.abspath(args.cache_dir)}")
+    print("     训练时使用: python train_pytorch.py --dataset-cache")
+
+
+if __name__ == "__main__":
+    main()
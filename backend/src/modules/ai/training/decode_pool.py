@@ -0,0 +1,217 @@
+"""
+批量推理的解码进程池与共享内存批次环
+
+线程池解码时 PIL 的部分工作与模型前向之后的整理都要持有 GIL，图片多时解码与前向仍会互相等待。
+这里把解码放到独立的进程中：
+- 父进程创建一块共享内存，划分为 slots 个批次槽，每个槽是一个 [batch_size, 3, 224, 224] 的 float32 缓冲区
+- 解码进程读取图片、解码并归一化后直接写入槽中对应的一行，只把少量元信息（错误、缓存键、各阶段耗时）传回父进程
+- 模型线程依次取出已填满的槽做前向；处理第 k 批时，解码进程已经在填第 k+1、k+2 批，
+  槽在模型线程处理完之后才会重新分配给新的一批
+
+利用率统计（见 stats()）用于按主机调整解码进程数：
+- decoderUtilization：解码进程忙碌时间 / (进程数 x 总时长)，接近 1 说明解码是瓶颈，可增加进程数
+- modelUtilization：模型线程处理批次（前向、整理与输出结果）的时间占比，接近 1 说明解码进程已经够用
+- modelWaitSeconds：模型线程等待解码完成的时间
+
+用法：
+    python infer_pytorch.py --dir uploads/ --decode-processes 3
+"""
+
+import multiprocessing
+import time
+from collections import deque
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import image_preprocess
+from image_preprocess import IMG_SIZE
+from inference_metrics import StageTimer, stage
+from result_cache import image_key
+
+
+DEFAULT_SLOTS = 3
+
+# 解码进程内的共享内存与批次环视图，见 _init_worker
+_worker_shm = None
+_worker_ring = None
+
+
+def _init_worker(shm_name: str, shape, decoder: str):
+    global _worker_shm, _worker_ring
+    # 子进程与父进程共用同一个 resource_tracker，共享内存只由父进程在 close() 中删除
+    _worker_shm = shared_memory.SharedMemory(name=shm_name)
+    _worker_ring = np.ndarray(shape, dtype=np.float32, buffer=_worker_shm.buf)
+    image_preprocess.set_decoder(decoder)
+
+
+def _decode_into(slot: int, row: int, image_path: str, cache_version: str = None):
+    """
+    解码进程中执行：读取并预处理一张图片，写入批次环的 [slot, row]
+    cache_version 不为空时同时计算结果缓存的键（图片内容哈希），由父进程查询缓存
+    """
+    start = time.perf_counter()
+    timer = StageTimer()
+    item = {"error": None, "key": None}
+    try:
+        with stage(timer, "read"):
+            with open(image_path, "rb") as f:
+                data = f.read()
+        if cache_version is not None:
+            with stage(timer, "cache"):
+                item["key"] = image_key(data, cache_version)
+        image_preprocess.preprocess_bytes(data, _worker_ring[slot, row], timer=timer)
+    except Exception as e:
+        item["error"] = str(e)
+    item["stages"] = timer.stages
+    item["busy"] = time.perf_counter() - start
+    return item
+
+
+class DecodePool:
+    """
+    processes 个解码进程 + slots 个批次槽的共享内存环
+    用 with 语句或 close() 释放进程与共享内存
+    """
+
+    def __init__(
+        self, processes: int, batch_size: int, slots: int = DEFAULT_SLOTS, decoder: str = None, metrics=None
+    ):
+        """
+        metrics 为 inference_metrics.InferenceMetrics 时，每批的忙碌 / 等待时间同时累计到 Prometheus 计数器
+        """
+        if processes < 1:
+            raise ValueError("解码进程数至少为 1")
+        if slots < 2:
+            raise ValueError("批次槽至少为 2 个，才能让解码与前向重叠")
+
+        self.processes = processes
+        self.batch_size = batch_size
+        self.slots = slots
+        self.metrics = metrics
+        shape = (slots, batch_size, 3, IMG_SIZE, IMG_SIZE)
+        self._shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * 4)
+        self.ring = np.ndarray(shape, dtype=np.float32, buffer=self._shm.buf)
+
+        # Linux 上 fork 启动，解码进程不需要重新导入；需在加载模型之前创建，子进程不继承 torch 线程池
+        method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+        context = multiprocessing.get_context(method)
+        self._pool = context.Pool(
+            processes,
+            initializer=_init_worker,
+            initargs=(self._shm.name, shape, decoder or image_preprocess._decoder),
+        )
+
+        self._images = 0
+        self._batches = 0
+        self._decoder_busy = 0.0
+        self._model_busy = 0.0
+        self._model_wait = 0.0
+        self._started = None
+        self._finished = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        if self._shm is not None:
+            self.ring = None
+            try:
+                self._shm.close()
+            except BufferError:
+                # 调用方仍持有某个批次的视图，映射随进程退出释放
+                pass
+            self._shm.unlink()
+            self._shm = None
+
+    def batches(self, image_paths, cache_version: str = None):
+        """
+        按输入顺序产出 (batch, items)：batch 为槽中已填好的 [N, 3, H, W] 视图，
+        items 为每张图片的 {"path", "error", "key", "timer"}（与 batch 的行一一对应）
+        batch 只在下一次迭代之前有效，之后该槽会被新的一批覆盖
+        """
+        self._started = time.perf_counter()
+        free = deque(range(self.slots))
+        inflight = deque()
+        chunk = []
+
+        def submit(paths):
+            slot = free.popleft()
+            results = [
+                self._pool.apply_async(_decode_into, (slot, row, path, cache_version))
+                for row, path in enumerate(paths)
+            ]
+            inflight.append((slot, paths, results))
+
+        def consume():
+            slot, paths, results = inflight.popleft()
+            start = time.perf_counter()
+            loaded = [result.get() for result in results]
+            wait = time.perf_counter() - start
+            busy = sum(item["busy"] for item in loaded)
+            self._model_wait += wait
+            self._decoder_busy += busy
+            if self.metrics is not None:
+                self.metrics.observe_pipeline(decoder_busy=busy, model_wait=wait)
+
+            items = []
+            for path, item in zip(paths, loaded):
+                timer = StageTimer()
+                for name, ms in item["stages"].items():
+                    timer.add(name, ms)
+                items.append({"path": path, "error": item["error"], "key": item["key"], "timer": timer})
+            self._images += len(items)
+            self._batches += 1
+            return slot, self.ring[slot, : len(items)], items
+
+        def run(slot, batch, items):
+            # 调用方处理这一批的时间记为模型忙碌时间，处理完之后槽才可重用
+            start = time.perf_counter()
+            yield batch, items
+            busy = time.perf_counter() - start
+            self._model_busy += busy
+            if self.metrics is not None:
+                self.metrics.observe_pipeline(model_busy=busy)
+            free.append(slot)
+
+        for image_path in image_paths:
+            chunk.append(image_path)
+            if len(chunk) == self.batch_size:
+                if not free:
+                    yield from run(*consume())
+                submit(chunk)
+                chunk = []
+        if chunk:
+            if not free:
+                yield from run(*consume())
+            submit(chunk)
+        while inflight:
+            yield from run(*consume())
+        self._finished = time.perf_counter()
+
+    def stats(self):
+        if self._started is None:
+            wall = 0.0
+        else:
+            wall = (self._finished or time.perf_counter()) - self._started
+        return {
+            "processes": self.processes,
+            "slots": self.slots,
+            "batchSize": self.batch_size,
+            "images": self._images,
+            "batches": self._batches,
+            "wallSeconds": round(wall, 3),
+            "decoderBusySeconds": round(self._decoder_busy, 3),
+            "modelBusySeconds": round(self._model_busy, 3),
+            "modelWaitSeconds": round(self._model_wait, 3),
+            "decoderUtilization": round(self._decoder_busy / (self.processes * wall), 3) if wall else None,
+            "modelUtilization": round(self._model_busy / wall, 3) if wall else None,
+        }
+
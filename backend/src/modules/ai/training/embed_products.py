@@ -0,0 +1,173 @@
+"""
+为商品图片提取特征并构建视觉相似度索引
+
+用法：
+    python embed_products.py                        # 从数据库读取 fish_product.imageUrls
+    python embed_products.py --ivf-lists 64         # 使用 IVF 分区（商品图片很多时）
+    python embed_products.py --products-json p.json # 不连数据库，从导出的 JSON 读取
+
+流程：
+1. 读取商品及其图片地址：默认连接 MySQL（需 pip install pymysql），
+   连接参数与后端相同，取自环境变量 DB_HOST / DB_PORT / DB_USERNAME / DB_PASSWORD / DB_DATABASE；
+   也可以用 --products-json 提供 [{"id": 1, "imageUrls": ["/uploads/xxx.jpg"]}, ...]
+2. 把图片地址映射为 backend/uploads 下的本地文件（与 recognition.service.ts 的规则一致）
+3. 批量提取 512 维特征（infer_pytorch.py --embed 的同一条路径）
+4. 写入 ./models/product_index（见 vector_index.py），
+   之后 infer_pytorch.py 会自动加载该索引，在识别结果中附带 similar 字段
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from vector_index import INDEX_DIR, build_index
+
+
+# backend/src/modules/ai/training -> backend/uploads
+DEFAULT_UPLOAD_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "..", "uploads"
+)
+
+
+def load_products_from_db():
+    """
+    从 fish_product 表读取 (id, imageUrls)
+    """
+    try:
+        import pymysql
+    except ImportError as e:
+        raise RuntimeError("读取数据库需要安装 pymysql（pip install pymysql），或使用 --products-json") from e
+
+    connection = pymysql.connect(
+        host=os.environ.get("DB_HOST", "localhost"),
+        port=int(os.environ.get("DB_PORT", 3306)),
+        user=os.environ.get("DB_USERNAME", "root"),
+        password=os.environ.get("DB_PASSWORD", ""),
+        database=os.environ.get("DB_DATABASE", "fish_app"),
+        charset="utf8mb4",
+    )
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT id, imageUrls FROM fish_product")
+            rows = cursor.fetchall()
+    finally:
+        connection.close()
+
+    products = []
+    for product_id, image_urls in rows:
+        if isinstance(image_urls, (bytes, str)):
+            image_urls = json.loads(image_urls) if image_urls else []
+        products.append({"id": product_id, "imageUrls": image_urls or []})
+    return products
+
+
+def load_products_from_json(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def resolve_upload_path(image_url: str, upload_dir: str):
+    """
+    图片地址转换为本地路径：http(s)://host/uploads/xxx.jpg 与 /uploads/xxx.jpg 都映射到 upload_dir/xxx.jpg
+    外部图片（不在 uploads 下）返回 None
+    """
+    if image_url.startswith(("http://", "https://")):
+        if "/uploads/" not in image_url:
+            return None
+        return os.path.join(upload_dir, image_url.split("/uploads/", 1)[1])
+    if image_url.startswith("/uploads/"):
+        return os.path.join(upload_dir, image_url[len("/uploads/"):])
+    return None
+
+
+def collect_images(products, upload_dir: str):
+    """
+    返回 (本地路径列表, 对应的 {"productId", "imageUrl"} 列表, 缺失数量)
+    """
+    paths, items = [], []
+    missing = 0
+    for product in products:
+        for image_url in product.get("imageUrls") or []:
+            path = resolve_upload_path(image_url, upload_dir)
+            if path is None or not os.path.isfile(path):
+                missing += 1
+                continue
+            paths.append(path)
+            items.append({"productId": product["id"], "imageUrl": image_url})
+    return paths, items, missing
+
+
+def main():
+    parser = argparse.ArgumentParser(description="提取商品图片特征并构建相似度索引")
+    parser.add_argument("--products-json", help="商品列表 JSON（不指定时从数据库读取）")
+    parser.add_argument(
+        "--upload-dir",
+        default=DEFAULT_UPLOAD_DIR,
+        help="上传图片目录（默认 backend/uploads）",
+    )
+    parser.add_argument("--output", default=INDEX_DIR, help="索引输出目录")
+    parser.add_argument(
+        "--ivf-lists", type=int, default=0, help="IVF 分区数（0 表示全量扫描，商品图片上万时建议约 sqrt(N)）"
+    )
+    parser.add_argument("--batch-size", type=int, default=32, help="每次前向的图片数")
+    parser.add_argument("--decode-threads", type=int, default=4, help="并行解码的线程数")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("构建商品图片相似度索引")
+    print("=" * 60)
+
+    try:
+        if args.products_json:
+            products = load_products_from_json(args.products_json)
+        else:
+            products = load_products_from_db()
+    except Exception as e:
+        print(f"[ERROR] 读取商品失败: {e}")
+        return
+
+    upload_dir = os.path.abspath(args.upload_dir)
+    paths, items, missing = collect_images(products, upload_dir)
+    print(f"商品数: {len(products)}, 可用图片: {len(paths)}, 缺失 / 外部图片: {missing}")
+    print(f"上传目录: {upload_dir}")
+    if not paths:
+        print("[ERROR] 没有可用的商品图片")
+        return
+
+    import model_artifact
+    import model_store
+    from infer_pytorch import get_backend, predict_files
+
+    start = time.perf_counter()
+    vectors, kept = [], []
+    for item, result in zip(items, predict_files(paths, args.batch_size, args.decode_threads, embed=True)):
+        if "error" in result:
+            print(f"  [WARN] {result['path']}: {result['error']}")
+            continue
+        vectors.append(np.asarray(result["embedding"], dtype=np.float32))
+        kept.append(item)
+    elapsed = time.perf_counter() - start
+
+    if not vectors:
+        print("[ERROR] 所有图片都提取失败")
+        return
+    print(f"提取特征: {len(vectors)} 张, 耗时 {elapsed:.1f}s ({len(vectors) / elapsed:.1f} 张/秒)")
+
+    header = build_index(
+        np.stack(vectors),
+        kept,
+        args.output,
+        nlist=args.ivf_lists,
+        # 记录提取特征的模型，识别进程换模型后据此提示重新构建索引
+        extra={"modelVersion": model_store.file_identity(model_artifact.resnet_files(get_backend().model_dir)[0])},
+    )
+    print(f"[OK] 索引已写入: {os.path.abspath(args.output)}")
+    print(f"     向量数: {header['count']}, 维度: {header['dim']}, IVF 分区: {header['nlist']}")
+    print("     infer_pytorch.py 会自动加载该索引，识别结果中的 similar 字段即视觉最相似的商品")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+将训练好的 PyTorch 模型导出为部署格式
+
+用法：
+    python export_model.py --format torchscript
+    python export_model.py --format onnx
+    python export_model.py --format all
+
+导出结果写入一个新的模型版本（继承当前版本的其他文件，见 model_store.py）：
+- torchscript：fish_classifier_resnet18_scripted.pt，冻结并针对推理优化的 TorchScript 模型，
+        类别映射打包在模型文件中，供 infer_pytorch.py --backend torchscript 使用
+- onnx：fish_classifier_resnet18.onnx，批大小维度为动态，类别映射写入 ONNX 元数据，
+        供 infer_pytorch.py --backend onnxruntime 使用
+"""
+
+import argparse
+import json
+import os
+
+import model_store
+from infer_pytorch import IMG_SIZE, ONNX_PATH, TORCHSCRIPT_PATH, load_model
+
+
+def export_torchscript(model, idx_to_class, output_path: str = TORCHSCRIPT_PATH, arch: str = "resnet18"):
+    """
+    导出冻结的 TorchScript 模型：freeze 把参数内联为常量并折叠 Conv + BN，
+    类别映射写入 extra files，推理时只需 torch.jit.load
+    （optimize_for_inference 生成的 MKLDNN 常量无法序列化，改为在加载后执行）
+    """
+    import torch
+
+    class_to_idx = {cls: idx for idx, cls in idx_to_class.items()}
+    example = torch.zeros(1, 3, IMG_SIZE, IMG_SIZE)
+
+    model.eval()
+    with torch.no_grad():
+        scripted = torch.jit.trace(model, example)
+        frozen = torch.jit.freeze(scripted)
+
+    torch.jit.save(
+        frozen,
+        output_path,
+        _extra_files={
+            "class_to_idx.json": json.dumps(class_to_idx, ensure_ascii=False),
+            "meta.json": json.dumps({"arch": arch, "precision": "fp32", "img_size": IMG_SIZE}),
+        },
+    )
+    return output_path
+
+
+def export_onnx(model, idx_to_class, output_path: str = ONNX_PATH, opset: int = 17):
+    """
+    导出 ONNX 模型（输入 [N, 3, 224, 224]，N 为动态维度）
+    """
+    import torch
+    import onnx
+
+    model.eval()
+    dummy = torch.zeros(1, 3, IMG_SIZE, IMG_SIZE)
+    torch.onnx.export(
+        model,
+        dummy,
+        output_path,
+        input_names=["input"],
+        output_names=["logits"],
+        dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=opset,
+    )
+
+    # 把类别映射写入元数据，推理时无需再用 torch 读取 class_to_idx.pt
+    class_to_idx = {cls: idx for idx, cls in idx_to_class.items()}
+    model_proto = onnx.load(output_path)
+    entry = model_proto.metadata_props.add()
+    entry.key = "class_to_idx"
+    entry.value = json.dumps(class_to_idx, ensure_ascii=False)
+    onnx.checker.check_model(model_proto)
+    onnx.save(model_proto, output_path)
+    # 新版本的导出器会先把权重写到外部数据文件，重新保存后权重已内联，外部文件不再需要
+    external_data = f"{output_path}.data"
+    if os.path.isfile(external_data):
+        os.remove(external_data)
+
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--format", choices=["torchscript", "onnx", "all"], default="all", help="导出格式"
+    )
+    parser.add_argument("--opset", type=int, default=17, help="ONNX opset 版本")
+    args = parser.parse_args()
+
+    model, idx_to_class = load_model()
+
+    outputs = []
+    if args.format in ("torchscript", "all"):
+        outputs.append(TORCHSCRIPT_PATH)
+    if args.format in ("onnx", "all"):
+        outputs.append(ONNX_PATH)
+
+    with model_store.new_version(skip=outputs, note=f"export_model.py --format {args.format}") as staging:
+        if args.format in ("torchscript", "all"):
+            path = export_torchscript(model, idx_to_class, model_store.model_file(TORCHSCRIPT_PATH, staging))
+            size_mb = os.path.getsize(path) / (1024 * 1024)
+            print(f"[OK] TorchScript 模型已导出 ({size_mb:.2f} MB)")
+            print("     推理时使用: python infer_pytorch.py --backend torchscript --image xxx.jpg")
+
+        if args.format in ("onnx", "all"):
+            try:
+                path = export_onnx(model, idx_to_class, model_store.model_file(ONNX_PATH, staging), args.opset)
+            except ImportError as e:
+                if args.format == "onnx":
+                    raise
+                print(f"[INFO] 跳过 ONNX 导出（{e}），需要时请安装 onnx")
+            else:
+                size_mb = os.path.getsize(path) / (1024 * 1024)
+                print(f"[OK] ONNX 模型已导出 ({size_mb:.2f} MB)")
+                print("     推理时使用: python infer_pytorch.py --backend onnxruntime --image xxx.jpg")
+
+    print(f"[OK] 已发布模型版本: {model_store.current_version()}")
+
+
+if __name__ == "__main__":
+    main()
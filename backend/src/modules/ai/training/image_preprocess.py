@@ -0,0 +1,123 @@
+"""
+图片解码与预处理（推理与验证集共用）
+
+手机拍摄的上传图片通常在 1200 万像素以上，全尺寸解码是单次识别中最大的 CPU 开销：
+- JPEG 使用 draft（DCT 域缩放）直接按 1/2、1/4、1/8 解码到不小于 224 的尺寸，再双线性缩放到 224x224
+- 可选 torchvision.io.decode_jpeg（libjpeg-turbo）解码，通过 --decoder torchvision 或环境变量 FISH_DECODER 选择
+- uint8 -> 归一化 float32 通过按通道查表一次完成，直接写入调用方提供的缓冲区，
+  不再像 ToTensor + Normalize 那样生成两份中间张量
+
+结果与 Resize((224, 224)) + ToTensor + Normalize 一致（仅 JPEG 缩放解码带来的细微像素差异）。
+"""
+
+import io
+import os
+
+import numpy as np
+
+from inference_metrics import stage
+
+
+IMG_SIZE = 224
+MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+DECODERS = ("pil", "torchvision")
+
+# 每个通道 256 个像素值对应的归一化结果：(v / 255 - mean) / std
+NORMALIZE_LUT = (
+    (np.arange(256, dtype=np.float64) / 255.0 - MEAN[:, np.newaxis]) / STD[:, np.newaxis]
+).astype(np.float32)
+
+_decoder = os.environ.get("FISH_DECODER", "pil")
+
+
+def set_decoder(name: str):
+    global _decoder
+    if name not in DECODERS:
+        raise ValueError(f"未知的解码器: {name}，可选: {', '.join(DECODERS)}")
+    _decoder = name
+
+
+def is_jpeg(data: bytes):
+    return data[:3] == b"\xff\xd8\xff"
+
+
+def _decode_pil(data: bytes, size: int, timer=None):
+    from PIL import Image
+
+    with stage(timer, "decode"):
+        img = Image.open(io.BytesIO(data))
+        # draft 只对 JPEG 生效，会选择不小于目标尺寸的最小缩放比例
+        img.draft("RGB", (size, size))
+        img = img.convert("RGB")
+    with stage(timer, "preprocess"):
+        return np.asarray(img.resize((size, size), Image.BILINEAR))
+
+
+def _decode_torchvision(data: bytes, size: int, timer=None):
+    import torch
+    from torchvision.io import ImageReadMode, decode_jpeg
+    from torchvision.transforms.v2.functional import resize
+
+    with stage(timer, "decode"):
+        encoded = torch.frombuffer(bytearray(data), dtype=torch.uint8)
+        tensor = decode_jpeg(encoded, mode=ImageReadMode.RGB)
+    with stage(timer, "preprocess"):
+        tensor = resize(tensor, [size, size], antialias=True)
+        return tensor.permute(1, 2, 0).numpy()
+
+
+def decode_pixels(data: bytes, size: int = IMG_SIZE, decoder: str = None, timer=None):
+    """
+    解码图片并缩放到 size x size，返回 [H, W, 3] 的 uint8 数组
+    torchvision 解码器只处理 JPEG，其他格式仍使用 PIL
+    timer（inference_metrics.StageTimer）不为空时分别记录解压（decode）与缩放（preprocess）耗时
+    """
+    decoder = decoder or _decoder
+    if decoder == "torchvision" and is_jpeg(data):
+        return _decode_torchvision(data, size, timer)
+    return _decode_pil(data, size, timer)
+
+
+def normalize_into(pixels: np.ndarray, out: np.ndarray):
+    """
+    将 [H, W, 3] 的 uint8 像素归一化后写入 out（[3, H, W] float32，需 C 连续）
+    """
+    for channel in range(3):
+        np.take(NORMALIZE_LUT[channel], pixels[..., channel], out=out[channel])
+    return out
+
+
+def preprocess_bytes(data: bytes, out: np.ndarray = None, decoder: str = None, timer=None):
+    """
+    将图片字节预处理为 [1, 3, H, W] 的 float32 数组
+    out 为预先分配的 [3, H, W] 缓冲区（例如批次缓冲区中的一行）时直接写入，不再额外分配
+    """
+    pixels = decode_pixels(data, IMG_SIZE, decoder, timer)
+    with stage(timer, "preprocess"):
+        if out is None:
+            out = np.empty((1, 3, IMG_SIZE, IMG_SIZE), dtype=np.float32)
+            normalize_into(pixels, out[0])
+            return out
+        return normalize_into(pixels, out)
+
+
+def load_eval_pixels(path: str):
+    """
+    ImageFolder 的 loader：与推理相同的解码路径，返回 uint8 像素
+    """
+    with open(path, "rb") as f:
+        return decode_pixels(f.read(), IMG_SIZE)
+
+
+class EvalTransform:
+    """
+    验证集 transform，配合 load_eval_pixels 使用，输出归一化后的 [3, H, W] 张量
+    """
+
+    def __call__(self, pixels: np.ndarray):
+        import torch
+
+        out = np.empty((3,) + pixels.shape[:2], dtype=np.float32)
+        return torch.from_numpy(normalize_into(pixels, out))
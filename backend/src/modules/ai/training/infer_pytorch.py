@@ -16,100 +16,1923 @@
     }
 
 后端 NestJS 可以通过 child_process 调用本脚本，并解析 JSON。
+
+常驻服务模式：
+    python infer_pytorch.py --serve                 # 通过 stdin/stdout 交互
+    python infer_pytorch.py --serve --socket /tmp/fish.sock   # 通过 Unix socket 交互
+
+    模型只在启动时加载一次并预热，之后每行读取一个 JSON 请求：
+        {"id": 1, "image": "/abs/path/to/image.jpg"}
+    每个请求输出一行 JSON 响应（字段与单次模式相同，并带回 id）：
+        {"id": 1, "fishName": "salmon", "confidence": 0.92, "alternatives": [...]}
+    启动完成后会先输出一行 {"ready": true}，调用方可据此判断服务已就绪。
+
+    图片也可以不经过磁盘文件，直接随请求传入（后端把刚上传的图片交给识别进程）：
+        {"id": 1, "imageBase64": "/9j/4AAQ..."}    图片字节的 base64
+        {"id": 1, "shm": "fish-123-1.img"}        /dev/shm 下的共享内存文件名（调用方负责创建与删除）
+    单次模式下 --image - 从 stdin 读取图片字节，--shm NAME 读取共享内存文件。
+
+    并发到达的请求会被合并成一次批量前向（见 micro_batcher.py），可通过
+    --max-batch-size / --batch-window-ms 调整；发送 {"cmd": "stats"} 可查看
+    实际批大小直方图，退出时也会把统计信息打印到 stderr。
+
+    过载保护：请求可带 "timeoutMs"（从服务读到请求时开始计算，未提供时使用 --default-timeout-ms），
+    超过截止时间的请求在解码前、前向前被丢弃，返回 {"error": ..., "shed": "expired"}；
+    在途请求数达到 --max-queue 时新请求立即返回 {"error": ..., "shed": "overloaded"}。
+    被丢弃的数量见 stats 中的 shedding 字段。
+
+结果缓存（见 result_cache.py）：
+    --cache 开启进程内 LRU 缓存，--cache-dir DIR（或环境变量 FISH_CACHE_DIR）再加一层磁盘缓存。
+    缓存键为图片内容哈希 + 模型版本，模型文件更新后旧结果自动失效。
+
+启动耗时分析：
+    python infer_pytorch.py --image fish.jpg --startup-report
+    在 stderr 输出一行 {"startupReport": {...}}，包含解释器启动、各依赖导入、模型构建、
+    权重加载与首次前向的耗时（毫秒）。torch / onnxruntime / PIL 均在需要时才导入，
+    ResNet18 结构由 fish_resnet.py 定义，不再导入 torchvision。
+
+图片解码（见 image_preprocess.py）：
+    JPEG 按缩小尺寸解码后缩放到 224x224，归一化结果直接写入预分配缓冲区；
+    --decoder torchvision（或环境变量 FISH_DECODER）改用 torchvision.io.decode_jpeg。
+
+CPU 执行配置（见 cpu_profile.py）：
+    线程数、channels_last、oneDNN 融合、inference_mode、torch.compile 从 ./models/cpu_profile.json
+    （python cpu_profile.py autotune 生成）与环境变量读取，--threads 可覆盖线程数。
+
+图片特征与商品相似检索：
+    --embed 输出 ResNet18 全局池化后的 512 维特征；./models/product_index（embed_products.py 生成）
+    存在时自动加载，识别结果附带 "similar": [{"productId", "imageUrl", "score"}]。
+
+模型热更新（见 model_store.py）：
+    训练产出的模型写入 ./models/versions 下的新版本目录，./models/CURRENT 原子切换到新版本。
+    常驻模式每隔 --watch-interval 秒检查一次，新版本在后台加载并预热后替换旧模型，不中断请求；
+    发送 {"cmd": "reload"} 可立即检查，stats 中的 model 字段为当前版本与热更新记录。
+
+多进程（见 prefork.py）：
+    --processes N（或环境变量 FISH_SERVE_PROCESSES）：父进程以内存映射方式加载一次权重后 fork 出 N 个 worker，
+    worker 共享权重内存、各自绑定一组 CPU 核心，父进程把请求分发给在途请求最少的 worker；
+    stats 中给出每个 worker 的 RSS / PSS。
+
+分阶段耗时与指标（见 inference_metrics.py）：
+    --timings（常驻模式下也可在请求中带 "timings": true）在结果中附带 timings 字段，
+    分别给出读取、解码、缩放归一化、前向、top-k 整理、序列化等阶段的耗时（毫秒）；
+    常驻与批量模式下 --metrics-port / --metrics-file 以 Prometheus 文本格式输出计数器与各阶段延迟直方图。
+
+级联推理：
+    --cascade（或 --backend cascade）先用 MobileNetV3-Small 判断，置信度低于 ./models/cascade.json
+    中的阈值时再用 ResNet18；升级比例与延迟节省见 stats 中的 cascade 字段。
+
+批量模式（离线重打分 / 评估）：
+    python infer_pytorch.py --dir uploads/
+    python infer_pytorch.py --manifest list.txt
+    python infer_pytorch.py --images a.jpg b.jpg c.jpg
+
+    模型只加载一次，多线程并行解码，按批前向；每处理完一批立即输出，
+    每张图片一行 JSON：{"path": "a.jpg", "fishName": ..., ...}，失败时为 {"path": ..., "error": ...}
+    --decode-processes N 改用解码进程池（见 decode_pool.py），解码与前向在不同进程中重叠进行，
+    结束时在 stderr 输出 {"pipeline": {...}}：解码进程与模型线程各自的利用率
 """
 
 import argparse
+import base64
+import binascii
+import io
 import json
 import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+# 启动各阶段耗时（毫秒），见 --startup-report
+_startup_times = {}
+_import_start = time.perf_counter()
+
+import numpy as np
 
-import torch
-from torchvision import models, transforms
-from PIL import Image
+_startup_times["import_numpy"] = (time.perf_counter() - _import_start) * 1000.0
+
+import cpu_profile
+import image_preprocess
+import model_artifact
+import model_store
+from decode_pool import DecodePool
+from image_preprocess import DECODERS, IMG_SIZE
+from inference_metrics import InferenceMetrics, MetricsExporter, StageTimer, merge_snapshots, render_snapshot, stage
+from micro_batcher import DeadlineExceeded, LoadShedder, MicroBatcher
+from result_cache import ResultCache, image_key, model_version
+from vector_index import INDEX_DIR, VectorIndex, index_exists, index_files
 
 
 MODEL_DIR = "./models"
+# 单文件模型（权重 + 类别映射 + 预处理参数，见 model_artifact.py）；不存在时读取旧格式的 .pth + class_to_idx.pt
+MODEL_ARTIFACT_PATH = os.path.join(MODEL_DIR, model_artifact.RESNET_ARTIFACT)
 MODEL_PATH = os.path.join(MODEL_DIR, "fish_classifier_resnet18.pth")
 CLASS_INDEX_PATH = os.path.join(MODEL_DIR, "class_to_idx.pt")
+ONNX_PATH = os.path.join(MODEL_DIR, "fish_classifier_resnet18.onnx")
+QUANTIZED_MODEL_PATH = os.path.join(MODEL_DIR, "fish_classifier_resnet18_int8.pt")
+TORCHSCRIPT_PATH = os.path.join(MODEL_DIR, "fish_classifier_resnet18_scripted.pt")
+STUDENT_TORCHSCRIPT_PATH = os.path.join(MODEL_DIR, "fish_classifier_mobilenet_v3_small_scripted.pt")
+CASCADE_CONFIG_PATH = os.path.join(MODEL_DIR, "cascade.json")
+
+TOP_K = 3
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+# --image - 表示从 stdin 读取图片字节；shm 请求只能引用该目录下的文件
+IMAGE_STDIN = "-"
+SHM_DIR = "/dev/shm"
+
+# 推理后端，可通过 --backend 或环境变量 FISH_INFER_BACKEND 选择
+DEFAULT_BACKEND = os.environ.get("FISH_INFER_BACKEND", "pytorch")
+
+# 进程内缓存的后端（含模型），避免重复加载
+_backend_name = DEFAULT_BACKEND
+_backend_cache = None
+_backend_lock = threading.Lock()
+
+# 识别结果缓存，默认关闭，见 configure_cache
+_result_cache = None
+
+# 商品向量索引，开启后识别结果附带视觉最相似的商品，见 configure_index
+_product_index = None
+_similar_k = 6
+
+# 常驻模式下的模型热更新，见 ModelWatcher
+_model_watcher = None
+
+# 分阶段耗时指标，默认关闭，见 configure_metrics；_include_timings 为 True 时每个结果都附带 timings
+_metrics = None
+_metrics_port = None
+_metrics_file = None
+_include_timings = False
+
+# 常驻模式下的过载保护（在途请求上限与默认截止时间），见 configure_shedding
+_load_shedder = None
+_default_timeout_ms = 0
+# 多进程模式下前端转发给 worker 的截止时间（time.monotonic() 时间，同一主机上各进程共用同一时钟）
+FORWARDED_DEADLINE_KEY = "deadlineMonotonic"
+
+# CPU 执行配置文件（线程数、channels_last 等），见 cpu_profile.py
+_cpu_profile_path = os.environ.get("FISH_CPU_PROFILE", cpu_profile.PROFILE_PATH)
+_cpu_profile_overrides = {}
+
+
+@contextmanager
+def startup_stage(name: str):
+    """
+    记录一个启动阶段的耗时，同名阶段累加
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000.0
+        _startup_times[name] = _startup_times.get(name, 0.0) + elapsed
+
+
+def process_age_ms():
+    """
+    当前进程从创建到现在的时间（毫秒），用于统计解释器启动耗时；仅 Linux 可用
+    """
+    try:
+        with open("/proc/self/stat", "r") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime", "r") as f:
+            uptime = float(f.read().split()[0])
+        start_seconds = int(fields[19]) / os.sysconf("SC_CLK_TCK")
+        return (uptime - start_seconds) * 1000.0
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+_process_age_at_import = process_age_ms()
+
+
+def print_startup_report():
+    print(json.dumps({"startupReport": startup_report()}), file=sys.stderr, flush=True)
+
 
-IMG_SIZE = 224
+def startup_report():
+    report = {}
+    if _process_age_at_import is not None:
+        report["interpreter_start"] = _process_age_at_import
+    report.update(_startup_times)
+    total = process_age_ms()
+    if total is not None:
+        report["total"] = total
+    return {name: round(ms, 2) for name, ms in report.items()}
 
 
-def load_model():
-    if not os.path.isfile(MODEL_PATH) or not os.path.isfile(CLASS_INDEX_PATH):
+def _import_pil_image():
+    if "PIL.Image" in sys.modules:
+        return sys.modules["PIL.Image"]
+    with startup_stage("import_pil"):
+        from PIL import Image
+    return Image
+
+
+def load_model(model_dir: str = None):
+    """
+    从指定版本目录（默认当前版本，见 model_store.py）加载 ResNet18，返回 (model, idx_to_class)
+    优先读取单文件模型（内存映射，见 model_artifact.py），没有时读取旧格式的 .pth + class_to_idx.pt
+    """
+    files = model_artifact.resnet_files(model_dir)
+    if not all(os.path.isfile(path) for path in files):
         raise FileNotFoundError("模型或类别索引文件不存在，请先运行 train_pytorch.py 进行训练。")
 
-    class_to_idx = torch.load(CLASS_INDEX_PATH, map_location="cpu")
+    with startup_stage("import_torch"):
+        import torch
+
+        from fish_resnet import resnet18
+
+    with startup_stage("load_weights"):
+        if len(files) == 1:
+            state_dict, meta = model_artifact.load_artifact(files[0])
+            model_artifact.check_preprocess(meta)
+            if meta.get("arch") != "resnet18":
+                raise ValueError(f"模型结构为 {meta.get('arch')}，不是 resnet18: {files[0]}")
+            class_to_idx = meta["classToIdx"]
+        else:
+            model_path, class_index_path = files
+            class_to_idx = torch.load(class_index_path, map_location="cpu")
+            state_dict = _load_state_dict_mmap(torch, model_path)
     idx_to_class = {idx: cls for cls, idx in class_to_idx.items()}
 
-    model = models.resnet18(weights=None)
-    in_features = model.fc.in_features
-    model.fc = torch.nn.Linear(in_features, len(class_to_idx))
-    model.load_state_dict(torch.load(MODEL_PATH, map_location="cpu"))
-    model.eval()
+    with startup_stage("build_model"):
+        model = resnet18(num_classes=len(class_to_idx))
+        try:
+            # assign=True 直接使用内存映射的张量作为参数，不再复制一份
+            model.load_state_dict(state_dict, assign=True)
+        except TypeError:
+            model.load_state_dict(state_dict)
+        model.eval()
 
     return model, idx_to_class
 
 
-def preprocess_image(image_path: str):
+def _load_state_dict_mmap(torch, path: str):
+    """
+    以内存映射方式读取权重（torch >= 2.1）：权重页由页缓存提供，多个进程加载同一文件时共享内存，
+    预 fork 的 worker 也与父进程共享；旧版本 torch 退回普通读取
+    """
+    try:
+        return torch.load(path, map_location="cpu", mmap=True)
+    except TypeError:
+        return torch.load(path, map_location="cpu")
+
+
+def read_torchscript_meta(path: str):
+    """
+    不加载模型，直接从 TorchScript 压缩包中读取 extra/meta.json
+    """
+    import zipfile
+
+    with zipfile.ZipFile(path) as archive:
+        for name in archive.namelist():
+            if name.endswith("/extra/meta.json"):
+                return json.loads(archive.read(name).decode("utf-8"))
+    return {}
+
+
+def load_torchscript(path: str):
+    """
+    加载 TorchScript 模型，类别映射等信息保存在模型文件的 extra files 中
+    返回 (model, idx_to_class, meta)
+    """
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"模型文件不存在: {path}")
+
+    with startup_stage("import_torch"):
+        import torch
+
+    # 量化模型需使用与量化时一致的引擎，且必须在加载模型前设置
+    meta = read_torchscript_meta(path)
+    engine = meta.get("quant_engine")
+    if engine and engine in torch.backends.quantized.supported_engines:
+        torch.backends.quantized.engine = engine
+
+    extra_files = {"class_to_idx.json": ""}
+    with startup_stage("load_weights"):
+        model = torch.jit.load(path, map_location="cpu", _extra_files=extra_files)
+        model.eval()
+
+    if not extra_files["class_to_idx.json"]:
+        raise RuntimeError(f"模型文件缺少类别映射: {path}")
+    class_to_idx = json.loads(extra_files["class_to_idx.json"])
+    idx_to_class = {idx: cls for cls, idx in class_to_idx.items()}
+
+    return model, idx_to_class, meta
+
+
+def softmax(logits: np.ndarray):
+    logits = logits - logits.max(axis=1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+def load_cpu_profile(backend_name: str):
+    return cpu_profile.load_profile(backend_name, _cpu_profile_path, _cpu_profile_overrides)
+
+
+class TorchBackend:
+    """
+    PyTorch eager 推理（默认）
+    profile 为 CPU 执行配置，默认从 cpu_profile.json / 环境变量读取
+    model_dir 为模型版本目录，默认当前版本（见 model_store.py）
+    """
+
+    name = "pytorch"
+    model_files = (MODEL_ARTIFACT_PATH,)
+    supports_features = True
+    fork_safe = True
+
+    def __init__(self, profile: dict = None, model_dir: str = None):
+        model, self.idx_to_class = load_model(model_dir)
+
+        import torch
+
+        self.torch = torch
+        self.profile = profile or load_cpu_profile(self.name)
+        cpu_profile.apply_threads(torch, self.profile)
+        with startup_stage("build_model"):
+            self.model = cpu_profile.prepare_model(torch, model, self.profile)
+
+    def predict_probs(self, batch: np.ndarray):
+        inputs = cpu_profile.prepare_input(self.torch, self.torch.from_numpy(batch), self.profile)
+        with cpu_profile.grad_mode(self.torch, self.profile):
+            outputs = self.model(inputs)
+            return self.torch.softmax(outputs, dim=1).numpy()
+
+    def embed(self, batch: np.ndarray):
+        """
+        返回全局池化后的特征（fc 之前），[N, 512]
+        """
+        inputs = cpu_profile.prepare_input(self.torch, self.torch.from_numpy(batch), self.profile)
+        with cpu_profile.grad_mode(self.torch, self.profile):
+            return self.model.forward_features(inputs).float().numpy()
+
+    def predict_probs_and_features(self, batch: np.ndarray):
+        """
+        一次前向同时得到分类概率与特征
+        """
+        inputs = cpu_profile.prepare_input(self.torch, self.torch.from_numpy(batch), self.profile)
+        with cpu_profile.grad_mode(self.torch, self.profile):
+            features = self.model.forward_features(inputs)
+            outputs = self.model.fc(features)
+            return self.torch.softmax(outputs, dim=1).numpy(), features.float().numpy()
+
+
+class QuantizedTorchBackend(TorchBackend):
+    """
+    INT8 量化模型推理，模型由 quantize_model.py 生成（TorchScript 格式）
+    """
+
+    name = "pytorch-int8"
+    model_files = (QUANTIZED_MODEL_PATH,)
+    supports_features = False
+
+    def __init__(self, profile: dict = None, model_dir: str = None):
+        path = model_store.model_file(QUANTIZED_MODEL_PATH, model_dir)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"量化模型不存在: {path}，请先运行 python quantize_model.py")
+
+        model, self.idx_to_class, _ = load_torchscript(path)
+
+        import torch
+
+        self.torch = torch
+        self.profile = profile or load_cpu_profile(self.name)
+        cpu_profile.apply_threads(torch, self.profile)
+        self.model = cpu_profile.prepare_model(torch, model, self.profile, allow_compile=False)
+
+
+class TorchScriptBackend(TorchBackend):
+    """
+    冻结的 TorchScript 模型推理，模型由 export_model.py --format torchscript 生成
+    - 类别映射打包在模型文件中，启动时不需要导入 torchvision、也不需要重建网络结构
+    """
+
+    name = "torchscript"
+    model_files = (TORCHSCRIPT_PATH,)
+    supports_features = False
+
+    def __init__(self, profile: dict = None, model_dir: str = None, path: str = TORCHSCRIPT_PATH):
+        path = model_store.model_file(path, model_dir)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(
+                f"TorchScript 模型不存在: {path}，请先运行 python export_model.py --format torchscript"
+            )
+        model, self.idx_to_class, _ = load_torchscript(path)
+
+        import torch
+
+        self.torch = torch
+        self.profile = profile or load_cpu_profile(self.name)
+        cpu_profile.apply_threads(torch, self.profile)
+        with startup_stage("build_model"):
+            model = cpu_profile.prepare_model(torch, model, self.profile, allow_compile=False)
+            # oneDNN Graph 融合与 optimize_for_inference 生成的 MKLDNN 图不兼容，二者取其一
+            if not self.profile["onednn_fusion"]:
+                model = torch.jit.optimize_for_inference(model)
+            self.model = model
+
+
+class OnnxBackend:
+    """
+    ONNX Runtime 推理，模型由 export_model.py --format onnx 导出
+    - 类别映射保存在 ONNX 元数据中，整个推理过程不需要导入 torch
+    """
+
+    name = "onnxruntime"
+    model_files = (ONNX_PATH,)
+    supports_features = False
+    # InferenceSession 创建时即启动线程池，fork 后子进程中的线程池不可用
+    fork_safe = False
+
+    def __init__(self, profile: dict = None, model_dir: str = None):
+        onnx_path = model_store.model_file(ONNX_PATH, model_dir)
+        if not os.path.isfile(onnx_path):
+            raise FileNotFoundError(
+                f"ONNX 模型不存在: {onnx_path}，请先运行 python export_model.py --format onnx"
+            )
+
+        with startup_stage("import_onnxruntime"):
+            import onnxruntime as ort
+
+        # 只使用配置中的线程数，channels_last 等选项对 onnxruntime 无效
+        self.profile = profile or load_cpu_profile(self.name)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.profile["intra_op_threads"]:
+            options.intra_op_num_threads = self.profile["intra_op_threads"]
+        if self.profile["inter_op_threads"]:
+            options.inter_op_num_threads = self.profile["inter_op_threads"]
+        with startup_stage("load_weights"):
+            self.session = ort.InferenceSession(
+                onnx_path, sess_options=options, providers=["CPUExecutionProvider"]
+            )
+        self.input_name = self.session.get_inputs()[0].name
+
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        if "class_to_idx" not in metadata:
+            raise RuntimeError("ONNX 模型缺少 class_to_idx 元数据，请重新导出")
+        class_to_idx = json.loads(metadata["class_to_idx"])
+        self.idx_to_class = {idx: cls for cls, idx in class_to_idx.items()}
+
+    def predict_probs(self, batch: np.ndarray):
+        logits = self.session.run(None, {self.input_name: batch})[0]
+        return softmax(logits)
+
+
+class CascadeBackend:
+    """
+    级联推理：MobileNetV3-Small 先判断，top-1 置信度不低于阈值时直接采用，
+    否则把这几张图片交给 ResNet18 重新判断
+    - 小模型由 train_pytorch.py --arch mobilenet_v3_small 训练并导出为 TorchScript
+    - 阈值由 calibrate_cascade.py 在验证集上校准后写入 ./models/cascade.json
+    - ResNet18 在第一次需要时才加载（常驻模式预热时加载），单次调用中小模型足够自信时完全不加载
+    """
+
+    name = "cascade"
+    model_files = (STUDENT_TORCHSCRIPT_PATH, CASCADE_CONFIG_PATH, MODEL_ARTIFACT_PATH)
+    supports_features = False
+    fork_safe = True
+
+    def __init__(self, profile: dict = None, model_dir: str = None):
+        model_dir = model_dir or model_store.current_dir()
+        student_path = model_store.model_file(STUDENT_TORCHSCRIPT_PATH, model_dir)
+        config_path = model_store.model_file(CASCADE_CONFIG_PATH, model_dir)
+        if not os.path.isfile(student_path):
+            raise FileNotFoundError(
+                f"小模型不存在: {student_path}，请先运行 python train_pytorch.py --arch mobilenet_v3_small"
+            )
+        if not os.path.isfile(config_path):
+            raise FileNotFoundError(f"级联配置不存在: {config_path}，请先运行 python calibrate_cascade.py")
+
+        with open(config_path, "r", encoding="utf-8") as f:
+            self.threshold = float(json.load(f)["threshold"])
+
+        self.profile = profile
+        self.model_dir = model_dir
+        self.student = TorchScriptBackend(profile, model_dir, path=STUDENT_TORCHSCRIPT_PATH)
+        self.idx_to_class = self.student.idx_to_class
+
+        self._teacher = None
+        self._teacher_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._images = 0
+        self._escalated = 0
+        self._student_ms = 0.0
+        self._teacher_ms = 0.0
+
+    def teacher(self):
+        if self._teacher is None:
+            with self._teacher_lock:
+                if self._teacher is None:
+                    teacher = TorchBackend(self.profile, self.model_dir)
+                    if teacher.idx_to_class != self.idx_to_class:
+                        raise RuntimeError("小模型与 ResNet18 的类别映射不一致，请用同一份数据集重新训练")
+                    self._teacher = teacher
+        return self._teacher
+
+    def components(self):
+        """
+        预热时需要初始化的模型（会加载 ResNet18）
+        """
+        return [self.student, self.teacher()]
+
+    def predict_probs(self, batch: np.ndarray):
+        start = time.perf_counter()
+        probs = self.student.predict_probs(batch)
+        student_ms = (time.perf_counter() - start) * 1000.0
+
+        teacher_ms = 0.0
+        doubtful = np.flatnonzero(probs.max(axis=1) < self.threshold)
+        if len(doubtful):
+            start = time.perf_counter()
+            probs[doubtful] = self.teacher().predict_probs(np.ascontiguousarray(batch[doubtful]))
+            teacher_ms = (time.perf_counter() - start) * 1000.0
+
+        with self._stats_lock:
+            self._images += len(batch)
+            self._escalated += len(doubtful)
+            self._student_ms += student_ms
+            self._teacher_ms += teacher_ms
+        return probs
+
+    def stats(self):
+        """
+        升级比例与延迟：teacherMsPerImage 为 ResNet18 单独处理一张图片的平均耗时，
+        latencySaving 为级联相对“每张都走 ResNet18”节省的比例
+        """
+        with self._stats_lock:
+            images, escalated = self._images, self._escalated
+            student_ms, teacher_ms = self._student_ms, self._teacher_ms
+
+        stats = {
+            "threshold": self.threshold,
+            "images": images,
+            "escalated": escalated,
+            "escalationRate": round(escalated / images, 4) if images else 0.0,
+            "msPerImage": round((student_ms + teacher_ms) / images, 3) if images else 0.0,
+        }
+        if escalated:
+            teacher_per_image = teacher_ms / escalated
+            stats["teacherMsPerImage"] = round(teacher_per_image, 3)
+            stats["latencySaving"] = round(1.0 - stats["msPerImage"] / teacher_per_image, 4)
+        return stats
+
+
+BACKENDS = {
+    TorchBackend.name: TorchBackend,
+    QuantizedTorchBackend.name: QuantizedTorchBackend,
+    TorchScriptBackend.name: TorchScriptBackend,
+    OnnxBackend.name: OnnxBackend,
+    CascadeBackend.name: CascadeBackend,
+}
+
+
+def set_backend(name: str):
+    """
+    切换推理后端（需在首次识别之前调用）
+    """
+    global _backend_name, _backend_cache
+    if name not in BACKENDS:
+        raise ValueError(f"未知的推理后端: {name}，可选: {', '.join(BACKENDS)}")
+    with _backend_lock:
+        _backend_name = name
+        _backend_cache = None
+
+
+def get_backend():
+    """
+    返回进程内缓存的推理后端，首次调用时加载模型
+    """
+    global _backend_cache
+    if _backend_cache is None:
+        with _backend_lock:
+            if _backend_cache is None:
+                _backend_cache = load_backend(BACKENDS[_backend_name])
+    return _backend_cache
+
+
+def load_backend(backend_cls, model_dir: str = None):
+    """
+    从指定版本目录（默认当前版本）加载后端，并记录模型目录与版本号
+    """
+    model_dir = model_dir or model_store.current_dir()
+    # 版本号在加载前计算，保证与实际加载的模型文件一致
+    version = _backend_version(backend_cls, model_dir)
+    backend = backend_cls(model_dir=model_dir)
+    backend.model_dir = model_dir
+    backend.version = version
+    return backend
+
+
+def _backend_version(backend_cls, model_dir: str = None):
+    """
+    模型版本号：由后端读取的模型文件的元信息计算
+    ResNet18 没有单文件模型时按旧格式的两个文件计算
+    """
+    files = []
+    for path in backend_cls.model_files:
+        if path == MODEL_ARTIFACT_PATH:
+            files += model_artifact.resnet_files(model_dir)
+        else:
+            files.append(model_store.model_file(path, model_dir))
+    return model_version(files, backend_cls.name)
+
+
+def _index_version(index_dir: str):
+    return model_version(index_files(index_dir), "index")
+
+
+def configure_index(index_dir: str = INDEX_DIR, k: int = 6, nprobe: int = 8):
+    """
+    加载商品向量索引：之后每次识别都用同一次前向的特征检索视觉最相似的 k 个商品
+    只有能输出特征的后端（pytorch）支持
+    """
+    global _product_index, _similar_k, _backend_cache
+    backend_cls = BACKENDS[_backend_name]
+    if not backend_cls.supports_features:
+        raise ValueError(f"{backend_cls.name} 后端不输出特征，商品相似检索需使用 pytorch 后端")
+
+    index = VectorIndex(index_dir, nprobe)
+    index.version = _index_version(index_dir)
+    _product_index = index
+    _similar_k = k
+    with _backend_lock:
+        _backend_cache = None
+    return _product_index
+
+
+def set_cpu_profile(path: str = None, **overrides):
+    """
+    指定 CPU 执行配置文件及覆盖项（需在首次识别之前调用）
+    """
+    global _cpu_profile_path, _cpu_profile_overrides, _backend_cache
+    if path:
+        _cpu_profile_path = path
+    _cpu_profile_overrides = overrides
+    with _backend_lock:
+        _backend_cache = None
+
+
+def configure_cache(cache_dir: str = None, memory_entries: int = 1024, max_disk_mb: float = 512):
+    """
+    开启识别结果缓存
+    旧模型版本的磁盘记录不在这里删除：缓存目录可能与使用其他模型 / 后端的进程共用，
+    版本是键的一部分，旧记录不会被命中，由 --cache-max-mb 的大小上限淘汰
+    """
+    global _result_cache
+    _result_cache = ResultCache(cache_dir, memory_entries, max_disk_mb)
+    return _result_cache
+
+
+def cache_version():
+    """
+    当前缓存使用的版本：模型已加载时取加载时的版本，
+    否则按模型文件元信息计算（单次调用命中缓存时可以完全跳过模型加载）；
+    开启商品索引时结果中包含相似商品，版本再加上索引的版本
+    """
+    if _backend_cache is not None:
+        version = _backend_cache.version
+    else:
+        version = _backend_version(BACKENDS[_backend_name])
+    if version is None:
+        return None
+    index = _product_index
+    if index is not None:
+        if index.version is None:
+            return None
+        version = f"{version}-{index.version}"
+    return version
+
+
+def cache_lookup(data: bytes):
+    """
+    返回 (key, 缓存结果)；未开启缓存或模型文件不存在时 key 为 None
+    """
+    if _result_cache is None:
+        return None, None
+    version = cache_version()
+    if version is None:
+        return None, None
+    key = image_key(data, version)
+    return key, _result_cache.get(key)
+
+
+def cache_stats():
+    return _result_cache.stats() if _result_cache is not None else None
+
+
+def configure_metrics(port: int = None, path: str = None):
+    """
+    开启分阶段耗时指标：port 为本机 HTTP 端口（GET /metrics），path 为定期写入的指标文件
+    """
+    global _metrics, _metrics_port, _metrics_file
+    _metrics = InferenceMetrics()
+    _metrics_port = port
+    _metrics_file = path
+    return _metrics
+
+
+def configure_shedding(max_pending: int = 64, default_timeout_ms: float = 0):
+    """
+    开启常驻模式下的过载保护：max_pending 为在途请求上限（0 表示不限制），
+    default_timeout_ms 为请求未带 timeoutMs 时的截止时间（0 表示不设截止时间）
+    """
+    global _load_shedder, _default_timeout_ms
+    _load_shedder = LoadShedder(max_pending)
+    _default_timeout_ms = default_timeout_ms
+    return _load_shedder
+
+
+def request_deadline(request: dict, forwarded: bool = False):
+    """
+    请求的截止时间（time.monotonic() 时间）；没有 timeoutMs 且没有默认值时返回 None
+    forwarded 为 True（多进程模式的 worker）时使用前端读到请求时算好的截止时间
+    """
+    if forwarded and FORWARDED_DEADLINE_KEY in request:
+        return float(request[FORWARDED_DEADLINE_KEY])
+    timeout_ms = request.get("timeoutMs") or _default_timeout_ms
+    if not timeout_ms:
+        return None
+    return time.monotonic() + float(timeout_ms) / 1000.0
+
+
+def shed_response(request: dict, reason: str, message: str):
+    """
+    被丢弃请求的快速响应，并计入 shedding 统计与指标
+    """
+    if _load_shedder is not None:
+        _load_shedder.record_shed(reason)
+    if _metrics is not None:
+        _metrics.observe_shed(reason)
+    response = {"id": request["id"]} if "id" in request else {}
+    response.update({"error": message, "shed": reason})
+    return response
+
+
+def set_timings(enabled: bool):
+    """
+    所有结果都附带 timings 字段（常驻模式下请求中的 "timings" 优先）
+    """
+    global _include_timings
+    _include_timings = enabled
+
+
+def start_metrics_exporter(collect=None):
+    """
+    按 configure_metrics 的配置输出指标，未开启时返回 None
+    collect 返回 Prometheus 文本，默认为本进程的指标
+    """
+    if _metrics is None or not (_metrics_port or _metrics_file):
+        return None
+    return MetricsExporter(collect or _metrics.render, _metrics_port, _metrics_file).start()
+
+
+def dump_response(response: dict, timer: StageTimer = None, include_timings: bool = False):
+    """
+    序列化一个识别结果（一行 JSON）；有 timer 时记录序列化耗时并计入指标，
+    include_timings 时在行尾附加 timings 字段（serialize 为不含 timings 部分的序列化耗时）
+    """
+    if timer is None:
+        return json.dumps(response, ensure_ascii=False)
+    with timer.stage("serialize"):
+        line = json.dumps(response, ensure_ascii=False)
+    timer.finish()
+    if _metrics is not None:
+        _metrics.observe_request(timer, "shed" if "shed" in response else "error" if "error" in response else "ok")
+    if include_timings:
+        separator = ", " if len(line) > 2 else ""
+        line = f'{line[:-1]}{separator}"timings": {json.dumps(timer.as_dict())}}}'
+    return line
+
+
+def warmup(backend, runs: int = 2):
+    """
+    用全零输入跑几次前向，提前完成算子初始化与内存分配
+    """
+    dummy = np.zeros((1, 3, IMG_SIZE, IMG_SIZE), dtype=np.float32)
+    components = backend.components() if hasattr(backend, "components") else [backend]
+    for run in range(runs):
+        for component in components:
+            if run == 0 and "first_forward" not in _startup_times:
+                with startup_stage("first_forward"):
+                    component.predict_probs(dummy)
+            else:
+                component.predict_probs(dummy)
+
+
+def read_image_bytes(image_path: str):
+    if image_path == IMAGE_STDIN:
+        data = sys.stdin.buffer.read()
+        if not data:
+            raise ValueError("stdin 中没有图片数据")
+        return data
     if not os.path.isfile(image_path):
         raise FileNotFoundError(f"图片不存在: {image_path}")
+    with open(image_path, "rb") as f:
+        return f.read()
+
+
+def read_shm_bytes(name: str):
+    """
+    读取 /dev/shm 下的共享内存文件（tmpfs，只在内存中）；只接受文件名，不允许路径
+    """
+    if not name or os.path.basename(name) != name or name in (".", ".."):
+        raise ValueError(f"无效的共享内存名称: {name}")
+    path = os.path.join(SHM_DIR, name)
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"共享内存不存在: {path}")
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def read_image_timed(image_path: str, timer: StageTimer = None):
+    with stage(timer, "read"):
+        return read_image_bytes(image_path)
 
-    transform = transforms.Compose(
-        [
-            transforms.Resize((IMG_SIZE, IMG_SIZE)),
-            transforms.ToTensor(),
-            transforms.Normalize(
-                mean=[0.485, 0.456, 0.406],
-                std=[0.229, 0.224, 0.225],
-            ),
-        ]
-    )
 
-    img = Image.open(image_path).convert("RGB")
-    tensor = transform(img).unsqueeze(0)  # [1, C, H, W]
-    return tensor
+def is_image_request(request: dict):
+    return bool(request.get("image") or request.get("imageBase64") or request.get("shm"))
 
 
-@torch.no_grad()
-def predict(image_path: str):
-    model, idx_to_class = load_model()
-    tensor = preprocess_image(image_path)
+def request_image_bytes(request: dict, timer: StageTimer = None):
+    """
+    取得请求中的图片字节：imageBase64（base64 字节）、shm（/dev/shm 文件名）或 image（文件路径）
+    """
+    with stage(timer, "read"):
+        if request.get("imageBase64"):
+            try:
+                return base64.b64decode(request["imageBase64"], validate=True)
+            except (binascii.Error, TypeError) as e:
+                raise ValueError(f"imageBase64 不是有效的 base64: {e}")
+        if request.get("shm"):
+            return read_shm_bytes(request["shm"])
+        if request.get("image"):
+            return read_image_bytes(request["image"])
+    raise ValueError("请求缺少 image、imageBase64 或 shm 字段")
+
+
+def preprocess_image(image_path: str):
+    return preprocess_bytes(read_image_bytes(image_path))
+
 
-    outputs = model(tensor)
-    probs = torch.softmax(outputs, dim=1)[0]
+def preprocess_bytes(data: bytes, out: np.ndarray = None, timer: StageTimer = None):
+    """
+    将图片字节预处理为 [1, C, H, W] 的 float32 数组
+    （等价于 Resize((224, 224)) + ToTensor + Normalize，JPEG 按缩小尺寸解码，见 image_preprocess.py）
+    out 为预先分配的 [C, H, W] 缓冲区时直接写入
+    """
+    with stage(timer if "PIL.Image" not in sys.modules else None, "load"):
+        _import_pil_image()
+    return image_preprocess.preprocess_bytes(data, out, timer=timer)
 
-    # Top-3
-    top_probs, top_idxs = torch.topk(probs, k=min(3, probs.shape[0]))
 
-    result = {
+def format_result(probs, idx_to_class):
+    """
+    将单张图片的概率向量整理为 fishName / confidence / alternatives 结构
+    """
+    top_idxs = np.argsort(-probs)[: min(TOP_K, probs.shape[0])]
+
+    return {
         "fishName": idx_to_class[int(top_idxs[0])],
-        "confidence": float(top_probs[0]),
+        "confidence": float(probs[top_idxs[0]]),
         "alternatives": [
             {
                 "name": idx_to_class[int(idx)],
-                "confidence": float(p),
+                "confidence": float(probs[idx]),
             }
-            for idx, p in zip(top_idxs[1:], top_probs[1:])
+            for idx in top_idxs[1:]
         ],
     }
 
+
+def _record_batch(timers, size: int, **stages):
+    """
+    把整批的前向 / 后处理耗时记到批中每个请求上（每个请求都要等整批完成）
+    """
+    if _metrics is not None and size:
+        _metrics.observe_batch(size)
+    for timer in timers or ():
+        if timer is not None:
+            for name, ms in stages.items():
+                timer.add(name, ms)
+
+
+def _get_backend_timed(timers):
+    """
+    get_backend；本次调用才加载模型时（单次调用模式）把加载耗时记为 load
+    """
+    if _backend_cache is not None:
+        return _backend_cache
+    start = time.perf_counter()
+    backend = get_backend()
+    _record_batch(timers, 0, load=(time.perf_counter() - start) * 1000.0)
+    return backend
+
+
+def predict_batch(arrays, timers=None):
+    """
+    将多张已预处理的图片（每个 [1, C, H, W]）拼成一个批次做一次前向，
+    返回与输入顺序一致的结果列表；arrays 也可以是已拼好的 [N, C, H, W] 数组
+    timers 为与输入对应的 StageTimer 列表（可以为 None），记录 forward / postprocess 耗时
+    """
+    # 整批使用同一个后端与索引，热更新替换不会影响正在进行的批次
+    backend = _get_backend_timed(timers)
+    index = _product_index
+    if isinstance(arrays, np.ndarray):
+        batch = arrays
+    else:
+        batch = np.concatenate(arrays, axis=0)  # [N, C, H, W]
+
+    def forward():
+        if index is not None:
+            return backend.predict_probs_and_features(batch)
+        return backend.predict_probs(batch), None
+
+    start = time.perf_counter()
+    if "first_forward" not in _startup_times:
+        with startup_stage("first_forward"):
+            probs, features = forward()
+    else:
+        probs, features = forward()
+    forward_ms = (time.perf_counter() - start) * 1000.0
+
+    start = time.perf_counter()
+    results = [format_result(row, backend.idx_to_class) for row in probs]
+    if features is not None:
+        for result, similar in zip(results, index.search_batch(features, _similar_k)):
+            result["similar"] = similar
+    postprocess_ms = (time.perf_counter() - start) * 1000.0
+
+    _record_batch(timers, len(batch), forward=forward_ms, postprocess=postprocess_ms)
+    return results
+
+
+def predict_queued(items):
+    """
+    常驻模式下 MicroBatcher 的 run_batch：items 为 (array, timer, 提交时间)，
+    从提交到这一批开始前向的时间记为 queue
+    """
+    start = time.perf_counter()
+    for _, timer, submitted in items:
+        if timer is not None:
+            timer.add("queue", (start - submitted) * 1000.0)
+    return predict_batch([array for array, _, _ in items], [timer for _, timer, _ in items])
+
+
+def embed_batch(arrays, timers=None):
+    """
+    提取一批图片的 512 维特征，返回 [{"embedding": [...]}]，顺序与输入一致
+    """
+    backend = _get_backend_timed(timers)
+    if not backend.supports_features:
+        raise ValueError(f"{backend.name} 后端不输出特征，--embed 需使用 pytorch 后端")
+
+    batch = arrays if isinstance(arrays, np.ndarray) else np.concatenate(arrays, axis=0)
+    start = time.perf_counter()
+    features = backend.embed(batch)
+    forward_ms = (time.perf_counter() - start) * 1000.0
+
+    start = time.perf_counter()
+    results = [{"embedding": row.tolist()} for row in features]
+    _record_batch(timers, len(batch), forward=forward_ms, postprocess=(time.perf_counter() - start) * 1000.0)
+    return results
+
+
+def recognize_bytes(data: bytes, infer=None, timer: StageTimer = None):
+    """
+    识别一张图片：先查缓存，未命中时预处理并推理，再写回缓存
+    infer 为单张图片的推理函数（默认直接调用 predict_batch）
+    """
+    with stage(timer if _result_cache is not None else None, "cache"):
+        key, cached = cache_lookup(data)
+    if cached is not None:
+        if timer is not None:
+            timer.cached = True
+        return cached
+
+    array = preprocess_bytes(data, timer=timer)
+    result = infer(array) if infer is not None else predict_batch([array], [timer])[0]
+    if key is not None:
+        _result_cache.put(key, result)
     return result
 
 
+def predict(image_path: str, timer: StageTimer = None):
+    return recognize_bytes(read_image_timed(image_path, timer), timer=timer)
+
+
+def embed(image_path: str, timer: StageTimer = None):
+    return embed_bytes(read_image_timed(image_path, timer), timer)
+
+
+def embed_bytes(data: bytes, timer: StageTimer = None):
+    return embed_batch([preprocess_bytes(data, timer=timer)], [timer])[0]
+
+
+def iter_dir_images(root: str):
+    """
+    递归列出目录下的图片文件（按路径排序，保证输出顺序稳定）
+    """
+    if not os.path.isdir(root):
+        raise FileNotFoundError(f"目录不存在: {root}")
+
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(dirpath, name)
+
+
+def iter_manifest_images(manifest_path: str):
+    """
+    读取清单文件，每行一个图片路径；空行与 # 开头的行忽略，
+    相对路径相对于清单文件所在目录
+    """
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        for line in f:
+            path = line.strip()
+            if not path or path.startswith("#"):
+                continue
+            yield path if os.path.isabs(path) else os.path.join(base_dir, path)
+
+
+def _load_for_batch(image_path: str, out: np.ndarray, use_cache: bool = True):
+    """
+    读取并解码一张图片，结果直接写入批次缓冲区中对应的一行 out
+    """
+    timer = StageTimer()
+    item = {"path": image_path, "array": None, "error": None, "key": None, "result": None, "timer": timer}
+    try:
+        data = read_image_timed(image_path, timer)
+        if use_cache:
+            with stage(timer if _result_cache is not None else None, "cache"):
+                item["key"], item["result"] = cache_lookup(data)
+            timer.cached = item["result"] is not None
+        if item["result"] is None:
+            item["array"] = preprocess_bytes(data, out, timer)
+    except Exception as e:
+        item["error"] = str(e)
+    return item
+
+
+def _run_loaded_batch(loaded, buffer: np.ndarray, run_batch=predict_batch):
+    """
+    一批已解码的图片（_load_for_batch 的结果），未命中缓存的部分合并前向，按输入顺序产出 (结果, StageTimer)
+    全部需要推理时直接使用批次缓冲区，不再拼接
+    """
+    rows = [row for row, item in enumerate(loaded) if item["array"] is not None]
+    pending = [loaded[row] for row in rows]
+
+    if len(rows) == len(loaded):
+        batch = buffer[: len(rows)]
+    else:
+        batch = buffer[rows]
+
+    try:
+        results = run_batch(batch, [item["timer"] for item in pending]) if pending else []
+    except Exception as e:
+        for item in pending:
+            item["error"] = str(e)
+    else:
+        for item, result in zip(pending, results):
+            item["result"] = result
+            if item["key"] is not None:
+                _result_cache.put(item["key"], result)
+
+    for item in loaded:
+        if item["error"] is not None:
+            yield {"path": item["path"], "error": item["error"]}, item["timer"]
+        else:
+            yield {"path": item["path"], **item["result"]}, item["timer"]
+
+
+def predict_files(
+    image_paths,
+    batch_size: int = 16,
+    decode_threads: int = 4,
+    embed: bool = False,
+    with_timers: bool = False,
+    decode_pool: DecodePool = None,
+):
+    """
+    批量识别多张图片：模型只加载一次，解码在线程池中并行进行，
+    并提前解码下一批，使解码与前向重叠；每批完成后立即产出该批结果
+    每批图片直接解码到该批的 [N, C, H, W] 缓冲区中
+    embed=True 时输出特征而不是识别结果（不使用结果缓存）
+    with_timers=True 时产出 (结果, StageTimer)，用于输出分阶段耗时
+    decode_pool 不为空时改由解码进程池解码（见 decode_pool.py），batch_size 以进程池的批次槽为准
+    """
+    if decode_pool is not None:
+        results = _predict_files_pooled(image_paths, decode_pool.batch_size, decode_pool, embed)
+    else:
+        results = _predict_files(image_paths, batch_size, decode_threads, embed)
+    if with_timers:
+        return results
+    return (result for result, _ in results)
+
+
+def _predict_files(image_paths, batch_size: int, decode_threads: int, embed: bool):
+    get_backend()
+    run_batch = embed_batch if embed else predict_batch
+
+    def new_buffer():
+        return np.empty((batch_size, 3, IMG_SIZE, IMG_SIZE), dtype=np.float32)
+
+    with ThreadPoolExecutor(max_workers=decode_threads, thread_name_prefix="decode") as executor:
+        inflight = deque()
+        chunk = []
+        buffer = new_buffer()
+
+        for image_path in image_paths:
+            chunk.append(executor.submit(_load_for_batch, image_path, buffer[len(chunk)], not embed))
+            if len(chunk) == batch_size:
+                inflight.append((chunk, buffer))
+                chunk = []
+                buffer = new_buffer()
+                # 最多预取一批，避免一次性解码整个目录占满内存
+                if len(inflight) > 1:
+                    yield from _run_inflight_batch(inflight.popleft(), run_batch)
+
+        if chunk:
+            inflight.append((chunk, buffer))
+        while inflight:
+            yield from _run_inflight_batch(inflight.popleft(), run_batch)
+
+
+def _run_inflight_batch(inflight, run_batch):
+    futures, buffer = inflight
+    return _run_loaded_batch([future.result() for future in futures], buffer, run_batch)
+
+
+def _predict_files_pooled(image_paths, batch_size: int, pool: DecodePool, embed: bool):
+    """
+    解码进程池版本：解码进程把图片写入共享内存中的批次槽，本线程依次对填满的槽做前向
+    """
+    get_backend()
+    run_batch = embed_batch if embed else predict_batch
+    version = None
+    if not embed and _result_cache is not None:
+        version = cache_version()
+
+    for batch, items in pool.batches(image_paths, version):
+        loaded = []
+        for item in items:
+            result = None
+            if item["key"] is not None and item["error"] is None:
+                result = _result_cache.get(item["key"])
+                item["timer"].cached = result is not None
+            array = batch if item["error"] is None and result is None else None
+            loaded.append({**item, "array": array, "result": result})
+        yield from _run_loaded_batch(loaded, batch, run_batch)
+
+
+def swap_backend(backend):
+    """
+    替换进程内的后端；已经取得旧后端的批次继续用旧模型完成
+    """
+    global _backend_cache
+    with _backend_lock:
+        _backend_cache = backend
+    _invalidate_cache()
+
+
+def swap_index(index):
+    global _product_index
+    with _backend_lock:
+        _product_index = index
+    _invalidate_cache()
+
+
+def _invalidate_cache():
+    if _result_cache is not None:
+        version = cache_version()
+        if version:
+            _result_cache.forget_other_versions(version)
+
+
+def _log_event(event: dict):
+    print(json.dumps(event, ensure_ascii=False), file=sys.stderr, flush=True)
+
+
+class ModelWatcher:
+    """
+    常驻模式下的模型热更新：每隔 interval 秒检查当前模型版本（./models/CURRENT，见 model_store.py）
+    与商品索引，有变化时在后台线程加载并预热，完成后替换进程内的后端 / 索引
+    - 加载与预热期间请求照常使用旧模型；已经开始的批次用旧模型完成，替换之后的批次使用新模型
+    - 没有版本目录、直接覆盖 ./models 下文件时，连续两次检查看到相同的文件元信息才加载，避免读到写了一半的文件
+    - 加载失败时继续使用旧模型，错误记录在 stats 中，同一版本不会反复重试
+    """
+
+    def __init__(self, interval: float = 10.0):
+        self.interval = interval
+        self.reloads = 0
+        self.index_reloads = 0
+        self.last_reload = None
+        self.last_error = None
+
+        self._pending = None
+        self._failed = None
+        self._check_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name="model-watcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                self.last_error = str(e)
+                _log_event({"modelWatcherError": str(e)})
+
+    def check(self):
+        """
+        检查一次，有更新时加载并替换，返回是否替换了模型或索引
+        """
+        with self._check_lock:
+            index_changed = self._check_index()
+            model_changed = self._check_model()
+        return index_changed or model_changed
+
+    def _check_model(self):
+        backend = get_backend()
+        backend_cls = type(backend)
+        model_dir = model_store.current_dir()
+        version = _backend_version(backend_cls, model_dir)
+        if version is None or version == backend.version:
+            self._pending = None
+            return False
+        if model_dir == model_store.MODEL_DIR and version != self._pending:
+            # 文件被直接覆盖，等下一次检查确认写入已经结束
+            self._pending = version
+            return False
+        if version == self._failed:
+            return False
+
+        self._pending = None
+        start = time.perf_counter()
+        try:
+            new_backend = load_backend(backend_cls, model_dir)
+            warmup(new_backend)
+        except Exception as e:
+            self._failed = version
+            self.last_error = f"加载模型失败（{model_dir}）: {e}"
+            _log_event({"modelReloadError": self.last_error})
+            return False
+
+        swap_backend(new_backend)
+        self.reloads += 1
+        self.last_reload = {
+            "version": version,
+            "modelDir": model_dir,
+            "loadMs": round((time.perf_counter() - start) * 1000.0, 1),
+            "at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        _log_event({"modelReloaded": self.last_reload})
+        self._warn_stale_index(model_dir)
+        return True
+
+    def _check_index(self):
+        index = _product_index
+        if index is None:
+            return False
+        version = _index_version(index.index_dir)
+        if version is None or version == index.version:
+            return False
+
+        new_index = VectorIndex(index.index_dir, index.nprobe)
+        # 加载期间索引又被替换时，可能读到前后两个索引的文件，下一次检查再加载
+        if _index_version(index.index_dir) != version:
+            return False
+        new_index.version = version
+        swap_index(new_index)
+        self.index_reloads += 1
+        _log_event({"indexReloaded": {"indexDir": index.index_dir, "count": len(new_index)}})
+        return True
+
+    def _warn_stale_index(self, model_dir: str):
+        """
+        商品索引中的特征由旧模型提取，换模型后需要重新运行 embed_products.py
+        """
+        index = _product_index
+        if index is None:
+            return
+        built_with = index.header.get("modelVersion")
+        if built_with and built_with != model_store.file_identity(model_artifact.resnet_files(model_dir)[0]):
+            _log_event({"warning": "商品索引由旧模型生成，请重新运行 python embed_products.py"})
+
+    def stats(self):
+        backend = _backend_cache
+        return {
+            "version": backend.version if backend is not None else None,
+            "modelDir": backend.model_dir if backend is not None else None,
+            "reloads": self.reloads,
+            "indexReloads": self.index_reloads,
+            "lastReload": self.last_reload,
+            "lastError": self.last_error,
+        }
+
+
+def start_model_watcher(interval: float):
+    global _model_watcher
+    _model_watcher = ModelWatcher(interval).start()
+    return _model_watcher
+
+
+def cascade_stats():
+    return _backend_cache.stats() if isinstance(_backend_cache, CascadeBackend) else None
+
+
+def server_stats(batcher: MicroBatcher = None):
+    stats = batcher.stats() if batcher is not None else {}
+    if _result_cache is not None:
+        stats["cache"] = cache_stats()
+    if cascade_stats() is not None:
+        stats["cascade"] = cascade_stats()
+    if _model_watcher is not None:
+        stats["model"] = _model_watcher.stats()
+    if _load_shedder is not None:
+        stats["shedding"] = _load_shedder.stats()
+    return stats
+
+
+def handle_request(request: dict, batcher: MicroBatcher = None, timer: StageTimer = None, deadline: float = None):
+    """
+    处理常驻模式下的单个请求，异常统一转成 {"error": ...}
+    有 batcher 时把预处理好的图片交给微批处理，与其他并发请求合并前向
+    timer 不为空时记录各阶段耗时；deadline（time.monotonic() 时间）已过的请求不再解码和前向
+    """
+    response = {}
+    if "id" in request:
+        response["id"] = request["id"]
+
+    try:
+        if request.get("cmd") == "stats":
+            response["stats"] = server_stats(batcher)
+            return response
+        if request.get("cmd") == "reload":
+            # 立即检查模型版本（不必等下一次定时检查），加载完成后才返回
+            if _model_watcher is None:
+                raise ValueError("当前进程没有开启模型热更新")
+            response["reloaded"] = _model_watcher.check()
+            response["model"] = _model_watcher.stats()
+            return response
+        if request.get("cmd") == "metrics":
+            # 指标快照（JSON），多进程模式下由前端合并后输出
+            if _metrics is None:
+                raise ValueError("当前进程没有开启指标（--metrics-port / --metrics-file）")
+            response["metrics"] = _metrics.snapshot()
+            return response
+
+        if not is_image_request(request):
+            raise ValueError("请求缺少 image、imageBase64 或 shm 字段")
+        if deadline is not None and time.monotonic() >= deadline:
+            raise DeadlineExceeded("请求在开始处理前已超过截止时间")
+
+        data = request_image_bytes(request, timer)
+        if request.get("embed"):
+            response.update(embed_bytes(data, timer))
+            return response
+
+        infer = None
+        if batcher is not None:
+            infer = lambda array: batcher.submit((array, timer, time.perf_counter()), deadline).result()
+        response.update(recognize_bytes(data, infer, timer))
+    except DeadlineExceeded as e:
+        return shed_response(request, "expired", str(e))
+    except Exception as e:
+        response["error"] = str(e)
+
+    return response
+
+
+def serve_stream(
+    rfile,
+    wfile,
+    batcher: MicroBatcher = None,
+    executor: ThreadPoolExecutor = None,
+    dispatch=None,
+    forwarded: bool = False,
+):
+    """
+    逐行读取 JSON 请求并逐行写回 JSON 响应，直到输入结束
+    提供 executor 时请求并发处理（响应可能乱序，靠 id 对应）
+    提供 dispatch（请求 -> 响应的 Future）时请求交给它处理，例如多进程模式下转发给 worker：
+    截止时间与在途请求上限在前端读到请求时检查，截止时间随请求转发，排队等待 worker 的时间同样计入 timeoutMs
+    forwarded 为 True 时输入来自多进程模式的前端，使用请求中转发的截止时间
+    """
+    write_lock = threading.Lock()
+    pending = set()
+
+    def write(line: str):
+        # 对端已断开时丢弃响应：写入可能发生在 Future 的回调中，异常不会传给任何调用方
+        try:
+            with write_lock:
+                wfile.write(line + "\n")
+                wfile.flush()
+        except (OSError, ValueError):
+            pass
+
+    def write_dispatched(done, request: dict, admitted: bool):
+        pending.discard(done)
+        if admitted:
+            _load_shedder.release()
+        error = done.exception()
+        if error is not None:
+            response = {"id": request["id"]} if "id" in request else {}
+            response["error"] = f"请求处理失败: {error}"
+        else:
+            response = done.result()
+            if request.get("cmd") == "stats" and _load_shedder is not None and "stats" in response:
+                # worker 的 shedding 统计只包含已转发的请求，前端拒绝的请求记在这里
+                response["stats"]["frontShedding"] = _load_shedder.stats()
+        write(dump_response(response))
+
+    def process(request, deadline=None):
+        timer = StageTimer() if is_image_request(request) else None
+        response = handle_request(request, batcher, timer, deadline)
+        write(dump_response(response, timer, request.get("timings", _include_timings)))
+
+    def process_admitted(request, deadline):
+        try:
+            process(request, deadline)
+        finally:
+            _load_shedder.release()
+
+    def submit(request: dict):
+        if not forwarded:
+            # 截止时间字段只由前端写入，客户端带来的忽略
+            request.pop(FORWARDED_DEADLINE_KEY, None)
+
+        # 识别请求在读到时确定截止时间；在途请求已满时立即拒绝，不进入排队
+        deadline, admitted = None, False
+        if is_image_request(request):
+            try:
+                deadline = request_deadline(request, forwarded)
+            except (TypeError, ValueError):
+                response = {"id": request["id"]} if "id" in request else {}
+                write(dump_response({**response, "error": "timeoutMs 必须是数字"}))
+                return
+            if _load_shedder is not None:
+                if not _load_shedder.admit():
+                    write(dump_response(shed_response(request, "overloaded", "推理服务繁忙，请稍后重试")))
+                    return
+                admitted = True
+
+        if dispatch is not None:
+            if deadline is not None:
+                request = {**request, FORWARDED_DEADLINE_KEY: deadline}
+            try:
+                future = dispatch(request)
+            except BaseException:
+                if admitted:
+                    _load_shedder.release()
+                raise
+            pending.add(future)
+            future.add_done_callback(lambda done: write_dispatched(done, request, admitted))
+            return
+
+        task = process_admitted if admitted else process
+        if executor is None:
+            task(request, deadline)
+        else:
+            future = executor.submit(task, request, deadline)
+            pending.add(future)
+            future.add_done_callback(pending.discard)
+
+    for line in rfile:
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as e:
+            with write_lock:
+                wfile.write(json.dumps({"error": f"无效的 JSON 请求: {e}"}, ensure_ascii=False) + "\n")
+                wfile.flush()
+            continue
+        if not isinstance(request, dict):
+            write(dump_response({"error": f"请求必须是 JSON 对象，收到 {type(request).__name__}"}))
+            continue
+
+        # 单个请求出错只返回该请求的错误，不结束读取循环，也不影响在途请求
+        try:
+            submit(request)
+        except Exception as e:
+            response = {"id": request["id"]} if "id" in request else {}
+            write(dump_response({**response, "error": str(e)}))
+
+    # 输入结束后等待本连接上尚未完成的请求写回响应
+    wait(list(pending))
+
+
+def serve_socket(socket_path: str, batcher: MicroBatcher = None, executor: ThreadPoolExecutor = None, dispatch=None):
+    """
+    在 Unix socket 上提供服务，每个连接一个线程，连接内按行收发 JSON
+    """
+    import socketserver
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            rfile = io.TextIOWrapper(self.rfile, encoding="utf-8")
+            wfile = io.TextIOWrapper(self.wfile, encoding="utf-8", write_through=True)
+            serve_stream(rfile, wfile, batcher, executor, dispatch)
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    with socketserver.ThreadingUnixStreamServer(socket_path, Handler) as server:
+        server.daemon_threads = True
+        print(json.dumps({"ready": True, "socket": socket_path}), flush=True)
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(socket_path)
+
+
+def serve(
+    socket_path: str = None,
+    max_batch_size: int = 8,
+    window_ms: float = 10.0,
+    workers: int = 8,
+    report_startup: bool = False,
+    watch_interval: float = 10.0,
+):
+    warmup(get_backend())
+    _import_pil_image()
+    if report_startup:
+        print_startup_report()
+    watcher = start_model_watcher(watch_interval)
+    exporter = start_metrics_exporter()
+
+    batcher = MicroBatcher(predict_queued, max_batch_size=max_batch_size, window_ms=window_ms).start()
+    # 请求的读取、解码在线程池中并发进行，前向由 batcher 合并执行
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="request")
+
+    try:
+        if socket_path:
+            serve_socket(socket_path, batcher, executor)
+        else:
+            print(json.dumps({"ready": True}), flush=True)
+            serve_stream(sys.stdin, sys.stdout, batcher, executor)
+    finally:
+        watcher.stop()
+        executor.shutdown(wait=True)
+        batcher.stop()
+        if exporter is not None:
+            exporter.stop()
+        print(json.dumps({"stats": server_stats(batcher)}, ensure_ascii=False), file=sys.stderr, flush=True)
+
+
+def serve_prefork(
+    processes: int,
+    socket_path: str = None,
+    max_batch_size: int = 8,
+    window_ms: float = 10.0,
+    workers: int = 8,
+    report_startup: bool = False,
+    watch_interval: float = 10.0,
+):
+    """
+    预 fork 多进程服务（见 prefork.py）：父进程加载一次模型但不做前向，
+    fork 出的 worker 共享权重内存，各自绑定一组核心、预热后按常驻模式处理请求
+    """
+    import prefork
+
+    backend_cls = BACKENDS[_backend_name]
+    if not backend_cls.fork_safe:
+        raise ValueError(f"{backend_cls.name} 后端不支持多进程模式，请使用 PyTorch 后端")
+
+    # 父进程中不做前向：避免在 fork 之前初始化 intra-op 线程池，也避免触碰权重页
+    get_backend()
+    _import_pil_image()
+    # SQLite 连接不能跨 fork 使用：父进程不处理请求，fork 之前关闭，每个 worker 打开自己的连接
+    if _result_cache is not None:
+        _result_cache.close()
+
+    def worker_main(conn, cores):
+        prefork.pin_to_cores(cores)
+        if _result_cache is not None:
+            _result_cache.reopen()
+        if "torch" in sys.modules:
+            sys.modules["torch"].set_num_threads(_cpu_profile_overrides.get("intra_op_threads") or len(cores))
+
+        warmup(get_backend())
+        watcher = start_model_watcher(watch_interval)
+        batcher = MicroBatcher(predict_queued, max_batch_size=max_batch_size, window_ms=window_ms).start()
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="request")
+
+        rfile = conn.makefile("r", encoding="utf-8")
+        wfile = conn.makefile("w", encoding="utf-8")
+        wfile.write(json.dumps({"ready": True, "pid": os.getpid()}) + "\n")
+        wfile.flush()
+        try:
+            serve_stream(rfile, wfile, batcher, executor, forwarded=True)
+        finally:
+            watcher.stop()
+            executor.shutdown(wait=True)
+            batcher.stop()
+
+    pool = prefork.WorkerPool(processes, worker_main).start()
+    if report_startup:
+        print_startup_report()
+    # 指标由各 worker 分别累计，前端输出时广播 metrics 命令并合并
+    # 前端拒绝的请求只计入前端自己的指标，与各 worker 的指标一起合并
+    exporter = start_metrics_exporter(
+        lambda: render_snapshot(
+            merge_snapshots(
+                [
+                    pool.dispatch({"cmd": "metrics"}).result(timeout=30)["metrics"],
+                    _metrics.snapshot() if _metrics is not None else None,
+                ]
+            )
+        )
+    )
+
+    # 全部 worker 退出时结束前端，由调用方重新拉起
+    def exit_when_workers_gone():
+        pool.wait_all_exited()
+        _log_event({"error": "所有推理 worker 都已退出"})
+        os._exit(1)
+
+    threading.Thread(target=exit_when_workers_gone, name="prefork-monitor", daemon=True).start()
+
+    try:
+        if socket_path:
+            serve_socket(socket_path, dispatch=pool.dispatch)
+        else:
+            print(json.dumps({"ready": True, "processes": processes}), flush=True)
+            serve_stream(sys.stdin, sys.stdout, dispatch=pool.dispatch)
+    finally:
+        stats = pool.dispatch({"cmd": "stats"}).result()
+        print(json.dumps({"stats": stats}, ensure_ascii=False), file=sys.stderr, flush=True)
+        if exporter is not None:
+            exporter.stop()
+        pool.stop()
+
+
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--image", required=True, help="待识别图片路径")
+    parser.add_argument("--image", help="待识别图片路径（- 表示从 stdin 读取图片字节）")
+    parser.add_argument("--shm", help="待识别图片所在的共享内存文件名（/dev/shm 下，由调用方创建与删除）")
+    parser.add_argument(
+        "--backend",
+        choices=sorted(BACKENDS),
+        default=DEFAULT_BACKEND,
+        help="推理后端：pytorch（默认）、torchscript、pytorch-int8、onnxruntime 或 cascade（后四者需先导出对应模型）",
+    )
+    parser.add_argument(
+        "--quantized",
+        action="store_true",
+        help="使用 INT8 量化模型（等价于 --backend pytorch-int8，需先运行 quantize_model.py）",
+    )
+    parser.add_argument(
+        "--embed",
+        action="store_true",
+        help="输出 512 维图片特征（ResNet18 全局池化层）而不是识别结果，需 pytorch 后端",
+    )
+    parser.add_argument(
+        "--index",
+        default=os.environ.get("FISH_PRODUCT_INDEX"),
+        help="商品向量索引目录（embed_products.py 生成），识别结果附带视觉最相似的商品；"
+        "未指定时若 ./models/product_index 存在且后端支持则自动加载",
+    )
+    parser.add_argument("--similar-k", type=int, default=6, help="返回的相似商品数量")
+    parser.add_argument("--nprobe", type=int, default=8, help="IVF 索引每次查询扫描的分区数")
+    parser.add_argument(
+        "--cascade",
+        action="store_true",
+        help="级联推理：MobileNetV3-Small 先判断，置信度不足时再用 ResNet18（等价于 --backend cascade）",
+    )
+    parser.add_argument("--dir", help="批量模式：识别目录下（递归）的所有图片")
+    parser.add_argument("--manifest", help="批量模式：识别清单文件中列出的图片，每行一个路径")
+    parser.add_argument("--images", nargs="+", help="批量模式：识别多张图片")
+    parser.add_argument(
+        "--startup-report",
+        action="store_true",
+        help="在 stderr 输出启动耗时分解（导入、模型构建、权重加载、首次前向）",
+    )
+    parser.add_argument(
+        "--cpu-profile",
+        default=None,
+        help="CPU 执行配置文件（默认 ./models/cpu_profile.json，由 cpu_profile.py autotune 生成，也可用环境变量 FISH_CPU_PROFILE）",
+    )
+    parser.add_argument("--threads", type=int, default=None, help="intra-op 线程数，覆盖配置文件")
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        help="在每个结果中附带 timings 字段：读取、解码、缩放归一化、前向、后处理、序列化各阶段耗时（毫秒）",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=int(os.environ.get("FISH_METRICS_PORT", 0)) or None,
+        help="常驻 / 批量模式下在 127.0.0.1 的该端口提供 Prometheus 指标（GET /metrics），也可用环境变量 FISH_METRICS_PORT",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        default=os.environ.get("FISH_METRICS_FILE"),
+        help="常驻 / 批量模式下定期把 Prometheus 指标写入该文件（node_exporter textfile），也可用环境变量 FISH_METRICS_FILE",
+    )
+    parser.add_argument("--cache", action="store_true", help="开启识别结果缓存（进程内 LRU）")
+    parser.add_argument(
+        "--cache-dir",
+        default=os.environ.get("FISH_CACHE_DIR"),
+        help="磁盘缓存目录（开启后同时使用内存与磁盘两级缓存，也可用环境变量 FISH_CACHE_DIR）",
+    )
+    parser.add_argument("--cache-memory-entries", type=int, default=1024, help="内存缓存的最大条目数")
+    parser.add_argument("--cache-max-mb", type=float, default=512, help="磁盘缓存的最大大小（MB）")
+    parser.add_argument(
+        "--decoder",
+        choices=DECODERS,
+        default=None,
+        help="JPEG 解码器：pil（默认，按缩小尺寸解码）或 torchvision（decode_jpeg），也可用环境变量 FISH_DECODER",
+    )
+    parser.add_argument("--batch-size", type=int, default=16, help="批量模式下每次前向的图片数")
+    parser.add_argument("--decode-threads", type=int, default=4, help="批量模式下并行解码的线程数")
+    parser.add_argument(
+        "--decode-processes",
+        type=int,
+        default=int(os.environ.get("FISH_DECODE_PROCESSES", 0)),
+        help="批量模式下改用解码进程池（0 表示使用解码线程），解码结果经共享内存中的批次槽交给模型线程，"
+        "结束时在 stderr 输出解码 / 模型利用率（也可用环境变量 FISH_DECODE_PROCESSES）",
+    )
+    parser.add_argument("--decode-slots", type=int, default=3, help="解码进程池的共享内存批次槽数（至少 2）")
+    parser.add_argument("--serve", action="store_true", help="常驻服务模式，模型只加载一次")
+    parser.add_argument("--socket", help="常驻模式下监听的 Unix socket 路径（默认使用 stdin/stdout）")
+    parser.add_argument("--max-batch-size", type=int, default=8, help="常驻模式下单次批量前向的最大图片数")
+    parser.add_argument("--batch-window-ms", type=float, default=10.0, help="常驻模式下凑批的最长等待时间（毫秒）")
+    parser.add_argument("--workers", type=int, default=8, help="常驻模式下并发处理请求（读取、解码）的线程数")
+    parser.add_argument(
+        "--max-queue",
+        type=int,
+        default=int(os.environ.get("FISH_MAX_QUEUE", 64)),
+        help="常驻模式下的在途请求上限，超出时立即返回 overloaded（0 表示不限制，也可用环境变量 FISH_MAX_QUEUE；"
+        "多进程模式下为每个 worker 的上限）",
+    )
+    parser.add_argument(
+        "--default-timeout-ms",
+        type=float,
+        default=float(os.environ.get("FISH_REQUEST_TIMEOUT_MS", 0)),
+        help="常驻模式下请求未带 timeoutMs 时的截止时间（毫秒，0 表示不设，也可用环境变量 FISH_REQUEST_TIMEOUT_MS）",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=int(os.environ.get("FISH_SERVE_PROCESSES", 0)),
+        help="常驻模式下预 fork 的 worker 进程数（默认 0 表示不 fork，单进程处理；worker 共享模型内存、"
+        "各自绑定一组 CPU 核心，仅 Linux；也可用环境变量 FISH_SERVE_PROCESSES）",
+    )
+    parser.add_argument(
+        "--watch-interval",
+        type=float,
+        default=float(os.environ.get("FISH_MODEL_WATCH_INTERVAL", 10)),
+        help="常驻模式下检查模型新版本的间隔（秒），发现新版本后在后台加载并替换；0 表示关闭"
+        "（也可用环境变量 FISH_MODEL_WATCH_INTERVAL）",
+    )
     args = parser.parse_args()
 
+    batch_sources = [args.dir, args.manifest, args.images]
+    if not args.serve and not args.image and not args.shm and not any(batch_sources):
+        parser.error("需要指定 --image、--shm、--dir、--manifest、--images 或 --serve 之一")
+
+    if args.quantized:
+        if args.backend not in (TorchBackend.name, QuantizedTorchBackend.name):
+            parser.error("--quantized 只能与 pytorch 后端一起使用")
+        args.backend = QuantizedTorchBackend.name
+    if args.cascade:
+        if args.backend not in (TorchBackend.name, CascadeBackend.name):
+            parser.error("--cascade 不能与其他后端同时指定")
+        args.backend = CascadeBackend.name
+
+    set_backend(args.backend)
+    set_cpu_profile(args.cpu_profile, intra_op_threads=args.threads)
+    if args.decoder:
+        image_preprocess.set_decoder(args.decoder)
+
+    if args.embed and not BACKENDS[args.backend].supports_features:
+        parser.error("--embed 需使用 pytorch 后端")
+    if not args.embed:
+        try:
+            if args.index:
+                configure_index(args.index, args.similar_k, args.nprobe)
+            elif BACKENDS[args.backend].supports_features and index_exists(INDEX_DIR):
+                configure_index(INDEX_DIR, args.similar_k, args.nprobe)
+        except (FileNotFoundError, ValueError) as e:
+            print(json.dumps({"error": str(e)}, ensure_ascii=False), flush=True)
+            sys.exit(1)
+    if args.cache or args.cache_dir:
+        configure_cache(args.cache_dir, args.cache_memory_entries, args.cache_max_mb)
+    if args.metrics_port or args.metrics_file:
+        configure_metrics(args.metrics_port, args.metrics_file)
+    set_timings(args.timings)
+    if args.serve:
+        configure_shedding(args.max_queue, args.default_timeout_ms)
+
+    if args.serve and args.processes > 0:
+        try:
+            serve_prefork(
+                args.processes,
+                args.socket,
+                args.max_batch_size,
+                args.batch_window_ms,
+                args.workers,
+                args.startup_report,
+                args.watch_interval,
+            )
+        except KeyboardInterrupt:
+            pass
+        except Exception as e:
+            print(json.dumps({"error": str(e)}, ensure_ascii=False), flush=True)
+            sys.exit(1)
+        return
+
+    if args.serve:
+        try:
+            serve(
+                args.socket,
+                args.max_batch_size,
+                args.batch_window_ms,
+                args.workers,
+                args.startup_report,
+                args.watch_interval,
+            )
+        except KeyboardInterrupt:
+            pass
+        except Exception as e:
+            print(json.dumps({"error": str(e)}, ensure_ascii=False), flush=True)
+            sys.exit(1)
+        return
+
+    if any(batch_sources):
+        if args.dir:
+            image_paths = iter_dir_images(args.dir)
+        elif args.manifest:
+            image_paths = iter_manifest_images(args.manifest)
+        else:
+            image_paths = args.images
+
+        exporter = start_metrics_exporter()
+        pool = None
+        try:
+            # 解码进程在加载模型之前 fork
+            if args.decode_processes > 0:
+                pool = DecodePool(args.decode_processes, args.batch_size, args.decode_slots, metrics=_metrics)
+            results = predict_files(
+                image_paths, args.batch_size, args.decode_threads, args.embed, with_timers=True, decode_pool=pool
+            )
+            for result, timer in results:
+                print(dump_response(result, timer, args.timings), flush=True)
+        except Exception as e:
+            print(json.dumps({"error": str(e)}, ensure_ascii=False), flush=True)
+            sys.exit(1)
+        finally:
+            if exporter is not None:
+                exporter.stop()
+            if pool is not None:
+                pool.close()
+        if pool is not None:
+            print(json.dumps({"pipeline": pool.stats()}), file=sys.stderr, flush=True)
+        if _result_cache is not None:
+            print(json.dumps({"cache": cache_stats()}), file=sys.stderr, flush=True)
+        if cascade_stats() is not None:
+            print(json.dumps({"cascade": cascade_stats()}), file=sys.stderr, flush=True)
+        if args.startup_report:
+            print_startup_report()
+        return
+
+    timer = StageTimer()
     try:
-        result = predict(args.image)
-        print(json.dumps(result, ensure_ascii=False))
+        with stage(timer, "read"):
+            data = read_shm_bytes(args.shm) if args.shm else read_image_bytes(args.image)
+        result = embed_bytes(data, timer) if args.embed else recognize_bytes(data, timer=timer)
     except Exception as e:
         # 出错时也输出 JSON，方便后端统一处理
-        error_obj = {"error": str(e)}
-        print(json.dumps(error_obj, ensure_ascii=False))
+        result = {"error": str(e)}
+    print(dump_response(result, timer, args.timings))
+
+    if args.startup_report:
+        print_startup_report()
 
 
 if __name__ == "__main__":
     main()
-
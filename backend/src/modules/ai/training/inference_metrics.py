@@ -0,0 +1,326 @@
+"""
+识别请求的分阶段耗时与 Prometheus 指标
+
+识别变慢时只看总耗时无法判断瓶颈在解码还是模型，这里把一次识别拆成以下阶段分别计时：
+
+    read          读取图片文件
+    decode        图片解压（JPEG 按缩小尺寸解码，见 image_preprocess.py）
+    preprocess    缩放到 224x224 与归一化
+    forward       模型前向（含 softmax；常驻模式下为该请求所在批次的前向耗时）
+    postprocess   top-k 排序、整理结果与相似商品检索
+    serialize     输出 JSON 序列化
+    queue         常驻模式下等待凑批的时间
+    cache         查询结果缓存（计算图片哈希）
+    load          单次调用时模型加载与 PIL 导入（常驻模式下启动时已完成）
+
+- StageTimer 记录单个请求各阶段的耗时（毫秒），可以附加在响应的 timings 字段中
+- InferenceMetrics 累计所有请求，生成 Prometheus 文本格式的计数器与直方图；
+  snapshot() 可以序列化为 JSON，多个进程的快照用 merge_snapshots 合并（预 fork 模式下由前端汇总）
+- 批量模式使用解码进程池（decode_pool.py）时，另有解码进程与模型线程的忙碌 / 等待时间计数器
+- MetricsExporter 在本机端口上提供 /metrics，或定期写入文件（node_exporter textfile collector）
+
+用法：
+    python infer_pytorch.py --serve --metrics-port 9464          # curl http://127.0.0.1:9464/metrics
+    python infer_pytorch.py --dir uploads/ --metrics-file /var/lib/node_exporter/fish.prom
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+
+STAGES = ("load", "read", "decode", "preprocess", "forward", "postprocess", "serialize", "queue", "cache")
+
+# 直方图桶的上界（秒 / 张）
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+# 指标名 -> (类型, 说明, 直方图桶)
+METRICS = {
+    "fish_inference_requests_total": ("counter", "识别请求数（status 为 ok / error / shed）", None),
+    "fish_inference_cache_hits_total": ("counter", "命中结果缓存的识别请求数", None),
+    "fish_inference_shed_total": ("counter", "被丢弃的识别请求数（reason 为 overloaded / expired）", None),
+    "fish_inference_request_seconds": ("histogram", "单个识别请求的总耗时", LATENCY_BUCKETS),
+    "fish_inference_stage_seconds": ("histogram", "识别请求各阶段的耗时", LATENCY_BUCKETS),
+    "fish_inference_batch_size": ("histogram", "每次前向的图片数", BATCH_SIZE_BUCKETS),
+    "fish_inference_decoder_busy_seconds_total": ("counter", "解码进程池中各进程忙碌时间之和", None),
+    "fish_inference_model_busy_seconds_total": ("counter", "解码进程池模式下模型线程处理批次的时间", None),
+    "fish_inference_model_wait_seconds_total": ("counter", "解码进程池模式下模型线程等待解码完成的时间", None),
+}
+
+DEFAULT_FILE_INTERVAL = 15.0
+
+
+class StageTimer:
+    """
+    单个请求各阶段的耗时（毫秒），同名阶段累加
+    一个请求的计时器会依次经过请求线程与批处理线程，但不会被同时使用
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.total_ms = None
+        self.cached = False
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - start) * 1000.0)
+
+    def add(self, name: str, ms: float):
+        self.stages[name] = self.stages.get(name, 0.0) + ms
+
+    def finish(self):
+        self.total_ms = (time.perf_counter() - self.start) * 1000.0
+        return self.total_ms
+
+    def as_dict(self):
+        """
+        按 STAGES 的顺序输出（毫秒），最后是 total
+        """
+        names = [name for name in STAGES if name in self.stages]
+        names += [name for name in self.stages if name not in STAGES]
+        timings = {name: round(self.stages[name], 3) for name in names}
+        timings["total"] = round(self.total_ms if self.total_ms is not None else self.finish(), 3)
+        return timings
+
+
+def stage(timer: StageTimer, name: str):
+    """
+    timer 为 None 时不计时
+    """
+    if timer is None:
+        return nullcontext()
+    return timer.stage(name)
+
+
+def _labels(**labels):
+    return ",".join(f'{key}="{value}"' for key, value in labels.items())
+
+
+class InferenceMetrics:
+    """
+    进程内累计的指标，线程安全
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def observe_request(self, timer: StageTimer, status: str = "ok"):
+        total_ms = timer.total_ms if timer.total_ms is not None else timer.finish()
+        with self._lock:
+            self._inc("fish_inference_requests_total", _labels(status=status))
+            if timer.cached:
+                self._inc("fish_inference_cache_hits_total", "")
+            self._observe("fish_inference_request_seconds", "", total_ms / 1000.0)
+            for name, ms in timer.stages.items():
+                self._observe("fish_inference_stage_seconds", _labels(stage=name), ms / 1000.0)
+
+    def observe_shed(self, reason: str):
+        with self._lock:
+            self._inc("fish_inference_shed_total", _labels(reason=reason))
+
+    def observe_batch(self, size: int):
+        with self._lock:
+            self._observe("fish_inference_batch_size", "", size)
+
+    def observe_pipeline(self, decoder_busy: float = 0.0, model_busy: float = 0.0, model_wait: float = 0.0):
+        """
+        解码进程池的忙碌 / 等待时间（秒），按主机比较两者的增长速度即可判断解码进程是否够用
+        """
+        with self._lock:
+            self._inc("fish_inference_decoder_busy_seconds_total", "", decoder_busy)
+            self._inc("fish_inference_model_busy_seconds_total", "", model_busy)
+            self._inc("fish_inference_model_wait_seconds_total", "", model_wait)
+
+    def snapshot(self):
+        """
+        可序列化为 JSON 的副本：{"counters": {名称: {标签: 值}}, "histograms": {名称: {标签: {...}}}}
+        """
+        with self._lock:
+            return {
+                "counters": {name: dict(series) for name, series in self._counters.items()},
+                "histograms": {
+                    name: {
+                        labels: {"counts": list(item["counts"]), "sum": item["sum"], "count": item["count"]}
+                        for labels, item in series.items()
+                    }
+                    for name, series in self._histograms.items()
+                },
+            }
+
+    def render(self):
+        return render_snapshot(self.snapshot())
+
+    def _inc(self, name: str, labels: str, value: float = 1):
+        series = self._counters.setdefault(name, {})
+        series[labels] = series.get(labels, 0) + value
+
+    def _observe(self, name: str, labels: str, value: float):
+        buckets = METRICS[name][2]
+        series = self._histograms.setdefault(name, {})
+        item = series.get(labels)
+        if item is None:
+            item = series[labels] = {"counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                item["counts"][i] += 1
+                break
+        item["sum"] += value
+        item["count"] += 1
+
+
+def merge_snapshots(snapshots):
+    """
+    合并多个进程的快照（计数与直方图逐项相加）
+    """
+    merged = {"counters": {}, "histograms": {}}
+    for snapshot in snapshots:
+        if not snapshot:
+            continue
+        for name, series in snapshot.get("counters", {}).items():
+            target = merged["counters"].setdefault(name, {})
+            for labels, value in series.items():
+                target[labels] = target.get(labels, 0) + value
+        for name, series in snapshot.get("histograms", {}).items():
+            target = merged["histograms"].setdefault(name, {})
+            for labels, item in series.items():
+                if labels not in target:
+                    target[labels] = {"counts": list(item["counts"]), "sum": item["sum"], "count": item["count"]}
+                    continue
+                current = target[labels]
+                current["counts"] = [a + b for a, b in zip(current["counts"], item["counts"])]
+                current["sum"] += item["sum"]
+                current["count"] += item["count"]
+    return merged
+
+
+def _format_bound(bound):
+    return str(int(bound)) if float(bound).is_integer() and bound >= 1 else repr(float(bound))
+
+
+def _series(name: str, labels: str, extra: str = ""):
+    labels = ",".join(part for part in (labels, extra) if part)
+    return f"{name}{{{labels}}}" if labels else name
+
+
+def render_snapshot(snapshot: dict):
+    """
+    Prometheus 文本格式（直方图桶为累计计数）
+    """
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        if kind == "counter":
+            series = snapshot.get("counters", {}).get(name)
+            if not series:
+                continue
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            for labels, value in sorted(series.items()):
+                lines.append(f"{_series(name, labels)} {value}")
+        else:
+            series = snapshot.get("histograms", {}).get(name)
+            if not series:
+                continue
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+            for labels, item in sorted(series.items()):
+                cumulative = 0
+                for bound, count in zip(buckets, item["counts"]):
+                    cumulative += count
+                    le = _labels(le=_format_bound(bound))
+                    lines.append(f"{_series(name + '_bucket', labels, le)} {cumulative}")
+                lines.append(f"{_series(name + '_bucket', labels, _labels(le='+Inf'))} {item['count']}")
+                lines.append(f"{_series(name + '_sum', labels)} {item['sum']:.6f}")
+                lines.append(f"{_series(name + '_count', labels)} {item['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def write_text_atomic(path: str, text: str):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+class MetricsExporter:
+    """
+    输出指标：port 不为空时在 127.0.0.1:port 上提供 GET /metrics，
+    path 不为空时每隔 interval 秒把指标写入文件（写临时文件后原子替换），stop 时再写一次
+    collect 返回 Prometheus 文本
+    """
+
+    def __init__(self, collect, port: int = None, path: str = None, interval: float = DEFAULT_FILE_INTERVAL):
+        self.collect = collect
+        self.port = port
+        self.path = path
+        self.interval = interval
+        self._server = None
+        self._threads = []
+        self._stop = threading.Event()
+
+    def start(self):
+        if self.port:
+            self._start_server()
+        if self.path:
+            thread = threading.Thread(target=self._write_loop, name="metrics-file", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        for thread in self._threads:
+            thread.join(timeout=5.0)
+        if self.path:
+            self.write_file()
+
+    def write_file(self):
+        write_text_atomic(self.path, self.collect())
+
+    def _write_loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write_file()
+            except Exception:
+                pass
+
+    def _start_server(self):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        collect = self.collect
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                try:
+                    body = collect().encode("utf-8")
+                except Exception as e:
+                    self.send_error(500, str(e))
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", self.port), Handler)
+        self._server.daemon_threads = True
+        thread = threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True)
+        thread.start()
+        self._threads.append(thread)
@@ -0,0 +1,252 @@
+"""
+线性探测（train_pytorch.py --linear-probe）：冻结主干，只训练分类头
+
+CPU 上完整微调 ResNet18 20 轮需要数小时，而新增一个鱼类品种时通常只需要重新训练最后的 fc 层：
+- 用预训练主干（ImageNet 权重，或 --probe-backbone current 使用当前版本模型的主干）对数据集做一次前向，
+  得到每张图片全局池化后的 512 维特征并保存到磁盘；--probe-augment N 额外保存 N 份数据增强后的训练集特征
+- 在特征上训练 fc 层（几秒钟），取验证集准确率最高的一轮
+- 主干 + 新的 fc 层组成完整的 ResNet18，保存为普通的单文件模型（见 model_artifact.py），推理端无需任何改动
+
+特征缓存按数据集文件清单、主干、划分与增强份数计算键，只要这些不变，再次训练分类头时不需要再跑主干。
+"""
+
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+import model_artifact
+
+
+FEATURE_CACHE_DIR = "./data/fish_features_cache"
+BACKBONES = ("imagenet", "current")
+HEAD_EPOCHS = 300
+HEAD_LR = 1e-2
+HEAD_WEIGHT_DECAY = 1e-4
+HEAD_BATCH_SIZE = 256
+
+
+def load_backbone(name: str, num_classes: int):
+    """
+    返回 (ResNet18, 主干标识)：imagenet 为 torchvision 预训练权重，current 为当前版本模型
+    """
+    from train_pytorch import create_model
+
+    if name == "current":
+        files = model_artifact.resnet_files()
+        if len(files) != 1 or not os.path.isfile(files[0]):
+            raise RuntimeError("当前版本没有单文件模型，无法使用 --probe-backbone current")
+        state_dict, meta = model_artifact.load_artifact(files[0])
+        model = create_model(meta["numClasses"], "resnet18", pretrained=False)
+        model.load_state_dict(state_dict)
+        return model, f"current:{meta['sha256']}"
+
+    return create_model(num_classes, "resnet18", pretrained=True), "imagenet:IMAGENET1K_V1"
+
+
+def extract_features(backbone, dataset, device, batch_size: int, workers: int):
+    """
+    主干前向（fc 之前）得到 [N, 512] 特征与 [N] 标签
+    """
+    import torch
+    from torch.utils.data import DataLoader
+
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=workers)
+    features, labels = [], []
+    backbone.eval()
+    with torch.no_grad():
+        for inputs, targets in loader:
+            features.append(backbone(inputs.to(device)).float().cpu().numpy())
+            labels.append(targets.numpy())
+    if not features:
+        return np.empty((0, 512), dtype=np.float32), np.empty((0,), dtype=np.int64)
+    return np.concatenate(features), np.concatenate(labels).astype(np.int64)
+
+
+def cache_key(data_dir: str, backbone_id: str, train_indices, val_indices, augment: int, cached_dataset: bool):
+    """
+    特征缓存键：数据集文件清单（路径、大小、修改时间）+ 主干 + 训练 / 验证集划分 + 增强份数
+    """
+    from dataset_cache import file_entries, scan_dataset
+
+    _, _, samples = scan_dataset(data_dir)
+    digest = hashlib.sha256()
+    digest.update(json.dumps(file_entries(data_dir, samples)).encode("utf-8"))
+    digest.update(backbone_id.encode("utf-8"))
+    digest.update(np.asarray(train_indices, dtype=np.int64).tobytes())
+    digest.update(np.asarray(val_indices, dtype=np.int64).tobytes())
+    digest.update(f"augment={augment};cached={cached_dataset}".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def load_or_extract_features(train_loader, val_loader, backbone, backbone_id, device, args):
+    """
+    返回 {"train_x", "train_y", "val_x", "val_y"}，以及是否命中特征缓存
+    训练集特征包括 1 份不做增强的特征（与验证集相同的预处理）和 args.probe_augment 份增强后的特征
+    """
+    from torch.utils.data import Subset
+
+    from train_pytorch import DATA_DIR
+
+    train_subset, val_subset = train_loader.dataset, val_loader.dataset
+    key = cache_key(
+        DATA_DIR,
+        backbone_id,
+        train_subset.indices,
+        val_subset.indices,
+        args.probe_augment,
+        bool(args.dataset_cache),
+    )
+    path = os.path.join(FEATURE_CACHE_DIR, f"features-{key}.npz")
+    if os.path.isfile(path):
+        with np.load(path) as data:
+            return {name: data[name] for name in data.files}, True
+
+    workers = train_loader.num_workers
+    batch_size = train_loader.batch_size
+    # 不做增强的训练集特征：用验证集的 Dataset（无增强）取训练集的下标
+    plain_train = Subset(val_subset.dataset, train_subset.indices)
+    parts_x, parts_y = [], []
+    for view in range(1 + args.probe_augment):
+        dataset = plain_train if view == 0 else train_subset
+        x, y = extract_features(backbone, dataset, device, batch_size, workers)
+        parts_x.append(x)
+        parts_y.append(y)
+        print(f"   提取训练集特征 {view + 1}/{1 + args.probe_augment}: {len(x)} 张")
+    val_x, val_y = extract_features(backbone, val_subset, device, batch_size, workers)
+
+    features = {
+        "train_x": np.concatenate(parts_x),
+        "train_y": np.concatenate(parts_y),
+        "val_x": val_x,
+        "val_y": val_y,
+    }
+    os.makedirs(FEATURE_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path, **features)
+    os.replace(tmp_path, path)
+    return features, False
+
+
+def train_head(features: dict, num_classes: int, epochs: int = HEAD_EPOCHS, lr: float = HEAD_LR):
+    """
+    在特征上训练 fc 层，返回 (验证集准确率最高时的 fc state_dict, 指标)
+    """
+    import torch
+    import torch.nn as nn
+
+    train_x = torch.from_numpy(features["train_x"])
+    train_y = torch.from_numpy(features["train_y"])
+    val_x = torch.from_numpy(features["val_x"])
+    val_y = torch.from_numpy(features["val_y"])
+
+    head = nn.Linear(train_x.shape[1], num_classes)
+    criterion = nn.CrossEntropyLoss()
+    optimizer = torch.optim.Adam(head.parameters(), lr=lr, weight_decay=HEAD_WEIGHT_DECAY)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=epochs)
+
+    best_state, best = None, None
+    for epoch in range(1, epochs + 1):
+        head.train()
+        order = torch.randperm(len(train_x))
+        total_loss = 0.0
+        for start in range(0, len(order), HEAD_BATCH_SIZE):
+            batch = order[start : start + HEAD_BATCH_SIZE]
+            optimizer.zero_grad()
+            loss = criterion(head(train_x[batch]), train_y[batch])
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item() * len(batch)
+        scheduler.step()
+
+        head.eval()
+        with torch.no_grad():
+            train_acc = (head(train_x).argmax(1) == train_y).float().mean().item()
+            if len(val_x):
+                val_logits = head(val_x)
+                val_loss = criterion(val_logits, val_y).item()
+                val_acc = (val_logits.argmax(1) == val_y).float().mean().item()
+            else:
+                val_loss, val_acc = 0.0, train_acc
+        if best is None or val_acc > best["valAcc"]:
+            best_state = {name: value.clone() for name, value in head.state_dict().items()}
+            best = {
+                "epoch": epoch,
+                "epochs": epochs,
+                "trainLoss": total_loss / max(len(order), 1),
+                "trainAcc": train_acc,
+                "valLoss": val_loss,
+                "valAcc": val_acc,
+            }
+    return best_state, best
+
+
+def current_model_metrics():
+    """
+    当前版本模型记录的训练指标（用于与完整微调对比），没有时返回 None
+    """
+    files = model_artifact.resnet_files()
+    if len(files) != 1 or not os.path.isfile(files[0]):
+        return None
+    try:
+        meta = model_artifact.read_metadata(files[0])
+    except ValueError:
+        return None
+    return meta.get("metrics") or None
+
+
+def run(args, train_loader, val_loader, num_classes: int, class_to_idx: dict, model_path: str, device):
+    """
+    线性探测训练，写入 model_path，返回指标（valAcc 等）；没有可用的验证结果时返回 None
+    """
+    import torch.nn as nn
+
+    baseline = current_model_metrics()
+    start = time.perf_counter()
+
+    backbone, backbone_id = load_backbone(args.probe_backbone, num_classes)
+    fc = backbone.fc
+    backbone.fc = nn.Identity()
+    backbone = backbone.to(device)
+
+    print(f"主干: {backbone_id.split(':')[0]}，额外增强份数: {args.probe_augment}")
+    features, cached = load_or_extract_features(train_loader, val_loader, backbone, backbone_id, device, args)
+    extract_seconds = time.perf_counter() - start
+    print(f"   特征: 训练集 {len(features['train_x'])} 条, 验证集 {len(features['val_x'])} 条"
+          f"（{'命中缓存' if cached else '已缓存到 ' + FEATURE_CACHE_DIR}）, 耗时 {extract_seconds:.1f}s")
+
+    head_start = time.perf_counter()
+    head_state, metrics = train_head(features, num_classes, args.probe_epochs)
+    head_seconds = time.perf_counter() - head_start
+    print(f"   分类头训练 {args.probe_epochs} 轮, 耗时 {head_seconds:.1f}s, "
+          f"最佳 Val Acc = {metrics['valAcc']:.4f}（第 {metrics['epoch']} 轮）")
+
+    # 主干 + 新分类头组成完整模型，与完整微调产出的模型结构相同
+    backbone.fc = fc if fc.out_features == num_classes else nn.Linear(fc.in_features, num_classes)
+    backbone.fc.load_state_dict(head_state)
+    total_seconds = time.perf_counter() - start
+    metrics.update(
+        {
+            "mode": "linear-probe",
+            "backbone": backbone_id,
+            "probeAugment": args.probe_augment,
+            "featureSeconds": round(extract_seconds, 2),
+            "headSeconds": round(head_seconds, 2),
+            "trainSeconds": round(total_seconds, 2),
+        }
+    )
+    model_artifact.save_artifact(model_path, backbone.cpu().state_dict(), "resnet18", class_to_idx, metrics)
+
+    print()
+    print(f"{'':12s} {'Val Acc':>8s} {'耗时':>10s}")
+    print(f"{'线性探测':10s} {metrics['valAcc']:8.4f} {total_seconds:9.1f}s")
+    if baseline and "valAcc" in baseline:
+        seconds = baseline.get("trainSeconds")
+        label = "当前版本" + ("（线性探测）" if baseline.get("mode") == "linear-probe" else "（完整微调）")
+        elapsed = f"{seconds:9.1f}s" if seconds is not None else f"{'-':>10s}"
+        print(f"{label:8s} {baseline['valAcc']:8.4f} {elapsed}")
+    else:
+        print("[INFO] 当前版本模型没有记录训练指标，无法与完整微调对比")
+    return metrics
@@ -0,0 +1,207 @@
+"""
+动态微批处理（micro-batching）
+
+常驻推理服务中，同一时间到达的多个识别请求会被合并成一次批量前向：
+- 收到第一个请求后，最多再等待 window_ms 毫秒，或凑满 max_batch_size 个请求
+- 把这一批交给 run_batch 一次性处理，再把结果分发回各自的调用方
+- 记录每批实际大小，生成批大小直方图，便于调整窗口与批大小
+- 请求可以带截止时间：开始前向时已经过期的请求直接以 DeadlineExceeded 结束，不再占用模型
+
+流量高峰时的过载保护见 LoadShedder：在途请求数达到上限时新请求立即被拒绝，
+过期请求在解码前与前向前被丢弃，调用方（Node 端）收到快速失败后走自己的兜底逻辑。
+"""
+
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+
+class DeadlineExceeded(Exception):
+    """
+    请求在处理完成前已经超过截止时间，调用方不会再读取结果
+    """
+
+
+class MicroBatcher:
+    def __init__(self, run_batch, max_batch_size: int = 8, window_ms: float = 10.0):
+        """
+        run_batch: 接收一批输入（list），返回等长的结果列表
+        """
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size 至少为 1")
+
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.window = max(window_ms, 0.0) / 1000.0
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._stopped = threading.Event()
+
+        self._stats_lock = threading.Lock()
+        self._histogram = Counter()
+        self._requests = 0
+        self._batches = 0
+        self._expired = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="micro-batcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, item, deadline: float = None) -> Future:
+        """
+        提交一个输入，返回 Future，批处理完成后可从中取得对应结果
+        deadline 为 time.monotonic() 时间，开始前向时已过期则 Future 以 DeadlineExceeded 结束
+        """
+        future = Future()
+        self._queue.put((item, future, deadline))
+        return future
+
+    def pending(self):
+        """
+        等待前向的请求数（近似值）
+        """
+        return self._queue.qsize()
+
+    def stats(self):
+        with self._stats_lock:
+            avg = self._requests / self._batches if self._batches else 0.0
+            return {
+                "requests": self._requests,
+                "batches": self._batches,
+                "avgBatchSize": round(avg, 3),
+                "maxBatchSize": self.max_batch_size,
+                "windowMs": self.window * 1000.0,
+                "expired": self._expired,
+                "batchSizeHistogram": {
+                    str(size): count for size, count in sorted(self._histogram.items())
+                },
+            }
+
+    def _collect(self):
+        """
+        阻塞等待第一个请求，之后在窗口期内尽量多收集请求
+        """
+        first = self._queue.get()
+        if first is None:
+            return []
+
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._stopped.set()
+                break
+            batch.append(item)
+        return batch
+
+    def _loop(self):
+        while not self._stopped.is_set():
+            batch = self._drop_expired(self._collect())
+            if not batch:
+                continue
+
+            items = [item for item, _, _ in batch]
+            futures = [future for _, future, _ in batch]
+
+            try:
+                results = self.run_batch(items)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+            else:
+                for future, result in zip(futures, results):
+                    future.set_result(result)
+
+            with self._stats_lock:
+                self._histogram[len(batch)] += 1
+                self._requests += len(batch)
+                self._batches += 1
+
+        # 停止后仍在队列中的请求直接失败，避免调用方无限等待
+        while True:
+            try:
+                pending = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if pending is not None:
+                pending[1].set_exception(RuntimeError("批处理服务已停止"))
+
+    def _drop_expired(self, batch):
+        """
+        去掉已经过了截止时间的请求，这些请求不再进入前向
+        """
+        now = time.monotonic()
+        alive = []
+        for entry in batch:
+            deadline = entry[2]
+            if deadline is not None and now >= deadline:
+                entry[1].set_exception(DeadlineExceeded("请求在等待推理时已超过截止时间"))
+                with self._stats_lock:
+                    self._expired += 1
+            else:
+                alive.append(entry)
+        return alive
+
+
+class LoadShedder:
+    """
+    常驻服务的准入控制：
+    - 在途请求（已接收、尚未返回）达到 max_pending 时，新请求立即被拒绝（overloaded），不再排队
+    - 记录因过载被拒绝与因超过截止时间被丢弃的请求数
+    max_pending 为 0 表示不限制
+    """
+
+    def __init__(self, max_pending: int = 64):
+        self.max_pending = max(max_pending, 0)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._peak = 0
+        self._admitted = 0
+        self._shed = Counter()
+
+    def admit(self):
+        """
+        占用一个名额，成功返回 True；满员时返回 False（由调用方通过 record_shed 记录）
+        """
+        with self._lock:
+            if self.max_pending and self._pending >= self.max_pending:
+                return False
+            self._pending += 1
+            self._admitted += 1
+            self._peak = max(self._peak, self._pending)
+            return True
+
+    def release(self):
+        with self._lock:
+            self._pending -= 1
+
+    def record_shed(self, reason: str):
+        with self._lock:
+            self._shed[reason] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "maxPending": self.max_pending,
+                "pending": self._pending,
+                "peakPending": self._peak,
+                "admitted": self._admitted,
+                "shed": dict(self._shed),
+            }
@@ -0,0 +1,304 @@
+"""
+单文件模型（权重 + 元数据），可内存映射加载
+
+原来一个可部署的模型是两个文件（fish_classifier_resnet18.pth + class_to_idx.pt），
+输入尺寸与归一化参数则分别写死在训练与推理脚本中。现在训练产出一个文件：
+
+    fish_classifier_resnet18.safetensors
+
+文件布局与 safetensors 相同（可以直接用 safetensors 库读取）：
+
+    8 字节小端整数 N | N 字节 JSON 头 | 所有张量的原始字节（按头中的 data_offsets 依次排列）
+
+JSON 头中每个张量为 {"dtype", "shape", "data_offsets"}，"__metadata__" 中的 "fish" 为本项目的元数据（JSON 字符串）：
+    arch              网络结构（resnet18 / mobilenet_v3_small）
+    classToIdx        类别映射
+    preprocess        输入尺寸、归一化均值与标准差、缩放方式（推理端据此校验预处理是否一致）
+    metrics           训练指标（验证集准确率、loss、轮次等）
+    sha256            张量数据区的 sha256，python model_artifact.py verify 校验
+
+加载时整个文件以 mmap（MAP_PRIVATE）映射，张量直接指向映射的内存，不读取、不复制：
+加载几乎不耗时，多个进程（包括预 fork 的 worker）加载同一文件时共享页缓存中的同一份权重。
+
+用法：
+    python model_artifact.py info                      # 查看当前版本模型的元数据
+    python model_artifact.py verify [路径]             # 校验数据区哈希
+    python model_artifact.py convert                   # 把当前版本的 .pth + class_to_idx.pt 转换为单文件模型并发布新版本
+"""
+
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import time
+
+import model_store
+
+
+ARTIFACT_FORMAT = "fish-model"
+FORMAT_VERSION = 1
+METADATA_KEY = "fish"
+HEADER_ALIGN = 8
+HASH_CHUNK = 4 * 1024 * 1024
+
+RESNET_ARTIFACT = "fish_classifier_resnet18.safetensors"
+STUDENT_ARTIFACT = "fish_classifier_mobilenet_v3_small.safetensors"
+# 旧格式：权重与类别映射分开保存
+LEGACY_RESNET_FILES = ("fish_classifier_resnet18.pth", "class_to_idx.pt")
+
+# safetensors 的 dtype 名 -> (torch dtype 名, numpy dtype)；bfloat16 按 int16 存取后再按位转换
+DTYPES = {
+    "F64": ("float64", "<f8"),
+    "F32": ("float32", "<f4"),
+    "F16": ("float16", "<f2"),
+    "BF16": ("bfloat16", "<i2"),
+    "I64": ("int64", "<i8"),
+    "I32": ("int32", "<i4"),
+    "I16": ("int16", "<i2"),
+    "I8": ("int8", "i1"),
+    "U8": ("uint8", "u1"),
+    "BOOL": ("bool", "?"),
+}
+TORCH_DTYPES = {torch_name: code for code, (torch_name, _) in DTYPES.items()}
+
+
+def resnet_files(model_dir: str = None):
+    """
+    ResNet18 模型所在的文件：版本目录中有单文件模型时只有它，否则为旧格式的权重 + 类别映射
+    """
+    artifact = model_store.model_file(RESNET_ARTIFACT, model_dir)
+    if os.path.isfile(artifact):
+        return [artifact]
+    return [model_store.model_file(name, model_dir) for name in LEGACY_RESNET_FILES]
+
+
+def preprocess_config():
+    """
+    推理与验证集共用的预处理参数（见 image_preprocess.py）
+    """
+    from image_preprocess import IMG_SIZE, MEAN, STD
+
+    return {"imgSize": IMG_SIZE, "mean": [float(v) for v in MEAN], "std": [float(v) for v in STD], "resize": "bilinear"}
+
+
+def _tensor_bytes(tensor):
+    import torch
+
+    tensor = tensor.detach().to("cpu").contiguous()
+    if tensor.dtype == torch.bfloat16:
+        tensor = tensor.view(torch.int16)
+    return tensor.numpy().tobytes()
+
+
+def save_artifact(path: str, state_dict, arch: str, class_to_idx: dict, metrics: dict = None, extra: dict = None):
+    """
+    写入单文件模型（先写临时文件再原子替换），返回元数据
+    state_dict 中的张量按元素字节数从大到小排列，保证每个张量在文件中按自身元素大小对齐
+    """
+    entries = []
+    for name, tensor in state_dict.items():
+        dtype_name = str(tensor.dtype).replace("torch.", "")
+        if dtype_name not in TORCH_DTYPES:
+            raise ValueError(f"不支持的张量类型: {name} ({tensor.dtype})")
+        entries.append((name, tensor, TORCH_DTYPES[dtype_name]))
+    entries.sort(key=lambda entry: -entry[1].element_size())
+
+    tensors = {}
+    digest = hashlib.sha256()
+    offset = 0
+    chunks = []
+    for name, tensor, code in entries:
+        data = _tensor_bytes(tensor)
+        digest.update(data)
+        tensors[name] = {"dtype": code, "shape": list(tensor.shape), "data_offsets": [offset, offset + len(data)]}
+        chunks.append(data)
+        offset += len(data)
+
+    meta = {
+        "format": ARTIFACT_FORMAT,
+        "formatVersion": FORMAT_VERSION,
+        "arch": arch,
+        "numClasses": len(class_to_idx),
+        "classToIdx": {str(cls): int(idx) for cls, idx in class_to_idx.items()},
+        "preprocess": preprocess_config(),
+        "metrics": metrics or {},
+        "createdAt": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "sha256": digest.hexdigest(),
+        "dataBytes": offset,
+    }
+    if extra:
+        meta.update(extra)
+
+    header = {"__metadata__": {METADATA_KEY: json.dumps(meta, ensure_ascii=False)}, **tensors}
+    header_bytes = json.dumps(header, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    # 与 safetensors 相同，用空格把头补齐到 8 字节的整数倍，数据区从对齐的位置开始
+    header_bytes += b" " * (-len(header_bytes) % HEADER_ALIGN)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for data in chunks:
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return meta
+
+
+def read_header(path: str):
+    """
+    只读取 JSON 头，返回 (张量表, 元数据, 数据区起始偏移)，不依赖 torch
+    """
+    with open(path, "rb") as f:
+        prefix = f.read(8)
+        if len(prefix) != 8:
+            raise ValueError(f"不是有效的模型文件: {path}")
+        (header_size,) = struct.unpack("<Q", prefix)
+        if header_size > os.path.getsize(path) - 8:
+            raise ValueError(f"模型文件头已损坏: {path}")
+        header = json.loads(f.read(header_size).decode("utf-8"))
+
+    metadata = header.pop("__metadata__", {}) or {}
+    try:
+        meta = json.loads(metadata[METADATA_KEY])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(f"模型文件缺少元数据: {path}")
+    if meta.get("format") != ARTIFACT_FORMAT:
+        raise ValueError(f"不是本项目的模型文件: {path}")
+    if meta.get("formatVersion", 0) > FORMAT_VERSION:
+        raise ValueError(f"模型文件版本 {meta['formatVersion']} 高于当前支持的 {FORMAT_VERSION}，请更新推理代码")
+    return header, meta, 8 + header_size
+
+
+def read_metadata(path: str):
+    return read_header(path)[1]
+
+
+def load_artifact(path: str, verify: bool = False):
+    """
+    内存映射加载，返回 (state_dict, 元数据)
+    张量直接指向映射的内存（写时复制），load_state_dict(assign=True) 后模型参数也不复制
+    verify=True 时先校验数据区哈希（需要读取整个文件）
+    """
+    import numpy as np
+    import torch
+
+    tensors, meta, data_start = read_header(path)
+    if verify:
+        verify_artifact(path)
+
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    state_dict = {}
+    for name, info in tensors.items():
+        torch_name, np_dtype = DTYPES[info["dtype"]]
+        begin, end = info["data_offsets"]
+        count = (end - begin) // np.dtype(np_dtype).itemsize
+        array = np.frombuffer(mapped, dtype=np_dtype, count=count, offset=data_start + begin)
+        tensor = torch.from_numpy(array.reshape(info["shape"]))
+        if torch_name == "bfloat16":
+            tensor = tensor.view(torch.bfloat16)
+        state_dict[name] = tensor
+    return state_dict, meta
+
+
+def verify_artifact(path: str):
+    """
+    重新计算数据区的 sha256 并与元数据比较，不一致时抛出 ValueError
+    """
+    _, meta, data_start = read_header(path)
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        f.seek(data_start)
+        while True:
+            chunk = f.read(HASH_CHUNK)
+            if not chunk:
+                break
+            digest.update(chunk)
+    if digest.hexdigest() != meta.get("sha256"):
+        raise ValueError(f"模型文件内容与哈希不一致（文件可能损坏）: {path}")
+    return meta
+
+
+def check_preprocess(meta: dict):
+    """
+    推理端的解码与归一化写死在 image_preprocess.py 中，模型记录的预处理不一致时拒绝加载
+    """
+    expected = preprocess_config()
+    actual = meta.get("preprocess") or {}
+    for key in ("imgSize", "mean", "std"):
+        value = actual.get(key)
+        if value is None:
+            continue
+        if key == "imgSize":
+            same = int(value) == expected[key]
+        else:
+            same = len(value) == len(expected[key]) and all(abs(a - b) < 1e-6 for a, b in zip(value, expected[key]))
+        if not same:
+            raise ValueError(f"模型的预处理参数 {key}={value} 与推理端 {expected[key]} 不一致")
+
+
+def convert_legacy(model_dir: str = None):
+    """
+    把旧格式的 .pth + class_to_idx.pt 转换为单文件模型并发布为新版本，返回版本名
+    """
+    import torch
+
+    model_path, class_index_path = [model_store.model_file(name, model_dir) for name in LEGACY_RESNET_FILES]
+    if not os.path.isfile(model_path) or not os.path.isfile(class_index_path):
+        raise FileNotFoundError("当前版本中没有 .pth 权重与 class_to_idx.pt，无需转换")
+
+    state_dict = torch.load(model_path, map_location="cpu")
+    class_to_idx = torch.load(class_index_path, map_location="cpu")
+    with model_store.new_version(
+        skip=[RESNET_ARTIFACT, *LEGACY_RESNET_FILES], note="model_artifact.py convert"
+    ) as staging:
+        save_artifact(
+            model_store.model_file(RESNET_ARTIFACT, staging),
+            state_dict,
+            "resnet18",
+            class_to_idx,
+            extra={"convertedFrom": os.path.basename(model_path)},
+        )
+    return model_store.current_version()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="单文件模型（权重 + 元数据）")
+    parser.add_argument("command", choices=["info", "verify", "convert"])
+    parser.add_argument("path", nargs="?", help="模型文件路径（默认当前版本的 ResNet18 模型）")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        try:
+            version = convert_legacy()
+        except FileNotFoundError as e:
+            print(f"[ERROR] {e}")
+            return
+        print(f"[OK] 已转换并发布模型版本: {version}")
+        return
+
+    path = args.path or model_store.model_file(RESNET_ARTIFACT)
+    if not os.path.isfile(path):
+        print(f"[ERROR] 模型文件不存在: {path}")
+        print("        旧格式模型可运行 python model_artifact.py convert 转换")
+        return
+    try:
+        meta = verify_artifact(path) if args.command == "verify" else read_metadata(path)
+    except ValueError as e:
+        print(f"[ERROR] {e}")
+        return
+
+    if args.command == "verify":
+        print(f"[OK] 哈希校验通过: {meta['sha256']}")
+    summary = {key: value for key, value in meta.items() if key != "classToIdx"}
+    summary["classes"] = sorted(meta.get("classToIdx", {}), key=meta["classToIdx"].get)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
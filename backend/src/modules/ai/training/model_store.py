@@ -0,0 +1,255 @@
+"""
+模型版本目录
+
+重新训练时如果直接覆盖 ./models 下的模型文件，正在加载模型的进程可能读到写了一半的文件，
+或者读到新的权重与旧的 class_to_idx.pt。改为每次产出模型都生成一个新的版本目录：
+
+    ./models/versions/20260101-030000/   一个完整的版本（权重、类别映射、导出模型、cascade.json 等）
+    ./models/versions/.staging-*/        正在写入的版本，读取方不会看到
+    ./models/CURRENT                     当前版本名，写临时文件后 os.replace 原子替换
+
+- 新版本先从当前版本继承未改动的文件（硬链接，不支持时复制），再写入本次产出的文件，
+  写完后整体改名为正式版本并切换 CURRENT；读取方看到的总是某个完整的版本
+- 版本目录中的文件可能与其他版本共享（硬链接），只能写入新文件，不能原地修改
+- 没有 CURRENT 时（旧部署）所有文件仍从 ./models 读取；第一次发布版本时从 ./models 继承
+- 默认保留最近 KEEP_VERSIONS 个版本（当前版本始终保留），便于回滚
+
+用法：
+    python model_store.py list            # 查看所有版本
+    python model_store.py use 20260101-030000   # 切换（回滚）到指定版本
+"""
+
+import argparse
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+
+
+MODEL_DIR = "./models"
+VERSIONS_DIR = os.path.join(MODEL_DIR, "versions")
+CURRENT_PATH = os.path.join(MODEL_DIR, "CURRENT")
+VERSION_INFO_NAME = "version.json"
+STAGING_PREFIX = ".staging-"
+KEEP_VERSIONS = 5
+
+# 版本目录中的模型文件（从 ./models 继承时只取这些文件）
+ARTIFACTS = (
+    "fish_classifier_resnet18.safetensors",
+    "fish_classifier_resnet18.pth",
+    "class_to_idx.pt",
+    "fish_classifier_resnet18_scripted.pt",
+    "fish_classifier_resnet18.onnx",
+    "fish_classifier_resnet18_int8.pt",
+    "fish_classifier_mobilenet_v3_small.safetensors",
+    "fish_classifier_mobilenet_v3_small.pth",
+    "fish_classifier_mobilenet_v3_small_scripted.pt",
+    "cascade.json",
+)
+
+
+def current_version():
+    """
+    当前版本名；没有发布过版本时返回 None
+    """
+    try:
+        with open(CURRENT_PATH, "r", encoding="utf-8") as f:
+            version = f.read().strip()
+    except OSError:
+        return None
+    return version or None
+
+
+def version_dir(version: str):
+    return os.path.join(VERSIONS_DIR, version)
+
+
+def current_dir():
+    """
+    当前版本目录；没有版本时返回 ./models
+    """
+    version = current_version()
+    if version and os.path.isdir(version_dir(version)):
+        return version_dir(version)
+    return MODEL_DIR
+
+
+def model_file(path: str, model_dir: str = None):
+    """
+    模型文件在指定版本目录（默认当前版本）中的路径
+    path 为 ./models 下的默认路径，只取文件名
+    """
+    return os.path.join(model_dir or current_dir(), os.path.basename(path))
+
+
+def file_identity(path: str):
+    """
+    文件的身份标识（设备、inode、大小、修改时间）：版本之间通过硬链接共享的文件标识相同
+    文件不存在时返回 None
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return f"{stat.st_dev}:{stat.st_ino}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def list_versions():
+    """
+    所有已发布的版本，按名称（即发布时间）升序
+    """
+    if not os.path.isdir(VERSIONS_DIR):
+        return []
+    return sorted(
+        name
+        for name in os.listdir(VERSIONS_DIR)
+        if not name.startswith(".") and os.path.isdir(os.path.join(VERSIONS_DIR, name))
+    )
+
+
+def read_version_info(version: str):
+    try:
+        with open(os.path.join(version_dir(version), VERSION_INFO_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _link_or_copy(src: str, dst: str):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def create_version(skip=()):
+    """
+    创建暂存目录并继承当前版本的文件，返回暂存目录路径
+    skip 为本次会重新写入（或已经过时、不应继承）的文件名，这些文件不会被继承
+    """
+    os.makedirs(VERSIONS_DIR, exist_ok=True)
+    staging = os.path.join(VERSIONS_DIR, f"{STAGING_PREFIX}{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    source = current_dir()
+    skip = {os.path.basename(name) for name in skip}
+    names = os.listdir(source) if source != MODEL_DIR else ARTIFACTS
+    for name in names:
+        src = os.path.join(source, name)
+        if name in skip or name == VERSION_INFO_NAME or not os.path.isfile(src):
+            continue
+        _link_or_copy(src, os.path.join(staging, name))
+    return staging
+
+
+def _write_current(version: str):
+    tmp_path = f"{CURRENT_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, CURRENT_PATH)
+
+
+def publish(staging: str, note: str = "", keep: int = KEEP_VERSIONS):
+    """
+    把暂存目录发布为新版本并切换 CURRENT，返回版本名
+    """
+    parent = current_version()
+    base = time.strftime("%Y%m%d-%H%M%S")
+    version, suffix = base, 1
+    while os.path.exists(version_dir(version)):
+        version = f"{base}-{suffix}"
+        suffix += 1
+
+    info = {
+        "version": version,
+        "parent": parent,
+        "note": note,
+        "createdAt": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "files": sorted(name for name in os.listdir(staging)),
+    }
+    with open(os.path.join(staging, VERSION_INFO_NAME), "w", encoding="utf-8") as f:
+        json.dump(info, f, ensure_ascii=False, indent=2)
+
+    os.rename(staging, version_dir(version))
+    _write_current(version)
+    prune(keep)
+    return version
+
+
+def discard(staging: str):
+    shutil.rmtree(staging, ignore_errors=True)
+
+
+@contextmanager
+def new_version(skip=(), note: str = ""):
+    """
+    在 with 块中向暂存目录写入文件，正常结束时发布为新版本，出错时丢弃
+        with new_version(skip=["cascade.json"]) as staging:
+            write(os.path.join(staging, "cascade.json"))
+    """
+    staging = create_version(skip)
+    try:
+        yield staging
+    except BaseException:
+        discard(staging)
+        raise
+    publish(staging, note)
+
+
+def use_version(version: str):
+    """
+    切换（回滚）到已有的版本
+    """
+    if not os.path.isdir(version_dir(version)):
+        raise FileNotFoundError(f"版本不存在: {version}")
+    _write_current(version)
+
+
+def prune(keep: int = KEEP_VERSIONS):
+    """
+    删除较旧的版本，只保留最近 keep 个（当前版本始终保留）
+    """
+    if keep <= 0:
+        return []
+    current = current_version()
+    removed = [version for version in list_versions()[:-keep] if version != current]
+    for version in removed:
+        shutil.rmtree(version_dir(version), ignore_errors=True)
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模型版本管理")
+    parser.add_argument("command", choices=["list", "use"], help="list：查看所有版本；use：切换到指定版本")
+    parser.add_argument("version", nargs="?", help="use 的目标版本名")
+    args = parser.parse_args()
+
+    if args.command == "use":
+        if not args.version:
+            parser.error("use 需要指定版本名")
+        try:
+            use_version(args.version)
+        except FileNotFoundError as e:
+            print(f"[ERROR] {e}")
+            return
+        print(f"[OK] 当前版本: {args.version}")
+        print("     常驻识别进程会在下一次检查时自动加载该版本")
+        return
+
+    current = current_version()
+    versions = list_versions()
+    if not versions:
+        print(f"[INFO] 还没有发布过版本，模型从 {os.path.abspath(MODEL_DIR)} 读取")
+        return
+    for version in versions:
+        info = read_version_info(version)
+        marker = "*" if version == current else " "
+        print(f"{marker} {version}  {info.get('createdAt', ''):19s}  {info.get('note', '')}")
+
+
+if __name__ == "__main__":
+    main()
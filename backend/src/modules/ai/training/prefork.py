@@ -0,0 +1,428 @@
+"""
+预 fork 多进程推理（infer_pytorch.py --serve --processes N）
+
+单个 Python 进程受 GIL 与单次前向的并行度限制，并发识别时用不满所有核心；
+而启动 N 个独立进程各自加载 ResNet18，常驻内存也会变成 N 倍。本模块的做法：
+
+- 父进程只加载一次模型（单文件模型以 mmap 映射，见 model_artifact.py，不做任何前向），然后 fork 出 N 个 worker，
+  worker 与父进程共享权重所在的内存页（写时复制，推理时只读，不会被复制）
+- 每个 worker 绑定到一组 CPU 核心（sched_setaffinity），intra-op 线程数等于分到的核心数，互不争抢
+- 父进程作为前端：从 stdin / Unix socket 读取请求，按在途请求数最少的原则分发给 worker，
+  响应按 id 原路写回；{"cmd": "stats"} / {"cmd": "reload"} 广播给所有 worker 后汇总
+- {"cmd": "metrics"} 广播后把各 worker 的指标快照合并（见 inference_metrics.py）
+- stats 中包含每个 worker 的 RSS / PSS（PSS 按共享进程数分摊共享页，更能反映实际内存占用）
+
+worker 意外退出后其在途请求返回错误，新请求分给其余 worker；全部 worker 退出时前端也退出，
+由调用方（pytorch-worker.ts）重新拉起。仅支持 Linux（依赖 fork 与 /proc）。
+
+吞吐扩展测试（依次用 1..N 个 worker 启动服务，测量吞吐与每个 worker 的内存）：
+    python prefork.py --max-processes 4 --image fish.jpg --requests 400
+"""
+
+import argparse
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+
+from inference_metrics import merge_snapshots
+
+
+BROADCAST_COMMANDS = ("stats", "reload", "metrics")
+MEMORY_FIELDS = {
+    "Rss": "rssMb",
+    "Pss": "pssMb",
+    "Shared_Clean": "sharedCleanMb",
+    "Shared_Dirty": "sharedDirtyMb",
+    "Private_Clean": "privateCleanMb",
+    "Private_Dirty": "privateDirtyMb",
+}
+
+
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def core_groups(processes: int, cores=None):
+    """
+    把可用核心按顺序平均分成 processes 组；worker 数多于核心数时轮流共用核心
+    """
+    cores = list(cores if cores is not None else available_cores())
+    if processes > len(cores):
+        return [[cores[i % len(cores)]] for i in range(processes)]
+    size, extra = divmod(len(cores), processes)
+    groups, start = [], 0
+    for i in range(processes):
+        end = start + size + (1 if i < extra else 0)
+        groups.append(cores[start:end])
+        start = end
+    return groups
+
+
+def pin_to_cores(cores):
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+
+
+def memory_usage(pid: int):
+    """
+    进程内存（MB）：Rss、Pss 以及共享 / 私有页，读取 /proc/<pid>/smaps_rollup；不可用时返回 None
+    """
+    usage = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in MEMORY_FIELDS:
+                    usage[MEMORY_FIELDS[key]] = round(int(value.split()[0]) / 1024.0, 1)
+    except (OSError, ValueError, IndexError):
+        return None
+    return usage
+
+
+class _Worker:
+    def __init__(self, index: int, pid: int, cores, sock: socket.socket):
+        self.index = index
+        self.pid = pid
+        self.cores = cores
+        self.sock = sock
+        self.rfile = sock.makefile("r", encoding="utf-8")
+        self.wfile = sock.makefile("w", encoding="utf-8")
+        self.write_lock = threading.Lock()
+        self.alive = True
+        self.outstanding = 0
+        self.requests = 0
+
+
+class WorkerPool:
+    """
+    fork 出 processes 个 worker 并分发请求
+    worker_main(conn, cores) 在子进程中运行：先向 conn 写一行 {"ready": true}，
+    之后逐行读取 JSON 请求、逐行写回带相同 id 的 JSON 响应，conn 关闭时返回
+    """
+
+    def __init__(self, processes: int, worker_main, ready_timeout: float = 300.0):
+        if processes < 1:
+            raise ValueError("processes 至少为 1")
+        if not hasattr(os, "fork"):
+            raise RuntimeError("当前平台不支持 fork，无法使用多进程模式")
+
+        self.processes = processes
+        self.worker_main = worker_main
+        self.ready_timeout = ready_timeout
+        self.workers = []
+
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._readers = []
+        self._stopping = threading.Event()
+        self._all_exited = threading.Event()
+
+    def start(self):
+        """
+        依次 fork 所有 worker 并等待它们就绪；fork 完成前父进程不启动任何线程
+        """
+        for index, cores in enumerate(core_groups(self.processes)):
+            parent_sock, child_sock = socket.socketpair()
+            pid = os.fork()
+            if pid == 0:
+                parent_sock.close()
+                for worker in self.workers:
+                    worker.sock.close()
+                code = 0
+                try:
+                    self.worker_main(child_sock, cores)
+                except BaseException:
+                    traceback.print_exc()
+                    code = 1
+                finally:
+                    sys.stderr.flush()
+                    os._exit(code)
+
+            child_sock.close()
+            self.workers.append(_Worker(index, pid, cores, parent_sock))
+
+        for worker in self.workers:
+            worker.sock.settimeout(self.ready_timeout)
+            try:
+                line = worker.rfile.readline()
+            except socket.timeout:
+                line = ""
+            worker.sock.settimeout(None)
+            if not line or not json.loads(line).get("ready"):
+                self.stop()
+                raise RuntimeError(f"worker {worker.index}（pid {worker.pid}）启动失败")
+
+        for worker in self.workers:
+            thread = threading.Thread(
+                target=self._read_responses, args=(worker,), name=f"prefork-{worker.index}", daemon=True
+            )
+            thread.start()
+            self._readers.append(thread)
+        return self
+
+    def alive_workers(self):
+        return [worker for worker in self.workers if worker.alive]
+
+    def submit(self, request: dict, worker: _Worker = None) -> Future:
+        """
+        发送一个请求，返回响应的 Future；未指定 worker 时选在途请求最少的 worker
+        """
+        future = Future()
+        with self._lock:
+            if worker is None:
+                alive = self.alive_workers()
+                if not alive:
+                    future.set_result(self._restore({"error": "所有推理 worker 都已退出"}, request))
+                    return future
+                worker = min(alive, key=lambda item: item.outstanding)
+            internal_id = next(self._ids)
+            self._pending[internal_id] = (worker, future, request)
+            worker.outstanding += 1
+            worker.requests += 1
+
+        try:
+            with worker.write_lock:
+                worker.wfile.write(json.dumps({**request, "id": internal_id}, ensure_ascii=False) + "\n")
+                worker.wfile.flush()
+        except OSError as e:
+            self._finish(internal_id, {"error": f"推理 worker 不可用: {e}"})
+        return future
+
+    def dispatch(self, request: dict) -> Future:
+        """
+        前端入口：识别请求交给一个 worker，stats / reload / metrics 广播给所有 worker 后汇总
+        """
+        if request.get("cmd") not in BROADCAST_COMMANDS:
+            return self.submit(request)
+
+        future = Future()
+
+        def broadcast():
+            command = {key: value for key, value in request.items() if key != "id"}
+            futures = [(worker, self.submit(command, worker)) for worker in self.alive_workers()]
+            workers = []
+            for worker, worker_future in futures:
+                response = worker_future.result()
+                workers.append(
+                    {
+                        "index": worker.index,
+                        "pid": worker.pid,
+                        "cores": worker.cores,
+                        "memory": memory_usage(worker.pid),
+                        **response,
+                    }
+                )
+            if request["cmd"] == "stats":
+                response = {"stats": {**self.stats(workers), "workers": workers}}
+            elif request["cmd"] == "metrics":
+                response = {"metrics": merge_snapshots(item.get("metrics") for item in workers)}
+            else:
+                response = {"reloaded": any(item.get("reloaded") for item in workers), "workers": workers}
+            future.set_result(self._restore(response, request))
+
+        threading.Thread(target=broadcast, name="prefork-broadcast", daemon=True).start()
+        return future
+
+    def stats(self, workers=None):
+        """
+        前端统计：每个 worker 分到的请求数与内存，以及父进程自身的内存
+        """
+        with self._lock:
+            dispatched = {worker.index: worker.requests for worker in self.workers}
+        front_memory = memory_usage(os.getpid())
+        total_pss = sum((item.get("memory") or {}).get("pssMb", 0.0) for item in workers or [])
+        total_pss += (front_memory or {}).get("pssMb", 0.0)
+        return {
+            "processes": self.processes,
+            "alive": len(self.alive_workers()),
+            "dispatched": dispatched,
+            "frontMemory": front_memory,
+            "totalPssMb": round(total_pss, 1),
+        }
+
+    def wait_all_exited(self, timeout: float = None):
+        """
+        等待所有 worker 意外退出（stop 引起的退出不算）
+        """
+        return self._all_exited.wait(timeout)
+
+    def stop(self, timeout: float = 30.0):
+        """
+        关闭与 worker 的连接（worker 读到 EOF 后处理完在途请求并退出），再回收子进程
+        """
+        self._stopping.set()
+        for worker in self.workers:
+            try:
+                worker.sock.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+
+        deadline = time.monotonic() + timeout
+        for worker in self.workers:
+            while True:
+                try:
+                    pid, _ = os.waitpid(worker.pid, os.WNOHANG)
+                except ChildProcessError:
+                    break
+                if pid:
+                    break
+                if time.monotonic() > deadline:
+                    os.kill(worker.pid, 9)
+                    os.waitpid(worker.pid, 0)
+                    break
+                time.sleep(0.05)
+        for thread in self._readers:
+            thread.join(timeout=1.0)
+
+    @staticmethod
+    def _restore(response: dict, request: dict):
+        response.pop("id", None)
+        if "id" in request:
+            return {"id": request["id"], **response}
+        return response
+
+    def _finish(self, internal_id: int, response: dict):
+        with self._lock:
+            entry = self._pending.pop(internal_id, None)
+            if entry is None:
+                return
+            worker, future, request = entry
+            worker.outstanding -= 1
+        future.set_result(self._restore(response, request))
+
+    def _read_responses(self, worker: _Worker):
+        try:
+            for line in worker.rfile:
+                try:
+                    response = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if "id" in response:
+                    self._finish(response["id"], response)
+        except OSError:
+            pass
+
+        # worker 已退出：在途请求返回错误
+        worker.alive = False
+        with self._lock:
+            orphaned = [internal_id for internal_id, entry in self._pending.items() if entry[0] is worker]
+        for internal_id in orphaned:
+            self._finish(internal_id, {"error": f"推理 worker {worker.index} 已退出"})
+        if not self.alive_workers() and not self._stopping.is_set():
+            self._all_exited.set()
+
+
+def _run_load(command, image: str, requests: int, concurrency: int):
+    """
+    启动一个服务进程，保持 concurrency 个在途请求，返回 (每秒图片数, stats)
+    """
+    process = subprocess.Popen(
+        command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, bufsize=1
+    )
+    try:
+        ready = json.loads(process.stdout.readline() or "{}")
+        if not ready.get("ready"):
+            raise RuntimeError(ready.get("error") or "服务启动失败")
+
+        slots = threading.Semaphore(concurrency)
+        responses = {}
+        done = threading.Event()
+
+        def read():
+            for line in process.stdout:
+                response = json.loads(line)
+                responses[response.get("id")] = response
+                if isinstance(response.get("id"), int):
+                    slots.release()
+                if len(responses) >= requests and "stats" in responses:
+                    break
+            done.set()
+
+        reader = threading.Thread(target=read, daemon=True)
+        reader.start()
+
+        start = time.perf_counter()
+        for request_id in range(requests):
+            slots.acquire()
+            process.stdin.write(json.dumps({"id": request_id, "image": image}) + "\n")
+            process.stdin.flush()
+        while sum(1 for key in responses if isinstance(key, int)) < requests:
+            time.sleep(0.005)
+        elapsed = time.perf_counter() - start
+
+        errors = [response["error"] for key, response in responses.items() if "error" in response]
+        if errors:
+            raise RuntimeError(errors[0])
+
+        process.stdin.write(json.dumps({"id": "stats", "cmd": "stats"}) + "\n")
+        process.stdin.flush()
+        done.wait(60)
+        return requests / elapsed, responses.get("stats", {})
+    finally:
+        process.stdin.close()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="预 fork 多进程推理的吞吐扩展与内存测试")
+    parser.add_argument("--image", required=True, help="测试图片（重复发送）")
+    parser.add_argument("--max-processes", type=int, default=len(available_cores()), help="最多测试的 worker 数")
+    parser.add_argument("--requests", type=int, default=200, help="每轮发送的请求数")
+    parser.add_argument("--concurrency", type=int, default=32, help="在途请求数")
+    parser.add_argument("--backend", default=None, help="推理后端（默认与 infer_pytorch.py 相同）")
+    parser.add_argument("--output", help="把结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "infer_pytorch.py")
+    image = os.path.abspath(args.image)
+
+    print("=" * 60)
+    print(f"预 fork 多进程吞吐测试（1..{args.max_processes} 个 worker，可用核心 {len(available_cores())} 个）")
+    print("=" * 60)
+
+    rows = []
+    for processes in range(1, args.max_processes + 1):
+        command = [sys.executable, script, "--serve", "--processes", str(processes), "--watch-interval", "0"]
+        if args.backend:
+            command += ["--backend", args.backend]
+        try:
+            throughput, stats = _run_load(command, image, args.requests, args.concurrency)
+        except Exception as e:
+            print(f"[ERROR] {processes} 个 worker: {e}")
+            return
+
+        stats = stats.get("stats", {})
+        memory = [item.get("memory") or {} for item in stats.get("workers", [])]
+        row = {
+            "processes": processes,
+            "imagesPerSecond": round(throughput, 2),
+            "speedup": round(throughput / rows[0]["imagesPerSecond"], 2) if rows else 1.0,
+            "workerRssMb": [item.get("rssMb") for item in memory],
+            "workerPssMb": [item.get("pssMb") for item in memory],
+            "totalPssMb": stats.get("totalPssMb"),
+        }
+        rows.append(row)
+        print(
+            f"  worker={processes:<3d} {row['imagesPerSecond']:8.2f} 张/秒  加速比 {row['speedup']:5.2f}x  "
+            f"每个 worker RSS {row['workerRssMb']} MB  PSS {row['workerPssMb']} MB  总 PSS {row['totalPssMb']} MB",
+            flush=True,
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+        print(f"[OK] 结果已写入: {os.path.abspath(args.output)}")
+
+
+if __name__ == "__main__":
+    main()
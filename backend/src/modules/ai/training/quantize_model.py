@@ -0,0 +1,245 @@
+"""
+ResNet18 鱼类识别模型 INT8 量化
+
+用法：
+    python quantize_model.py                      # 训练后静态量化（PTQ）
+    python quantize_model.py --calib-images 300   # 指定校准图片数量
+    python quantize_model.py --qat-epochs 3       # 在 PTQ 基础上做量化感知微调（QAT）
+
+流程：
+1. 加载 train_pytorch.py 训练好的 fp32 模型；
+2. 从训练集中抽样图片做校准（QAT 时在训练集上微调若干轮）；
+3. 生成 INT8 模型并保存为 TorchScript：./models/fish_classifier_resnet18_int8.pt
+   （类别映射和量化引擎写在模型文件里，推理时使用 infer_pytorch.py --quantized）；
+4. 在验证集上对比 fp32 / int8 的 Top-1 / Top-3 准确率与单张图片 p50 / p99 延迟。
+"""
+
+import argparse
+import json
+import os
+import random
+import time
+
+from infer_pytorch import IMG_SIZE
+
+
+DEFAULT_ENGINE = "x86"
+
+
+def collect_train_image_paths(train_dataset):
+    """
+    从 random_split 得到的训练子集中取出原始图片路径
+    """
+    samples = train_dataset.dataset.samples
+    return [samples[i][0] for i in train_dataset.indices]
+
+
+def calibrate(prepared_model, image_paths, batch_size: int = 16):
+    """
+    用校准图片跑前向，让 observer 统计各层激活的取值范围
+    """
+    import numpy as np
+    import torch
+
+    from infer_pytorch import preprocess_image
+
+    with torch.no_grad():
+        for start in range(0, len(image_paths), batch_size):
+            chunk = image_paths[start:start + batch_size]
+            batch = np.concatenate([preprocess_image(path) for path in chunk], axis=0)
+            prepared_model(torch.from_numpy(batch))
+
+
+def quantize_ptq(model, image_paths, engine: str = DEFAULT_ENGINE):
+    """
+    训练后静态量化（FX Graph Mode）
+    """
+    import copy
+
+    import torch
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    torch.backends.quantized.engine = engine
+    example_inputs = (torch.zeros(1, 3, IMG_SIZE, IMG_SIZE),)
+
+    prepared = prepare_fx(
+        copy.deepcopy(model).eval(), get_default_qconfig_mapping(engine), example_inputs
+    )
+    calibrate(prepared, image_paths)
+    return convert_fx(prepared)
+
+
+def quantize_qat(model, train_loader, epochs: int, engine: str = DEFAULT_ENGINE, lr: float = 1e-5):
+    """
+    量化感知训练：插入伪量化节点后在训练集上微调，再转换为 INT8
+    """
+    import copy
+
+    import torch
+    import torch.nn as nn
+    import torch.optim as optim
+    from torch.ao.quantization import get_default_qat_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_qat_fx
+
+    from train_pytorch import train_one_epoch
+
+    torch.backends.quantized.engine = engine
+    example_inputs = (torch.zeros(1, 3, IMG_SIZE, IMG_SIZE),)
+
+    prepared = prepare_qat_fx(
+        copy.deepcopy(model).train(), get_default_qat_qconfig_mapping(engine), example_inputs
+    )
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.Adam(prepared.parameters(), lr=lr)
+
+    for epoch in range(1, epochs + 1):
+        loss, acc = train_one_epoch(prepared, criterion, optimizer, train_loader, torch.device("cpu"))
+        print(f"  QAT Epoch [{epoch}/{epochs}] Loss={loss:.4f} Acc={acc:.4f}")
+
+    prepared.eval()
+    return convert_fx(prepared)
+
+
+def save_quantized(model, idx_to_class, output_path: str, engine: str = DEFAULT_ENGINE):
+    """
+    保存为冻结的 TorchScript 模型，类别映射与量化引擎写入 extra files
+    """
+    import torch
+
+    class_to_idx = {cls: idx for idx, cls in idx_to_class.items()}
+    example = torch.zeros(1, 3, IMG_SIZE, IMG_SIZE)
+
+    with torch.no_grad():
+        scripted = torch.jit.freeze(torch.jit.trace(model.eval(), example))
+
+    torch.jit.save(
+        scripted,
+        output_path,
+        _extra_files={
+            "class_to_idx.json": json.dumps(class_to_idx, ensure_ascii=False),
+            "meta.json": json.dumps({"quant_engine": engine, "precision": "int8"}),
+        },
+    )
+    return output_path
+
+
+def evaluate_topk(model, dataloader):
+    """
+    计算 Top-1 / Top-3 准确率
+    """
+    import torch
+
+    top1 = top3 = total = 0
+    with torch.no_grad():
+        for inputs, labels in dataloader:
+            outputs = model(inputs)
+            k = min(3, outputs.shape[1])
+            topk = outputs.topk(k, dim=1).indices
+            top1 += (topk[:, 0] == labels).sum().item()
+            top3 += (topk == labels.unsqueeze(1)).any(dim=1).sum().item()
+            total += labels.size(0)
+
+    if total == 0:
+        return 0.0, 0.0
+    return top1 / total, top3 / total
+
+
+def measure_latency(model, runs: int = 100, warmup: int = 10):
+    """
+    单张图片前向延迟（毫秒），返回 (p50, p99)
+    """
+    import numpy as np
+    import torch
+
+    dummy = torch.randn(1, 3, IMG_SIZE, IMG_SIZE)
+    timings = []
+    with torch.no_grad():
+        for _ in range(warmup):
+            model(dummy)
+        for _ in range(runs):
+            start = time.perf_counter()
+            model(dummy)
+            timings.append((time.perf_counter() - start) * 1000.0)
+
+    return float(np.percentile(timings, 50)), float(np.percentile(timings, 99))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ResNet18 鱼类识别模型 INT8 量化")
+    parser.add_argument("--calib-images", type=int, default=200, help="校准使用的训练集图片数量")
+    parser.add_argument("--qat-epochs", type=int, default=0, help="量化感知微调轮数（0 表示只做 PTQ）")
+    parser.add_argument("--engine", default=DEFAULT_ENGINE, help="量化引擎：x86 / fbgemm / qnnpack")
+    parser.add_argument("--latency-runs", type=int, default=100, help="延迟测试的前向次数")
+    args = parser.parse_args()
+
+    import torch
+
+    import model_artifact
+    import model_store
+    from infer_pytorch import QUANTIZED_MODEL_PATH, load_model, load_torchscript
+    from train_pytorch import DATA_DIR, SEED, create_dataloaders, set_seed
+
+    if args.engine not in torch.backends.quantized.supported_engines:
+        print(f"[ERROR] 当前 PyTorch 不支持量化引擎: {args.engine}")
+        print(f"        可用引擎: {torch.backends.quantized.supported_engines}")
+        return
+
+    print("=" * 60)
+    print("INT8 量化鱼类识别模型")
+    print("=" * 60)
+
+    # 与训练时相同的随机种子，保证验证集划分一致
+    set_seed(SEED)
+    train_loader, val_loader, _, _ = create_dataloaders(DATA_DIR)
+    fp32_model, idx_to_class = load_model()
+
+    if args.qat_epochs > 0:
+        print(f"量化感知微调 {args.qat_epochs} 轮...")
+        int8_model = quantize_qat(fp32_model, train_loader, args.qat_epochs, args.engine)
+    else:
+        image_paths = collect_train_image_paths(train_loader.dataset)
+        random.Random(SEED).shuffle(image_paths)
+        image_paths = image_paths[: args.calib_images]
+        print(f"使用 {len(image_paths)} 张训练集图片校准...")
+        int8_model = quantize_ptq(fp32_model, image_paths, args.engine)
+
+    # 写入新的模型版本：与当前版本的 fp32 权重成对发布
+    staging = model_store.create_version(skip=[QUANTIZED_MODEL_PATH])
+    quantized_path = model_store.model_file(QUANTIZED_MODEL_PATH, staging)
+    try:
+        save_quantized(int8_model, idx_to_class, quantized_path, args.engine)
+        # 重新加载保存的模型，确保评估的就是推理时使用的文件
+        int8_model, _, _ = load_torchscript(quantized_path)
+    except BaseException:
+        model_store.discard(staging)
+        raise
+
+    print()
+    print("在验证集上对比 fp32 / int8 ...")
+    report = {}
+    for name, model in (("fp32", fp32_model), ("int8", int8_model)):
+        top1, top3 = evaluate_topk(model, val_loader)
+        p50, p99 = measure_latency(model, args.latency_runs)
+        report[name] = {"top1": top1, "top3": top3, "p50_ms": p50, "p99_ms": p99}
+
+    report["fp32"]["size_mb"] = os.path.getsize(model_artifact.resnet_files(staging)[0]) / (1024 * 1024)
+    report["int8"]["size_mb"] = os.path.getsize(quantized_path) / (1024 * 1024)
+    version = model_store.publish(staging, note=f"quantize_model.py --engine {args.engine}")
+
+    print()
+    print(f"{'':6s} {'Top-1':>8s} {'Top-3':>8s} {'p50(ms)':>9s} {'p99(ms)':>9s} {'大小(MB)':>9s}")
+    for name, row in report.items():
+        print(
+            f"{name:6s} {row['top1']:8.4f} {row['top3']:8.4f} "
+            f"{row['p50_ms']:9.2f} {row['p99_ms']:9.2f} {row['size_mb']:9.2f}"
+        )
+    speedup = report["fp32"]["p50_ms"] / report["int8"]["p50_ms"] if report["int8"]["p50_ms"] > 0 else 0.0
+    print()
+    print(f"p50 加速比: {speedup:.2f}x, Top-1 变化: {report['int8']['top1'] - report['fp32']['top1']:+.4f}")
+    print(f"[OK] INT8 模型已保存，模型版本: {version}")
+    print("     推理时使用: python infer_pytorch.py --quantized --image xxx.jpg")
+
+
+if __name__ == "__main__":
+    main()
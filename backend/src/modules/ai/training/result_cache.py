@@ -0,0 +1,199 @@
+"""
+识别结果缓存（按内容寻址）
+
+用户经常重复上传同一张图片（重试、分享同一张商品图），缓存可以跳过整条推理流程：
+- 缓存键 = sha256(图片字节) + 模型版本；模型版本由模型文件的路径、大小、修改时间计算，
+  重新训练写入新的模型文件后版本自动变化，旧结果不会再被命中
+- 两级缓存：进程内 LRU（OrderedDict）+ 磁盘 SQLite（按总大小淘汰最久未访问的记录）
+- 旧版本的磁盘记录不主动删除：同一个缓存目录可能由使用不同模型 / 后端的多个进程共用
+  （例如 INT8 与 fp32 服务），版本已是键的一部分，不会被误命中，由大小上限按最久未访问淘汰
+- 统计内存命中 / 磁盘命中 / 未命中次数
+- 多进程（--processes）共用同一个缓存目录：SQLite 连接不能跨 fork 使用，每个 worker 在 fork 之后调用 reopen()
+  打开自己的连接；磁盘总大小以数据库中的 SUM(size) 为准，淘汰时计入所有进程写入的记录
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+CACHE_DB_NAME = "results.sqlite3"
+# 本进程写入的字节数超过上限的这一比例时，重新从数据库读取总大小（其他进程的写入只能这样计入）
+DISK_SYNC_FRACTION = 0.01
+
+
+def model_version(paths, tag: str = ""):
+    """
+    根据模型文件的元信息计算版本号（不读取文件内容，开销可以忽略）
+    文件不存在时返回 None，此时不使用缓存
+    """
+    digest = hashlib.sha256(tag.encode("utf-8"))
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        digest.update(os.path.abspath(path).encode("utf-8"))
+        digest.update(f":{stat.st_size}:{stat.st_mtime_ns};".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def image_key(data: bytes, version: str):
+    return f"{version}:{hashlib.sha256(data).hexdigest()}"
+
+
+class ResultCache:
+    def __init__(self, cache_dir: str = None, memory_entries: int = 1024, max_disk_mb: float = 512):
+        self.memory_entries = memory_entries
+        self.max_disk_bytes = int(max_disk_mb * 1024 * 1024)
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits_memory = 0
+        self._hits_disk = 0
+        self._misses = 0
+
+        self.cache_dir = cache_dir
+        self._db = None
+        self._disk_bytes = 0
+        self._unsynced_bytes = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._open()
+
+    def _open(self):
+        self._db = sqlite3.connect(
+            os.path.join(self.cache_dir, CACHE_DB_NAME), check_same_thread=False, isolation_level=None
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # 多个 worker 同时写入时等待锁，而不是立即报 database is locked
+        self._db.execute("PRAGMA busy_timeout=5000")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY, version TEXT NOT NULL, value TEXT NOT NULL,"
+            " size INTEGER NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_results_accessed ON results(accessed)")
+        self._disk_bytes = self._db_size()
+        self._unsynced_bytes = 0
+
+    def reopen(self):
+        """
+        fork 出的子进程中调用：重新打开自己的数据库连接（父进程应在 fork 之前 close()，
+        子进程不使用、也不关闭继承来的连接）；进程内 LRU 与统计清空
+        """
+        with self._lock:
+            self._memory.clear()
+            self._hits_memory = self._hits_disk = self._misses = 0
+            self._db = None
+            if self.cache_dir:
+                self._open()
+
+    def _db_size(self):
+        row = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()
+        return row[0]
+
+    def forget_other_versions(self, version: str):
+        """
+        模型热更新后丢弃进程内 LRU 中旧版本的记录（本进程不会再命中它们）；
+        磁盘记录可能属于共用缓存目录的其他进程，留给大小上限淘汰
+        """
+        with self._lock:
+            for key in [k for k in self._memory if not k.startswith(f"{version}:")]:
+                del self._memory[key]
+
+    def get(self, key: str):
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self._hits_memory += 1
+                return json.loads(value)
+
+            if self._db is not None:
+                row = self._db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE results SET accessed = ? WHERE key = ?", (time.time(), key)
+                    )
+                    self._remember(key, row[0])
+                    self._hits_disk += 1
+                    return json.loads(row[0])
+
+            self._misses += 1
+            return None
+
+    def put(self, key: str, result: dict):
+        value = json.dumps(result, ensure_ascii=False)
+        with self._lock:
+            self._remember(key, value)
+            if self._db is None:
+                return
+
+            size = len(value.encode("utf-8")) + len(key)
+            old = self._db.execute("SELECT size FROM results WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO results (key, version, value, size, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, key.split(":", 1)[0], value, size, time.time()),
+            )
+            delta = size - (old[0] if old else 0)
+            self._disk_bytes += delta
+            self._unsynced_bytes += delta
+            # _disk_bytes 只包含本进程看到的变化，超过上限或本进程已写入较多时再读取数据库中的实际总大小
+            if (
+                self._disk_bytes > self.max_disk_bytes
+                or self._unsynced_bytes > self.max_disk_bytes * DISK_SYNC_FRACTION
+            ):
+                self._disk_bytes = self._db_size()
+                self._unsynced_bytes = 0
+                if self._disk_bytes > self.max_disk_bytes:
+                    self._evict_disk()
+
+    def stats(self):
+        with self._lock:
+            if self._db is not None:
+                # 与其他进程共用数据库时，本进程的计数不包含它们写入的记录
+                self._disk_bytes = self._db_size()
+                self._unsynced_bytes = 0
+            lookups = self._hits_memory + self._hits_disk + self._misses
+            hits = self._hits_memory + self._hits_disk
+            return {
+                "hitsMemory": self._hits_memory,
+                "hitsDisk": self._hits_disk,
+                "misses": self._misses,
+                "hitRate": round(hits / lookups, 4) if lookups else 0.0,
+                "memoryEntries": len(self._memory),
+                "diskBytes": self._disk_bytes,
+            }
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _remember(self, key: str, value: str):
+        if self.memory_entries <= 0:
+            return
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        """
+        按最久未访问的顺序删除记录，直到总大小降到上限的 90% 以下
+        """
+        target = int(self.max_disk_bytes * 0.9)
+        self._disk_bytes = self._db_size()
+        evicted = []
+        for key, size in self._db.execute("SELECT key, size FROM results ORDER BY accessed ASC"):
+            if self._disk_bytes <= target:
+                break
+            evicted.append((key,))
+            self._disk_bytes -= size
+        self._db.executemany("DELETE FROM results WHERE key = ?", evicted)
+        self._disk_bytes = self._db_size()
@@ -0,0 +1,67 @@
+"""
+测试 create_class_index.py：当前版本为单文件模型时，发布的新版本推理使用新的类别映射
+（在临时目录中构造数据目录与模型版本，不依赖已训练的模型）
+"""
+
+import os
+import shutil
+import tempfile
+
+from PIL import Image
+
+import create_class_index
+import model_artifact
+import model_store
+from fish_resnet import resnet18
+from infer_pytorch import load_model
+
+CLASSES = ("salmon", "tuna")
+
+
+def test_class_index():
+    """测试类别映射更新后发布的版本"""
+    print("=" * 60)
+    print("测试类别索引更新")
+    print("=" * 60)
+
+    old_cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="fish-class-index-")
+    try:
+        os.chdir(workdir)
+        for name in CLASSES:
+            os.makedirs(os.path.join(create_class_index.DATA_DIR, name))
+            Image.new("RGB", (8, 8)).save(os.path.join(create_class_index.DATA_DIR, name, "0.png"))
+
+        # 当前版本的单文件模型中类别映射与数据目录的顺序相反
+        old_mapping = {name: len(CLASSES) - 1 - idx for idx, name in enumerate(CLASSES)}
+        state_dict = resnet18(num_classes=len(CLASSES)).state_dict()
+        with model_store.new_version(note="test_class_index.py") as staging:
+            model_artifact.save_artifact(
+                os.path.join(staging, model_artifact.RESNET_ARTIFACT), state_dict, "resnet18", old_mapping,
+                extra={"convertedFrom": "test"},
+            )
+            open(os.path.join(staging, "fish_classifier_resnet18.onnx"), "wb").close()
+        old_version = model_store.current_version()
+
+        version = create_class_index.create_class_index()
+        assert version is not None and version != old_version, "没有发布新版本"
+
+        _, idx_to_class = load_model(model_store.current_dir())
+        expected = dict(enumerate(CLASSES))
+        assert idx_to_class == expected, f"类别映射 {idx_to_class}，应为 {expected}"
+        meta = model_artifact.read_metadata(model_store.model_file(model_artifact.RESNET_ARTIFACT))
+        assert meta["convertedFrom"] == "test", "重新保存时丢失了原有的元数据"
+        assert not os.path.exists(model_store.model_file("fish_classifier_resnet18.onnx")), "内嵌旧映射的导出模型仍被继承"
+
+        # 映射已一致时不再发布新版本
+        assert create_class_index.create_class_index() is None
+        assert model_store.current_version() == version
+    finally:
+        os.chdir(old_cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print("[OK] 新版本的类别映射已更新")
+
+
+if __name__ == "__main__":
+    test_class_index()
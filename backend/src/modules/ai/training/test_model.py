@@ -5,7 +5,7 @@
 import os
 import json
 import glob
-from infer_pytorch import predict
+from infer_pytorch import predict_files
 
 def test_model():
     """测试模型"""
@@ -23,40 +23,50 @@ def test_model():
     print()
     
     results = []
-    
+
+    # 先收集每个类别的测试图片，再一次性批量识别（模型只加载一次）
+    test_images = {}
     for category in sorted(categories)[:5]:  # 测试前5个类别
         category_path = os.path.join(data_dir, category)
         images = glob.glob(os.path.join(category_path, "*.png"))
-        
         if images:
-            test_image = images[0]
-            print(f"测试类别: {category}")
-            print(f"  图片: {os.path.basename(test_image)}")
-            
-            try:
-                result = predict(test_image)
-                print(f"  识别结果: {result['fishName']}")
-                print(f"  置信度: {result['confidence']:.4f}")
-                
-                if result['fishName'] == category:
-                    print(f"  [OK] 识别正确！")
-                else:
-                    print(f"  [WARN] 识别错误，期望: {category}, 实际: {result['fishName']}")
-                
-                results.append({
-                    'category': category,
-                    'predicted': result['fishName'],
-                    'confidence': result['confidence'],
-                    'correct': result['fishName'] == category
-                })
-            except Exception as e:
-                print(f"  [ERROR] 识别失败: {e}")
-                results.append({
-                    'category': category,
-                    'error': str(e)
-                })
-            
-            print()
+            test_images[images[0]] = category
+
+    try:
+        predictions = list(predict_files(list(test_images)))
+    except Exception as e:
+        print(f"[ERROR] 加载模型失败: {e}")
+        return
+
+    for result in predictions:
+        test_image = result['path']
+        category = test_images[test_image]
+        print(f"测试类别: {category}")
+        print(f"  图片: {os.path.basename(test_image)}")
+
+        if 'error' in result:
+            print(f"  [ERROR] 识别失败: {result['error']}")
+            results.append({
+                'category': category,
+                'error': result['error']
+            })
+        else:
+            print(f"  识别结果: {result['fishName']}")
+            print(f"  置信度: {result['confidence']:.4f}")
+
+            if result['fishName'] == category:
+                print(f"  [OK] 识别正确！")
+            else:
+                print(f"  [WARN] 识别错误，期望: {category}, 实际: {result['fishName']}")
+
+            results.append({
+                'category': category,
+                'predicted': result['fishName'],
+                'confidence': result['confidence'],
+                'correct': result['fishName'] == category
+            })
+
+        print()
     
     # 统计结果
     print("="*60)
@@ -1,9 +1,25 @@
 """
 基于 PyTorch 的鱼类图像识别模型训练脚本
 
+用法：
+    python train_pytorch.py                             # ResNet18（默认）
+    python train_pytorch.py --arch mobilenet_v3_small   # 级联推理用的小模型（见 calibrate_cascade.py）
+
 特点：
-- 使用 torchvision 提供的预训练模型（默认 ResNet18）
+- 使用 torchvision 提供的预训练模型（默认 ResNet18，可选 MobileNetV3-Small）
 - 支持数据增强、训练集 / 验证集划分
+- 产出的模型写入新的版本目录，训练完成后原子切换（见 model_store.py），
+  训练期间与切换时正在运行的识别进程不会读到写了一半的文件
+- 模型保存为单文件（权重 + 类别映射 + 预处理参数 + 验证集指标，见 model_artifact.py），
+  输入尺寸与归一化参数与推理共用 image_preprocess.py 中的定义
+- --dataset-cache：训练前把数据集一次性解码缩放为 uint8 内存映射数组（见 dataset_cache.py），
+  之后每个 epoch 不再重复解码原图，数据目录变化时自动重建
+- --linear-probe：冻结预训练主干，只在缓存的特征上训练 fc 层（见 linear_probe.py），几秒钟产出可直接部署的模型
+- --precision bf16 / --channels-last：训练与验证在 bfloat16 autocast 下运行、卷积使用 NHWC 内存布局，
+  支持 AVX-512 BF16 / AMX 的 CPU 上明显加快；--bench-precision 在本机对比各组合的每秒图片数
+- 每个 epoch 结束时原子写入完整检查点（模型、优化器、随机数状态等，见 training_checkpoint.py），
+  进程中断后 --resume 从最近的检查点继续
+- 学习率默认按验证集 loss 平台期减半（可选 one-cycle），验证集 loss 连续多轮没有改善时提前结束训练
 - 适配与 TensorFlow 版本相同的数据目录结构：
 
 data/
@@ -14,23 +30,33 @@ data/
     └── ...
 """
 
+import argparse
 import os
+import time
 from pathlib import Path
 
-import torch
-import torch.nn as nn
-import torch.optim as optim
-from torch.utils.data import DataLoader
-from torchvision import datasets, models, transforms
+import dataset_cache
+import linear_probe
+import model_artifact
+import model_store
+import training_checkpoint
+from image_preprocess import IMG_SIZE, MEAN, STD
+
+# torch / torchvision 只在实际训练时导入，模块被 quantize_model.py 等脚本引用
+# 或只是打印帮助、报告数据目录错误时不必承担数秒的导入开销
 
 
 # 基本配置
 DATA_DIR = "./data/fish_images"
 MODEL_DIR = "./models"
-MODEL_PATH = os.path.join(MODEL_DIR, "fish_classifier_resnet18.pth")
-CLASS_INDEX_PATH = os.path.join(MODEL_DIR, "class_to_idx.pt")
+MODEL_PATH = os.path.join(MODEL_DIR, model_artifact.RESNET_ARTIFACT)
+STUDENT_MODEL_PATH = os.path.join(MODEL_DIR, model_artifact.STUDENT_ARTIFACT)
+# 旧格式的文件（训练后已过时，不再从当前版本继承）
+LEGACY_MODEL_PATHS = {
+    "resnet18": [os.path.join(MODEL_DIR, name) for name in model_artifact.LEGACY_RESNET_FILES],
+    "mobilenet_v3_small": [os.path.join(MODEL_DIR, "fish_classifier_mobilenet_v3_small.pth")],
+}
 
-IMG_SIZE = 224
 BATCH_SIZE = 16  # 降低批次大小，适应较小的数据集
 EPOCHS = 20  # 减少训练轮数，快速测试
 LEARNING_RATE = 1e-4
@@ -38,11 +64,33 @@ WEIGHT_DECAY = 1e-4
 NUM_WORKERS = 2  # Windows上减少worker数量
 VAL_SPLIT = 0.2
 SEED = 42
+DATASET_CACHE_DIR = dataset_cache.CACHE_DIR
+
+# 学习率调度与早停（与 train_model.py 的 ReduceLROnPlateau / EarlyStopping 一样监控验证集 loss）
+LR_SCHEDULES = ("plateau", "onecycle", "constant")
+LR_FACTOR = 0.5  # 平台期学习率乘以该系数
+LR_PATIENCE = 2  # 验证集 loss 连续几轮没有改善时降低学习率
+MIN_LR = 1e-6
+ONECYCLE_MAX_LR = LEARNING_RATE * 10
+EARLY_STOP_PATIENCE = 5  # 验证集 loss 连续几轮没有改善时停止训练，0 表示不早停
+EARLY_STOP_MIN_DELTA = 1e-4
+
+# 训练精度：fp32，或 bf16 autocast（权重与优化器状态仍为 fp32，保存的模型与 fp32 训练的格式相同）
+PRECISIONS = ("fp32", "bf16")
+BENCH_PRECISION_STEPS = 10
+
+# 可训练的网络结构及其权重保存路径
+ARCHS = ("resnet18", "mobilenet_v3_small")
+ARCH_MODEL_PATHS = {
+    "resnet18": MODEL_PATH,
+    "mobilenet_v3_small": STUDENT_MODEL_PATH,
+}
 
 
 def set_seed(seed: int = 42):
     import random
     import numpy as np
+    import torch
 
     random.seed(seed)
     np.random.seed(seed)
@@ -50,12 +98,13 @@ def set_seed(seed: int = 42):
     torch.cuda.manual_seed_all(seed)
 
 
-def create_dataloaders(data_dir: str):
+def create_datasets(data_dir: str):
     """
-    使用 ImageFolder + 随机划分训练 / 验证集
+    ImageFolder：每次取样都从原图解码，训练集带数据增强
     """
-    if not os.path.isdir(data_dir):
-        raise RuntimeError(f"数据目录不存在: {data_dir}")
+    from torchvision import datasets, transforms
+
+    from image_preprocess import EvalTransform, load_eval_pixels
 
     # 数据增强与预处理
     train_transform = transforms.Compose(
@@ -65,35 +114,58 @@ def create_dataloaders(data_dir: str):
             transforms.RandomRotation(15),
             transforms.ColorJitter(brightness=0.2, contrast=0.2, saturation=0.2),
             transforms.ToTensor(),
-            transforms.Normalize(
-                mean=[0.485, 0.456, 0.406],
-                std=[0.229, 0.224, 0.225],
-            ),
+            transforms.Normalize(mean=MEAN.tolist(), std=STD.tolist()),
         ]
     )
 
-    val_transform = transforms.Compose(
-        [
-            transforms.Resize((IMG_SIZE, IMG_SIZE)),
-            transforms.ToTensor(),
-            transforms.Normalize(
-                mean=[0.485, 0.456, 0.406],
-                std=[0.229, 0.224, 0.225],
-            ),
-        ]
+    # 验证集与线上推理使用同一条解码 / 归一化路径（见 image_preprocess.py），
+    # 等价于 Resize((224, 224)) + ToTensor + Normalize
+    full_dataset = datasets.ImageFolder(data_dir, transform=train_transform)
+    val_full_dataset = datasets.ImageFolder(
+        data_dir, transform=EvalTransform(), loader=load_eval_pixels
     )
+    return full_dataset, val_full_dataset, full_dataset.class_to_idx
 
-    full_dataset = datasets.ImageFolder(data_dir, transform=train_transform)
-    num_classes = len(full_dataset.classes)
 
-    # 按 VAL_SPLIT 比例划分
+def create_cached_datasets(data_dir: str, cache_dir: str):
+    """
+    预解码缓存（见 dataset_cache.py）：缓存过期或不存在时先构建，样本从内存映射中读取
+    """
+    manifest, rebuilt = dataset_cache.ensure_cache(data_dir, cache_dir)
+    if rebuilt:
+        print(f"[OK] 已构建数据集缓存: {manifest['count']} 张, 耗时 {manifest['buildSeconds']}s")
+    else:
+        print(f"[OK] 使用数据集缓存: {os.path.abspath(cache_dir)}（{manifest['count']} 张）")
+    train_dataset = dataset_cache.CachedImageDataset(cache_dir, train=True)
+    val_dataset = dataset_cache.CachedImageDataset(cache_dir, train=False)
+    return train_dataset, val_dataset, manifest["classToIdx"]
+
+
+def create_dataloaders(data_dir: str, cache_dir: str = None):
+    """
+    使用 ImageFolder（cache_dir 不为空时使用预解码缓存）+ 随机划分训练 / 验证集
+    """
+    if not os.path.isdir(data_dir):
+        raise RuntimeError(f"数据目录不存在: {data_dir}")
+
+    import torch
+    from torch.utils.data import DataLoader, Subset
+
+    if cache_dir:
+        full_dataset, val_full_dataset, class_to_idx = create_cached_datasets(data_dir, cache_dir)
+    else:
+        full_dataset, val_full_dataset, class_to_idx = create_datasets(data_dir)
+    num_classes = len(class_to_idx)
+
+    # 按 VAL_SPLIT 比例划分；训练集与验证集各用一份 ImageFolder，
+    # 避免修改共享数据集的 transform 导致训练集也失去数据增强
     val_size = int(len(full_dataset) * VAL_SPLIT)
     train_size = len(full_dataset) - val_size
-    train_dataset, val_dataset = torch.utils.data.random_split(
-        full_dataset, [train_size, val_size]
+    train_split, val_split = torch.utils.data.random_split(
+        range(len(full_dataset)), [train_size, val_size]
     )
-    # 验证集使用 val_transform
-    val_dataset.dataset.transform = val_transform
+    train_dataset = Subset(full_dataset, train_split.indices)
+    val_dataset = Subset(val_full_dataset, val_split.indices)
 
     # Windows上num_workers=0可以避免多进程问题
     import platform
@@ -114,34 +186,172 @@ def create_dataloaders(data_dir: str):
         pin_memory=False if workers == 0 else True,
     )
 
-    return train_loader, val_loader, num_classes, full_dataset.class_to_idx
+    return train_loader, val_loader, num_classes, class_to_idx
 
 
-def create_model(num_classes: int):
+def create_model(num_classes: int, arch: str = "resnet18", pretrained: bool = True):
     """
-    基于 ResNet18 的迁移学习模型
+    迁移学习模型：ResNet18（默认）或 MobileNetV3-Small（级联推理中先行判断的小模型）
     """
-    model = models.resnet18(weights=models.ResNet18_Weights.IMAGENET1K_V1)
+    import torch.nn as nn
+    from torchvision import models
+
+    if arch == "mobilenet_v3_small":
+        weights = models.MobileNet_V3_Small_Weights.IMAGENET1K_V1 if pretrained else None
+        model = models.mobilenet_v3_small(weights=weights)
+        in_features = model.classifier[-1].in_features
+        model.classifier[-1] = nn.Linear(in_features, num_classes)
+        return model
+
+    weights = models.ResNet18_Weights.IMAGENET1K_V1 if pretrained else None
+    model = models.resnet18(weights=weights)
     in_features = model.fc.in_features
     model.fc = nn.Linear(in_features, num_classes)
     return model
 
 
-def train_one_epoch(model, criterion, optimizer, dataloader, device):
+def parse_args():
+    parser = argparse.ArgumentParser(description="训练鱼类识别模型")
+    parser.add_argument("--arch", choices=ARCHS, default="resnet18", help="网络结构")
+    parser.add_argument("--epochs", type=int, default=EPOCHS, help="训练轮数")
+    parser.add_argument(
+        "--no-pretrained", action="store_true", help="不加载 ImageNet 预训练权重（离线环境或对比实验）"
+    )
+    parser.add_argument(
+        "--dataset-cache",
+        nargs="?",
+        const=DATASET_CACHE_DIR,
+        default=None,
+        help=f"使用预解码的数据集缓存（默认目录 {DATASET_CACHE_DIR}），每个 epoch 不再重新解码原图",
+    )
+    parser.add_argument(
+        "--linear-probe",
+        action="store_true",
+        help="快速模式：冻结主干，只训练 fc 层（主干特征缓存到磁盘，仅 resnet18）",
+    )
+    parser.add_argument(
+        "--probe-backbone",
+        choices=linear_probe.BACKBONES,
+        default="imagenet",
+        help="线性探测使用的主干：imagenet（预训练权重）或 current（当前版本模型，已针对鱼类微调）",
+    )
+    parser.add_argument("--probe-augment", type=int, default=0, help="线性探测额外缓存的数据增强训练集特征份数")
+    parser.add_argument("--probe-epochs", type=int, default=linear_probe.HEAD_EPOCHS, help="线性探测中分类头的训练轮数")
+    parser.add_argument(
+        "--precision",
+        choices=PRECISIONS,
+        default="fp32",
+        help="训练与验证的计算精度：bf16 为 bfloat16 autocast（需要 AVX-512 BF16 / AMX 或支持 bf16 的 GPU）",
+    )
+    parser.add_argument("--channels-last", action="store_true", help="模型与输入使用 channels_last（NHWC）内存布局")
+    parser.add_argument(
+        "--bench-precision",
+        nargs="?",
+        type=int,
+        const=BENCH_PRECISION_STEPS,
+        default=None,
+        metavar="STEPS",
+        help=f"不训练，用一个 batch 对比 fp32 / bf16 与 channels_last 的每秒图片数（默认每种 {BENCH_PRECISION_STEPS} 步）",
+    )
+    parser.add_argument(
+        "--lr-schedule",
+        choices=LR_SCHEDULES,
+        default="plateau",
+        help=f"学习率调度：plateau（验证集 loss 连续 {LR_PATIENCE} 轮未改善时 x{LR_FACTOR}）、"
+        f"onecycle（先升到 {ONECYCLE_MAX_LR:g} 再退火）或 constant",
+    )
+    parser.add_argument(
+        "--early-stop-patience",
+        type=int,
+        default=EARLY_STOP_PATIENCE,
+        help="验证集 loss 连续几轮没有改善时提前结束训练（0 表示训练满 --epochs 轮）",
+    )
+    parser.add_argument(
+        "--resume",
+        nargs="?",
+        const="latest",
+        default=None,
+        metavar="CHECKPOINT",
+        help="从检查点继续训练（不指定路径时使用该网络结构最近的检查点）",
+    )
+    parser.add_argument(
+        "--keep-checkpoints",
+        type=int,
+        default=training_checkpoint.KEEP_CHECKPOINTS,
+        help="保留最近几个 epoch 的检查点（0 表示不保存检查点）",
+    )
+    parser.add_argument(
+        "--checkpoint-dir", default=training_checkpoint.CHECKPOINT_DIR, help="检查点根目录（按网络结构分子目录）"
+    )
+    args = parser.parse_args()
+    if args.linear_probe:
+        if args.arch != "resnet18":
+            parser.error("--linear-probe 只支持 resnet18")
+        if args.no_pretrained and args.probe_backbone == "imagenet":
+            parser.error("--linear-probe 需要预训练主干，不能与 --no-pretrained 同时使用")
+        if args.precision != "fp32" or args.channels_last:
+            parser.error("--precision / --channels-last 用于完整微调，--linear-probe 不支持")
+        if args.resume:
+            parser.error("--linear-probe 只需几秒，不支持 --resume")
+    return args
+
+
+def bf16_supported(device) -> bool:
+    """
+    设备是否原生支持 bfloat16 计算（CPU 需要 AVX-512 BF16 / AMX，否则 oneDNN 以 fp32 模拟，反而更慢）
+    """
+    import torch
+
+    if device.type == "cuda":
+        return torch.cuda.is_bf16_supported()
+    return torch.ops.mkldnn._is_mkldnn_bf16_supported()
+
+
+def autocast(device, precision: str = "fp32"):
+    """
+    precision 为 bf16 时的 autocast 上下文：卷积与全连接以 bfloat16 计算，其余算子保持 fp32
+    """
+    import torch
+
+    return torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=precision == "bf16")
+
+
+def to_device(inputs, device, channels_last: bool = False):
+    import torch
+
+    if channels_last:
+        return inputs.to(device, memory_format=torch.channels_last)
+    return inputs.to(device)
+
+
+def train_one_epoch(
+    model, criterion, optimizer, dataloader, device, precision: str = "fp32", channels_last: bool = False, scheduler=None
+):
+    """
+    precision="bf16" 时前向在 autocast 下运行；loss 先转回 fp32 再计算，反向在 autocast 之外执行。
+    bfloat16 的指数范围与 fp32 相同，不需要 GradScaler
+    scheduler 为按 batch 更新的学习率调度（one-cycle），每次 optimizer.step() 之后调用
+    """
+    import torch
+
     model.train()
     total_loss = 0.0
     correct = 0
     total = 0
 
     for inputs, labels in dataloader:
-        inputs = inputs.to(device)
+        inputs = to_device(inputs, device, channels_last)
         labels = labels.to(device)
 
         optimizer.zero_grad()
-        outputs = model(inputs)
+        with autocast(device, precision):
+            outputs = model(inputs)
+        outputs = outputs.float()
         loss = criterion(outputs, labels)
         loss.backward()
         optimizer.step()
+        if scheduler is not None:
+            scheduler.step()
 
         total_loss += loss.item() * inputs.size(0)
         _, preds = torch.max(outputs, 1)
@@ -153,24 +363,28 @@ def train_one_epoch(model, criterion, optimizer, dataloader, device):
     return avg_loss, acc
 
 
-@torch.no_grad()
-def evaluate(model, criterion, dataloader, device):
+def evaluate(model, criterion, dataloader, device, precision: str = "fp32", channels_last: bool = False):
+    import torch
+
     model.eval()
     total_loss = 0.0
     correct = 0
     total = 0
 
-    for inputs, labels in dataloader:
-        inputs = inputs.to(device)
-        labels = labels.to(device)
+    with torch.no_grad():
+        for inputs, labels in dataloader:
+            inputs = to_device(inputs, device, channels_last)
+            labels = labels.to(device)
 
-        outputs = model(inputs)
-        loss = criterion(outputs, labels)
+            with autocast(device, precision):
+                outputs = model(inputs)
+            outputs = outputs.float()
+            loss = criterion(outputs, labels)
 
-        total_loss += loss.item() * inputs.size(0)
-        _, preds = torch.max(outputs, 1)
-        correct += (preds == labels).sum().item()
-        total += labels.size(0)
+            total_loss += loss.item() * inputs.size(0)
+            _, preds = torch.max(outputs, 1)
+            correct += (preds == labels).sum().item()
+            total += labels.size(0)
 
     avg_loss = total_loss / total if total > 0 else 0.0
     acc = correct / total if total > 0 else 0.0
@@ -178,25 +392,35 @@ def evaluate(model, criterion, dataloader, device):
 
 
 def main():
+    args = parse_args()
+    epochs = args.epochs
+
     print("="*60)
-    print("使用 PyTorch 训练鱼类识别模型")
+    print(f"使用 PyTorch 训练鱼类识别模型（{args.arch}）")
     print("="*60)
     print(f"数据目录: {os.path.abspath(DATA_DIR)}")
-    print(f"模型保存目录: {os.path.abspath(MODEL_DIR)}")
+    print(f"模型版本目录: {os.path.abspath(model_store.VERSIONS_DIR)}")
     print()
-    
-    set_seed(SEED)
 
-    os.makedirs(MODEL_DIR, exist_ok=True)
+    if not os.path.isdir(DATA_DIR):
+        print(f"[ERROR] 数据目录不存在: {os.path.abspath(DATA_DIR)}")
+        print("        请先准备按类别分组的图片文件夹")
+        return
+
+    import torch
+
+    set_seed(SEED)
 
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     print(f"使用设备: {device}")
     if device.type == 'cpu':
         print("  [WARN] 使用CPU训练，速度较慢，建议使用GPU或减少训练轮数")
+    if args.precision == "bf16" and not bf16_supported(device):
+        print("  [WARN] 当前设备不支持原生 bfloat16 计算，--precision bf16 可能比 fp32 更慢")
     print()
 
     try:
-        train_loader, val_loader, num_classes, class_to_idx = create_dataloaders(DATA_DIR)
+        train_loader, val_loader, num_classes, class_to_idx = create_dataloaders(DATA_DIR, args.dataset_cache)
     except RuntimeError as e:
         print(f"[ERROR] 错误: {e}")
         print()
@@ -212,11 +436,16 @@ def main():
     total_train = len(train_loader.dataset)
     total_val = len(val_loader.dataset)
     print(f"训练集: {total_train} 张, 验证集: {total_val} 张")
+
+    if args.bench_precision is not None:
+        print()
+        bench_precision(args, train_loader, num_classes, device)
+        return
     
     # 估算训练时间
     batches_per_epoch = len(train_loader)
-    total_batches = batches_per_epoch * EPOCHS
-    print(f"每个epoch: {batches_per_epoch} 个batch, 共 {EPOCHS} 个epoch")
+    total_batches = batches_per_epoch * epochs
+    print(f"每个epoch: {batches_per_epoch} 个batch, 共 {epochs} 个epoch")
     print(f"总batch数: {total_batches}")
     if device.type == 'cpu':
         estimated_time = total_batches * 2  # 假设每个batch 2秒（CPU）
@@ -231,44 +460,414 @@ def main():
         print("       建议每类至少准备 20-50 张图片")
     print()
 
-    model = create_model(num_classes).to(device)
+    from infer_pytorch import (
+        CASCADE_CONFIG_PATH,
+        ONNX_PATH,
+        QUANTIZED_MODEL_PATH,
+        STUDENT_TORCHSCRIPT_PATH,
+        TORCHSCRIPT_PATH,
+    )
+
+    # 本次训练产出（或因此过时）的文件不从当前版本继承，其余文件（另一个模型等）沿用；
+    # cascade.json 的阈值是针对上一对小模型 / ResNet18 校准的，重新训练任一个后都需要重新校准
+    if args.arch == "resnet18":
+        outputs = (MODEL_PATH, TORCHSCRIPT_PATH, ONNX_PATH, QUANTIZED_MODEL_PATH, CASCADE_CONFIG_PATH)
+    else:
+        outputs = (STUDENT_MODEL_PATH, STUDENT_TORCHSCRIPT_PATH, CASCADE_CONFIG_PATH)
+    resume = None
+    if args.resume and not args.linear_probe:
+        try:
+            resume = load_resume_checkpoint(args, train_loader, class_to_idx)
+        except (FileNotFoundError, ValueError) as e:
+            print(f"[ERROR] 无法续训: {e}")
+            return
+
+    staging = model_store.create_version(skip=[*outputs, *LEGACY_MODEL_PATHS[args.arch]])
+    model_path = model_store.model_file(ARCH_MODEL_PATHS[args.arch], staging)
+
+    try:
+        if args.linear_probe:
+            print("线性探测：冻结主干，只训练分类头")
+            print("="*60)
+            metrics = linear_probe.run(args, train_loader, val_loader, num_classes, class_to_idx, model_path, device)
+            best_val_acc = metrics["valAcc"]
+        else:
+            best_val_acc = finetune(
+                args, model_path, train_loader, val_loader, num_classes, class_to_idx, device, resume
+            )
+    except BaseException:
+        model_store.discard(staging)
+        raise
+
+    if not os.path.isfile(model_path):
+        model_store.discard(staging)
+        print("[ERROR] 验证准确率始终为 0，没有保存模型，当前版本保持不变")
+        return
+
+    print("="*60)
+    print("[SUCCESS] 训练完成！")
+    print(f"最佳验证准确率: {best_val_acc:.4f}")
+    print()
+
+    publish_model(args, staging, model_path, num_classes, class_to_idx, best_val_acc)
+
+
+class EarlyStopping:
+    """
+    验证集 loss 连续 patience 轮没有下降超过 min_delta 时 step() 返回 True；patience <= 0 时从不停止
+    """
+
+    def __init__(self, patience: int = EARLY_STOP_PATIENCE, min_delta: float = EARLY_STOP_MIN_DELTA):
+        self.patience = patience
+        self.min_delta = min_delta
+        self.best_loss = None
+        self.bad_epochs = 0
+        self.stopped_epoch = None
+
+    def step(self, epoch: int, val_loss: float) -> bool:
+        if self.best_loss is None or val_loss < self.best_loss - self.min_delta:
+            self.best_loss = val_loss
+            self.bad_epochs = 0
+        else:
+            self.bad_epochs += 1
+        if self.patience > 0 and self.bad_epochs >= self.patience:
+            self.stopped_epoch = epoch
+        return self.stopped_epoch is not None
+
+    def state_dict(self):
+        return {"bestLoss": self.best_loss, "badEpochs": self.bad_epochs, "stoppedEpoch": self.stopped_epoch}
+
+    def load_state_dict(self, state: dict):
+        self.best_loss = state["bestLoss"]
+        self.bad_epochs = state["badEpochs"]
+        self.stopped_epoch = state["stoppedEpoch"]
+
+
+def create_scheduler(args, optimizer, steps_per_epoch: int):
+    """
+    返回 (调度器, 是否按 batch 更新)；constant 时为 (None, False)
+    """
+    import torch.optim as optim
+
+    if args.lr_schedule == "plateau":
+        scheduler = optim.lr_scheduler.ReduceLROnPlateau(
+            optimizer, mode="min", factor=LR_FACTOR, patience=LR_PATIENCE, min_lr=MIN_LR
+        )
+        return scheduler, False
+    if args.lr_schedule == "onecycle":
+        scheduler = optim.lr_scheduler.OneCycleLR(
+            optimizer, max_lr=ONECYCLE_MAX_LR, epochs=args.epochs, steps_per_epoch=steps_per_epoch
+        )
+        return scheduler, True
+    return None, False
+
+
+def load_resume_checkpoint(args, train_loader, class_to_idx: dict):
+    """
+    读取 --resume 指定（或最近）的检查点，并确认网络结构、类别与训练集划分与本次一致
+    """
+    directory = training_checkpoint.run_dir(args.arch, args.checkpoint_dir)
+    path = training_checkpoint.latest_checkpoint(directory) if args.resume == "latest" else args.resume
+    if not path or not os.path.isfile(path):
+        raise FileNotFoundError(f"没有找到检查点: {path or os.path.abspath(directory)}")
+
+    checkpoint = training_checkpoint.load_checkpoint(path)
+    if checkpoint.get("arch") != args.arch:
+        raise ValueError(f"检查点的网络结构为 {checkpoint.get('arch')}，与 --arch {args.arch} 不一致")
+    if checkpoint.get("classToIdx") != class_to_idx:
+        raise ValueError("检查点的类别与数据目录不一致（数据目录已变化），请重新开始训练")
+    if checkpoint.get("trainIndices") != list(train_loader.dataset.indices):
+        raise ValueError("检查点的训练 / 验证集划分与本次不一致（数据目录已变化），请重新开始训练")
+    # 早期的检查点没有记录学习率调度，按 constant 处理
+    lr_schedule = checkpoint.get("lrSchedule", "constant")
+    if lr_schedule != args.lr_schedule:
+        raise ValueError(f"检查点使用 --lr-schedule {lr_schedule}，续训时请使用相同的学习率调度")
+    if lr_schedule == "onecycle" and checkpoint.get("epochs") != args.epochs:
+        raise ValueError(f"one-cycle 的学习率曲线按总轮数计算，续训时请使用相同的 --epochs {checkpoint.get('epochs')}")
+    if checkpoint.get("precision") != args.precision or checkpoint.get("channelsLast") != args.channels_last:
+        print(f"[WARN] 检查点以 {checkpoint.get('precision')}（channels_last={checkpoint.get('channelsLast')}）训练，"
+              f"本次使用 {args.precision}（channels_last={args.channels_last}）")
+    print(f"[OK] 从检查点继续: {path}（已完成 {checkpoint['epoch']} 轮，最佳 Val Acc = {checkpoint['bestValAcc']:.4f}）")
+    return checkpoint
+
+
+def finetune(
+    args, model_path: str, train_loader, val_loader, num_classes: int, class_to_idx: dict, device, resume=None
+):
+    """
+    完整微调，验证集准确率提升时保存到 model_path，返回最佳验证准确率
+    每个 epoch 结束时写检查点；resume 为 load_resume_checkpoint 的结果时从其后一轮继续
+    """
+    import torch
+    import torch.nn as nn
+    import torch.optim as optim
+
+    epochs = args.epochs
+    checkpoint_dir = training_checkpoint.run_dir(args.arch, args.checkpoint_dir)
+    # 续训时权重来自检查点，不需要（可能要联网下载的）预训练权重
+    model = create_model(num_classes, args.arch, pretrained=not args.no_pretrained and resume is None)
+    if args.channels_last:
+        model = model.to(device, memory_format=torch.channels_last)
+    else:
+        model = model.to(device)
     criterion = nn.CrossEntropyLoss()
     optimizer = optim.Adam(
         model.parameters(), lr=LEARNING_RATE, weight_decay=WEIGHT_DECAY
     )
+    scheduler, per_batch = create_scheduler(args, optimizer, len(train_loader))
+    early_stopping = EarlyStopping(args.early_stop_patience)
 
     best_val_acc = 0.0
-    print(f"开始训练，共 {EPOCHS} 轮...")
+    start_epoch = 1
+    # 训练阶段（含数据加载）累计的图片数与耗时，用于报告每秒图片数
+    train_images, train_seconds = 0, 0.0
+    elapsed = 0.0
+    if resume is not None:
+        model.load_state_dict(resume["model"])
+        optimizer.load_state_dict(resume["optimizer"])
+        if scheduler is not None and resume.get("scheduler") is not None:
+            scheduler.load_state_dict(resume["scheduler"])
+        if resume.get("earlyStopping") is not None:
+            early_stopping.load_state_dict(resume["earlyStopping"])
+        best_val_acc = resume["bestValAcc"]
+        start_epoch = resume["epoch"] + 1
+        train_images, train_seconds = resume["trainImages"], resume["trainImageSeconds"]
+        elapsed = resume["elapsedSeconds"]
+        if best_val_acc > 0 and not training_checkpoint.restore_best(checkpoint_dir, model_path):
+            print("[WARN] 检查点目录中没有最佳模型，只有之后验证准确率更高的轮次才会保存模型")
+            best_val_acc = 0.0
+        # 最后恢复随机数状态，之后的打乱顺序与数据增强与不中断时相同
+        training_checkpoint.set_rng_state(resume["rng"])
+    elif args.keep_checkpoints > 0:
+        if training_checkpoint.list_checkpoints(checkpoint_dir):
+            print(f"[INFO] 开始新的训练，清空旧检查点: {os.path.abspath(checkpoint_dir)}（续训请使用 --resume）")
+        training_checkpoint.clear(checkpoint_dir)
+
+    layout = "channels_last" if args.channels_last else "NCHW"
+    if start_epoch > 1:
+        print(f"继续训练，第 {start_epoch}-{epochs} 轮（{args.precision}, {layout}）...")
+    else:
+        print(f"开始训练，共 {epochs} 轮（{args.precision}, {layout}）...")
+    if args.lr_schedule == "plateau":
+        print(f"学习率: {LEARNING_RATE:g}，验证集 loss 连续 {LR_PATIENCE} 轮未改善时 x{LR_FACTOR}（最低 {MIN_LR:g}）")
+    elif args.lr_schedule == "onecycle":
+        print(f"学习率: one-cycle，最高 {ONECYCLE_MAX_LR:g}")
+    if args.early_stop_patience > 0:
+        print(f"早停: 验证集 loss 连续 {args.early_stop_patience} 轮未改善时停止")
     print("="*60)
 
-    for epoch in range(1, EPOCHS + 1):
+    # 续训时计入中断前的训练耗时
+    train_start = time.perf_counter() - elapsed
+    for epoch in range(start_epoch, epochs + 1):
+        if early_stopping.stopped_epoch is not None:
+            # 从已经早停的检查点续训
+            break
+        epoch_start = time.perf_counter()
+        lr = optimizer.param_groups[0]["lr"]
         train_loss, train_acc = train_one_epoch(
-            model, criterion, optimizer, train_loader, device
+            model,
+            criterion,
+            optimizer,
+            train_loader,
+            device,
+            args.precision,
+            args.channels_last,
+            scheduler if per_batch else None,
         )
-        val_loss, val_acc = evaluate(model, criterion, val_loader, device)
+        epoch_train_seconds = time.perf_counter() - epoch_start
+        train_images += len(train_loader.dataset)
+        train_seconds += epoch_train_seconds
+        val_loss, val_acc = evaluate(model, criterion, val_loader, device, args.precision, args.channels_last)
 
         print(
-            f"Epoch [{epoch:2d}/{EPOCHS}] | "
+            f"Epoch [{epoch:2d}/{epochs}] | "
             f"Train: Loss={train_loss:.4f} Acc={train_acc:.4f} | "
-            f"Val: Loss={val_loss:.4f} Acc={val_acc:.4f}"
+            f"Val: Loss={val_loss:.4f} Acc={val_acc:.4f} | "
+            f"lr={lr:.1e} | "
+            f"{time.perf_counter() - epoch_start:.1f}s, {len(train_loader.dataset) / epoch_train_seconds:.1f} img/s"
         )
+        if args.lr_schedule == "plateau":
+            scheduler.step(val_loss)
+            new_lr = optimizer.param_groups[0]["lr"]
+            if new_lr < lr:
+                print(f"   [INFO] 验证集 loss 连续 {LR_PATIENCE} 轮未改善，学习率降低为 {new_lr:.1e}")
 
-        # 保存最优模型
+        # 保存最优模型（写入暂存的版本目录，发布前识别进程看不到）
         if val_acc > best_val_acc:
             best_val_acc = val_acc
-            torch.save(model.state_dict(), MODEL_PATH)
-            torch.save(class_to_idx, CLASS_INDEX_PATH)
+            metrics = {
+                "epoch": epoch,
+                "epochs": epochs,
+                "trainLoss": train_loss,
+                "trainAcc": train_acc,
+                "valLoss": val_loss,
+                "valAcc": val_acc,
+                "mode": "finetune",
+                # 到保存这个模型为止的训练耗时，线性探测据此对比
+                "trainSeconds": round(time.perf_counter() - train_start, 2),
+                "precision": args.precision,
+                "channelsLast": args.channels_last,
+                "trainImagesPerSec": round(train_images / train_seconds, 2),
+                "lrSchedule": args.lr_schedule,
+                "lr": lr,
+            }
+            model_artifact.save_artifact(model_path, model.state_dict(), args.arch, class_to_idx, metrics)
+            if args.keep_checkpoints > 0:
+                training_checkpoint.save_best(checkpoint_dir, model_path)
             print(f"   [OK] 保存更优模型 (Val Acc = {best_val_acc:.4f})")
 
+        stop = early_stopping.step(epoch, val_loss)
+        if args.keep_checkpoints > 0:
+            training_checkpoint.save_checkpoint(
+                checkpoint_dir,
+                epoch,
+                model,
+                optimizer,
+                scheduler,
+                keep=args.keep_checkpoints,
+                arch=args.arch,
+                epochs=epochs,
+                classToIdx=class_to_idx,
+                trainIndices=list(train_loader.dataset.indices),
+                precision=args.precision,
+                channelsLast=args.channels_last,
+                lrSchedule=args.lr_schedule,
+                earlyStopping=early_stopping.state_dict(),
+                bestValAcc=best_val_acc,
+                trainImages=train_images,
+                trainImageSeconds=train_seconds,
+                elapsedSeconds=time.perf_counter() - train_start,
+            )
+        if stop:
+            break
+
+    stopped_epoch = early_stopping.stopped_epoch
+    if stopped_epoch is not None and stopped_epoch < epochs:
+        # 按已训练轮次的平均耗时估算节省的时间
+        epoch_seconds = (time.perf_counter() - train_start) / stopped_epoch
+        saved_epochs = epochs - stopped_epoch
+        print(
+            f"[INFO] 早停：验证集 loss 连续 {early_stopping.bad_epochs} 轮未改善，在第 {stopped_epoch}/{epochs} 轮结束，"
+            f"节省 {saved_epochs} 轮，约 {saved_epochs * epoch_seconds / 60:.1f} 分钟（平均每轮 {epoch_seconds:.1f}s）"
+        )
+
+    if train_seconds > 0:
+        print(f"训练吞吐（{args.precision}, {layout}，含数据加载）: {train_images / train_seconds:.1f} img/s")
+    return best_val_acc
+
+
+def bench_precision(args, train_loader, num_classes: int, device, steps: int = None):
+    """
+    用训练集的第一个 batch 反复执行训练步（前向 + 反向 + 优化器）与验证前向，
+    对比 fp32 / bf16 与 NCHW / channels_last 各组合的每秒图片数（不含数据加载）
+    """
+    import torch
+    import torch.nn as nn
+    import torch.optim as optim
+
+    steps = max(steps or args.bench_precision, 1)
+    inputs, labels = next(iter(train_loader))
+    labels = labels.to(device)
+    criterion = nn.CrossEntropyLoss()
+    supported = bf16_supported(device)
+
+    print(f"训练精度对比：{args.arch}, batch={len(inputs)}, 每种组合 {steps} 步（另有 2 步预热）")
+    if not supported:
+        print("[WARN] 当前设备不支持原生 bfloat16 计算，bf16 的结果仅供参考")
     print("="*60)
-    print("[SUCCESS] 训练完成！")
-    print(f"最优模型保存在: {os.path.abspath(MODEL_PATH)}")
-    print(f"类别索引映射保存在: {os.path.abspath(CLASS_INDEX_PATH)}")
-    print(f"最佳验证准确率: {best_val_acc:.4f}")
+    print(f"{'精度':6s} {'内存布局':14s} {'训练 img/s':>12s} {'验证 img/s':>12s} {'训练加速':>10s}")
+
+    baseline = None
+    for precision in PRECISIONS:
+        for channels_last in (False, True):
+            model = create_model(num_classes, args.arch, pretrained=False)
+            model = model.to(device, memory_format=torch.channels_last) if channels_last else model.to(device)
+            optimizer = optim.Adam(model.parameters(), lr=LEARNING_RATE, weight_decay=WEIGHT_DECAY)
+            batch = to_device(inputs, device, channels_last)
+
+            def train_step():
+                optimizer.zero_grad()
+                with autocast(device, precision):
+                    outputs = model(batch)
+                criterion(outputs.float(), labels).backward()
+                optimizer.step()
+
+            def eval_step():
+                with torch.no_grad(), autocast(device, precision):
+                    model(batch)
+
+            rates = []
+            for step, train in ((train_step, True), (eval_step, False)):
+                model.train(train)
+                for _ in range(2):
+                    step()
+                if device.type == "cuda":
+                    torch.cuda.synchronize()
+                start = time.perf_counter()
+                for _ in range(steps):
+                    step()
+                if device.type == "cuda":
+                    torch.cuda.synchronize()
+                rates.append(len(batch) * steps / (time.perf_counter() - start))
+
+            if baseline is None:
+                baseline = rates[0]
+            layout = "channels_last" if channels_last else "NCHW"
+            print(f"{precision:6s} {layout:14s} {rates[0]:12.1f} {rates[1]:12.1f} {rates[0] / baseline:9.2f}x")
+    print()
+    print("训练时使用: python train_pytorch.py --precision bf16 --channels-last")
+
+
+def publish_model(args, staging: str, model_path: str, num_classes: int, class_to_idx: dict, best_val_acc: float):
+    """
+    导出部署格式并发布暂存的版本目录
+    """
+    from infer_pytorch import ONNX_PATH, STUDENT_TORCHSCRIPT_PATH, TORCHSCRIPT_PATH, load_model
+
+    try:
+        if args.arch == "mobilenet_v3_small":
+            # 小模型只用于级联推理，导出 TorchScript 后即可加载，推理时不需要 torchvision
+            from export_model import export_torchscript
+
+            best_model = create_model(num_classes, args.arch, pretrained=False)
+            best_model.load_state_dict(model_artifact.load_artifact(model_path)[0])
+            idx_to_class = {idx: cls for cls, idx in class_to_idx.items()}
+            export_torchscript(
+                best_model, idx_to_class, model_store.model_file(STUDENT_TORCHSCRIPT_PATH, staging), arch=args.arch
+            )
+            print("已导出 TorchScript 小模型")
+        else:
+            # 导出部署格式：TorchScript（供 --backend torchscript）与 ONNX（供 --backend onnxruntime）
+            from export_model import export_torchscript
+
+            best_model, idx_to_class = load_model(staging)
+            export_torchscript(best_model, idx_to_class, model_store.model_file(TORCHSCRIPT_PATH, staging))
+            print("已导出 TorchScript 模型")
+            try:
+                from export_model import export_onnx
+
+                export_onnx(best_model, idx_to_class, model_store.model_file(ONNX_PATH, staging))
+                print("已导出 ONNX 模型")
+            except ImportError as e:
+                print(f"[INFO] 跳过 ONNX 导出（{e}），可安装 onnx 后运行 python export_model.py --format onnx")
+    except BaseException:
+        model_store.discard(staging)
+        raise
+
+    mode = " --linear-probe" if args.linear_probe else ""
+    version = model_store.publish(staging, note=f"train_pytorch.py --arch {args.arch}{mode}, val_acc={best_val_acc:.4f}")
+    print(f"[OK] 已发布模型版本: {version}")
+    print(f"     版本目录: {os.path.abspath(model_store.version_dir(version))}")
+    print("     常驻识别进程会在后台加载新版本并自动切换，无需重启；回滚: python model_store.py use <版本名>")
     print()
     print("下一步:")
-    print("  1. 重启后端服务")
-    print("  2. 在前端测试识别功能")
+    if args.arch == "mobilenet_v3_small":
+        print("  python calibrate_cascade.py   # 在验证集上校准级联阈值，生成 cascade.json")
+    else:
+        print("  1. 如使用 INT8 模型，重新运行 python quantize_model.py")
+        print("  2. 如使用商品相似检索，重新运行 python embed_products.py")
+        print("  3. 如使用级联推理，重新运行 python calibrate_cascade.py（旧的 cascade.json 已不再继承）")
+        print("  4. 在前端测试识别功能")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,204 @@
+"""
+训练检查点（train_pytorch.py 每个 epoch 结束时保存，--resume 从中断处继续）
+
+CPU 上完整训练要几个小时，原来只在验证准确率提升时保存模型权重，机器被回收或进程崩溃后只能从头开始，
+优化器状态也没有保存。现在每个 epoch 结束时写一个完整的检查点：
+
+    ./checkpoints/<网络结构>/epoch-018.pt    模型、优化器、学习率调度器、随机数状态、epoch、最佳指标、训练 / 验证集划分
+    ./checkpoints/<网络结构>/<模型文件名>     到目前为止验证准确率最高的模型（单文件模型，见 model_artifact.py）
+
+- 先写临时文件并 fsync，再 os.replace 原子替换，中断时不会留下写了一半的检查点
+- 默认保留最近 KEEP_CHECKPOINTS 个，--keep-checkpoints 0 关闭
+- 随机数状态（Python / NumPy / torch / CUDA）在 epoch 边界保存与恢复，
+  续训时训练集的打乱顺序与数据增强和不中断时相同
+- 不带 --resume 开始新的训练时清空该网络结构的检查点目录
+
+用法：
+    python train_pytorch.py --resume                   # 从最近的检查点继续
+    python train_pytorch.py --resume checkpoints/resnet18/epoch-012.pt
+    python training_checkpoint.py list                 # 查看已有的检查点
+"""
+
+import argparse
+import os
+import re
+import shutil
+import time
+
+
+CHECKPOINT_DIR = "./checkpoints"
+KEEP_CHECKPOINTS = 3
+CHECKPOINT_VERSION = 1
+CHECKPOINT_PATTERN = re.compile(r"^epoch-(\d+)\.pt$")
+
+
+def run_dir(arch: str, root: str = CHECKPOINT_DIR):
+    return os.path.join(root, arch)
+
+
+def checkpoint_path(directory: str, epoch: int):
+    return os.path.join(directory, f"epoch-{epoch:03d}.pt")
+
+
+def list_checkpoints(directory: str):
+    """
+    [(epoch, 路径)]，按 epoch 从小到大
+    """
+    if not os.path.isdir(directory):
+        return []
+    found = []
+    for name in os.listdir(directory):
+        match = CHECKPOINT_PATTERN.match(name)
+        if match:
+            found.append((int(match.group(1)), os.path.join(directory, name)))
+    return sorted(found)
+
+
+def latest_checkpoint(directory: str):
+    checkpoints = list_checkpoints(directory)
+    return checkpoints[-1][1] if checkpoints else None
+
+
+def rng_state():
+    import random
+
+    import numpy as np
+    import torch
+
+    return {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+        "cuda": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+    }
+
+
+def set_rng_state(state: dict):
+    import random
+
+    import numpy as np
+    import torch
+
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if state.get("cuda") is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+def _atomic_save(obj, path: str):
+    import torch
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            torch.save(obj, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def save_checkpoint(directory: str, epoch: int, model, optimizer, scheduler=None, keep: int = KEEP_CHECKPOINTS, **state):
+    """
+    保存第 epoch 轮结束时的完整训练状态，返回检查点路径；state 为额外字段（最佳指标、划分、耗时等）
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = checkpoint_path(directory, epoch)
+    checkpoint = {
+        "version": CHECKPOINT_VERSION,
+        "epoch": epoch,
+        "model": model.state_dict(),
+        "optimizer": optimizer.state_dict(),
+        "scheduler": scheduler.state_dict() if scheduler is not None else None,
+        "rng": rng_state(),
+        "savedAt": time.strftime("%Y-%m-%d %H:%M:%S"),
+        **state,
+    }
+    _atomic_save(checkpoint, path)
+    prune(directory, keep)
+    return path
+
+
+def load_checkpoint(path: str):
+    import torch
+
+    # 检查点中有 NumPy 随机数状态等非张量对象，需要 weights_only=False（只加载本机训练产生的文件）
+    checkpoint = torch.load(path, map_location="cpu", weights_only=False)
+    if checkpoint.get("version", 0) > CHECKPOINT_VERSION:
+        raise ValueError(f"检查点版本 {checkpoint['version']} 高于当前支持的 {CHECKPOINT_VERSION}: {path}")
+    return checkpoint
+
+
+def save_best(directory: str, model_path: str):
+    """
+    把暂存版本目录中的最佳模型复制到检查点目录（续训时复制回新的暂存目录）
+    """
+    os.makedirs(directory, exist_ok=True)
+    target = os.path.join(directory, os.path.basename(model_path))
+    tmp_path = f"{target}.{os.getpid()}.tmp"
+    shutil.copyfile(model_path, tmp_path)
+    os.replace(tmp_path, target)
+    return target
+
+
+def restore_best(directory: str, model_path: str):
+    """
+    续训时把检查点目录中的最佳模型复制到 model_path，没有时返回 False
+    """
+    source = os.path.join(directory, os.path.basename(model_path))
+    if not os.path.isfile(source):
+        return False
+    shutil.copyfile(source, model_path)
+    return True
+
+
+def prune(directory: str, keep: int = KEEP_CHECKPOINTS):
+    """
+    只保留最近 keep 个检查点，返回删除的路径
+    """
+    if keep <= 0:
+        return []
+    removed = [path for _, path in list_checkpoints(directory)[:-keep]]
+    for path in removed:
+        os.remove(path)
+    return removed
+
+
+def clear(directory: str):
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="训练检查点")
+    parser.add_argument("command", choices=["list", "clear"])
+    parser.add_argument("--arch", default=None, help="只处理指定网络结构的检查点")
+    parser.add_argument("--checkpoint-dir", default=CHECKPOINT_DIR, help="检查点根目录")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.checkpoint_dir):
+        print(f"[INFO] 没有检查点: {os.path.abspath(args.checkpoint_dir)}")
+        return
+    archs = [args.arch] if args.arch else sorted(os.listdir(args.checkpoint_dir))
+
+    for arch in archs:
+        directory = run_dir(arch, args.checkpoint_dir)
+        if args.command == "clear":
+            clear(directory)
+            print(f"[OK] 已删除检查点: {os.path.abspath(directory)}")
+            continue
+        checkpoints = list_checkpoints(directory)
+        if not checkpoints:
+            continue
+        print(f"{arch}:")
+        for epoch, path in checkpoints:
+            size_mb = os.path.getsize(path) / (1024 * 1024)
+            modified = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(os.path.getmtime(path)))
+            print(f"  epoch {epoch:3d}  {size_mb:7.1f} MB  {modified}  {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+商品图片向量索引（按视觉相似度查找商品）
+
+- 向量为 ResNet18 全局池化后的 512 维特征（infer_pytorch.py --embed），L2 归一化后以 float16 存储，
+  查询时内积即余弦相似度
+- 索引文件通过 np.load(mmap_mode="r") 内存映射加载，多个进程共享页缓存，启动几乎不耗时
+- 可选 IVF 分区：对向量做球面 k-means 聚成 nlist 个簇，向量按簇连续存放，
+  查询时只扫描与查询最接近的 nprobe 个簇，商品库很大时仍可在毫秒级返回
+- 同一商品有多张图片时按最高分去重，返回商品级结果（候选不足 k 个商品时自动扩大候选窗口）
+
+目录结构（默认 ./models/product_index）：
+    index.json     维度、数量、分区数、构建时间等
+    vectors.npy    [N, D] float16（IVF 时按簇排列）
+    items.json     与 vectors 行对应的 {"productId", "imageUrl"}
+    centroids.npy  [nlist, D] float32（仅 IVF）
+    offsets.npy    [nlist + 1] int64，第 i 个簇的行范围为 offsets[i]:offsets[i+1]（仅 IVF）
+"""
+
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+
+INDEX_DIR = os.path.join("./models", "product_index")
+HEADER_NAME = "index.json"
+SCORE_BLOCK_ROWS = 8192
+
+
+def normalize_rows(vectors: np.ndarray):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def spherical_kmeans(vectors: np.ndarray, nlist: int, iterations: int = 20, seed: int = 42):
+    """
+    对已归一化的向量做球面 k-means，返回 (centroids, assignments)
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=nlist, replace=False)].copy()
+
+    assignments = np.zeros(len(vectors), dtype=np.int64)
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        for cluster in range(nlist):
+            members = vectors[assignments == cluster]
+            if len(members):
+                centroids[cluster] = members.sum(axis=0)
+            else:
+                # 空簇重新随机取一个点，避免分区数实际变少
+                centroids[cluster] = vectors[rng.integers(len(vectors))]
+        centroids = normalize_rows(centroids)
+
+    return centroids, np.argmax(vectors @ centroids.T, axis=1)
+
+
+def build_index(vectors: np.ndarray, items, output_dir: str = INDEX_DIR, nlist: int = 0, extra: dict = None):
+    """
+    构建并写入索引；先写到临时目录再替换，正在读取旧索引的进程不受影响
+    vectors: [N, D] 特征；items: 与之对应的商品信息（dict，至少含 productId）
+    nlist > 0 时使用 IVF 分区
+    """
+    vectors = normalize_rows(vectors)
+    items = list(items)
+    if len(items) != len(vectors):
+        raise ValueError("向量数量与商品信息数量不一致")
+    if len(vectors) == 0:
+        raise ValueError("没有可写入索引的向量")
+
+    nlist = min(nlist, len(vectors))
+    header = {
+        "dim": int(vectors.shape[1]),
+        "count": int(len(vectors)),
+        "nlist": int(nlist),
+        "createdAt": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    if extra:
+        header.update(extra)
+
+    tmp_dir = f"{output_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    if nlist > 0:
+        centroids, assignments = spherical_kmeans(vectors, nlist)
+        order = np.argsort(assignments, kind="stable")
+        vectors = vectors[order]
+        items = [items[i] for i in order]
+        counts = np.bincount(assignments, minlength=nlist)
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        np.save(os.path.join(tmp_dir, "centroids.npy"), centroids.astype(np.float32))
+        np.save(os.path.join(tmp_dir, "offsets.npy"), offsets)
+
+    np.save(os.path.join(tmp_dir, "vectors.npy"), vectors.astype(np.float16))
+    with open(os.path.join(tmp_dir, "items.json"), "w", encoding="utf-8") as f:
+        json.dump(items, f, ensure_ascii=False)
+    # 头文件最后写入，存在即表示索引完整
+    with open(os.path.join(tmp_dir, HEADER_NAME), "w", encoding="utf-8") as f:
+        json.dump(header, f, ensure_ascii=False, indent=2)
+
+    old_dir = f"{output_dir}.old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.isdir(output_dir):
+        os.rename(output_dir, old_dir)
+    os.rename(tmp_dir, output_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return header
+
+
+def index_exists(index_dir: str = INDEX_DIR):
+    return os.path.isfile(os.path.join(index_dir, HEADER_NAME))
+
+
+def index_files(index_dir: str):
+    """
+    索引中会被读取的文件（用于计算结果缓存的版本号）
+    """
+    return [os.path.join(index_dir, HEADER_NAME), os.path.join(index_dir, "vectors.npy")]
+
+
+class VectorIndex:
+    def __init__(self, index_dir: str = INDEX_DIR, nprobe: int = 8):
+        header_path = os.path.join(index_dir, HEADER_NAME)
+        if not index_exists(index_dir):
+            raise FileNotFoundError(f"商品向量索引不存在: {index_dir}，请先运行 python embed_products.py")
+
+        with open(header_path, "r", encoding="utf-8") as f:
+            self.header = json.load(f)
+        with open(os.path.join(index_dir, "items.json"), "r", encoding="utf-8") as f:
+            self.items = json.load(f)
+
+        self.index_dir = index_dir
+        self.dim = self.header["dim"]
+        self.nprobe = nprobe
+        self.vectors = np.load(os.path.join(index_dir, "vectors.npy"), mmap_mode="r")
+
+        self.centroids = None
+        self.offsets = None
+        if self.header.get("nlist", 0) > 0:
+            self.centroids = np.load(os.path.join(index_dir, "centroids.npy"))
+            self.offsets = np.load(os.path.join(index_dir, "offsets.npy"))
+
+    def __len__(self):
+        return len(self.items)
+
+    def _candidate_ranges(self, query: np.ndarray):
+        """
+        需要扫描的行范围：IVF 时为最接近查询的 nprobe 个簇，否则为全部向量
+        """
+        if self.centroids is None:
+            return [(0, len(self.vectors))]
+        nprobe = min(self.nprobe, len(self.centroids))
+        lists = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        return [(int(self.offsets[i]), int(self.offsets[i + 1])) for i in sorted(lists)]
+
+    def _score(self, start: int, end: int, query: np.ndarray):
+        """
+        分块把 float16 向量转成 float32 再做内积（numpy 的 float16 矩阵乘法没有 BLAS 加速）
+        """
+        return np.concatenate(
+            [
+                self.vectors[block:min(block + SCORE_BLOCK_ROWS, end)].astype(np.float32) @ query
+                for block in range(start, end, SCORE_BLOCK_ROWS)
+            ]
+            or [np.empty(0, dtype=np.float32)]
+        )
+
+    def search(self, query: np.ndarray, k: int = 6):
+        """
+        返回与查询向量最相似的 k 个商品：[{"productId", "imageUrl", "score"}]，按分数降序
+        """
+        query = normalize_rows(np.asarray(query).reshape(1, -1))[0]
+        ranges = self._candidate_ranges(query)
+        scores = np.concatenate([self._score(start, end, query) for start, end in ranges])
+        rows = np.concatenate([np.arange(start, end) for start, end in ranges])
+        if len(scores) == 0:
+            return []
+        return self._top_products(scores, rows, k)
+
+    def _top_products(self, scores: np.ndarray, rows: np.ndarray, k: int):
+        """
+        按分数降序取前 k 个不同的商品。同一商品可能有多张图片，先取 k * 4 个候选按商品去重，
+        不足 k 个商品时候选窗口加倍，直到凑满 k 个或候选用完
+        """
+        if k <= 0:
+            return []
+        limit = k * 4
+        while True:
+            limit = min(len(scores), limit)
+            top = np.argpartition(-scores, limit - 1)[:limit] if limit < len(scores) else np.arange(len(scores))
+            top = top[np.argsort(-scores[top], kind="stable")]
+
+            results = []
+            seen = set()
+            for position in top:
+                item = self.items[int(rows[position])]
+                if item["productId"] in seen:
+                    continue
+                seen.add(item["productId"])
+                results.append({**item, "score": round(float(scores[position]), 4)})
+                if len(results) == k:
+                    return results
+            if limit == len(scores):
+                return results
+            limit *= 2
+
+    def search_batch(self, queries: np.ndarray, k: int = 6):
+        return [self.search(query, k) for query in queries]
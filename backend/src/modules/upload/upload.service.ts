@@ -4,10 +4,16 @@ import * as fs from 'fs';
 import * as path from 'path';
 import { randomBytes } from 'crypto';
 
+// 内存中保留的最近上传图片（用于随后的识别请求，不必再从磁盘读取）
+const RECENT_UPLOAD_LIMIT = 32;
+const RECENT_UPLOAD_TTL_MS = 10 * 60 * 1000;
+
 @Injectable()
 export class UploadService {
   private readonly uploadDir: string;
   private readonly baseUrl: string;
+  // 文件名 -> 图片内容；Map 按插入顺序遍历，超出上限时删除最早的
+  private readonly recentUploads = new Map<string, { buffer: Buffer; savedAt: number }>();
 
   constructor(private configService: ConfigService) {
     this.uploadDir = this.configService.get('UPLOAD_DIR', './uploads');
@@ -29,6 +35,7 @@ export class UploadService {
 
     // 保存文件
     fs.writeFileSync(filepath, file.buffer);
+    this.rememberUpload(filename, file.buffer);
 
     // 返回文件信息（使用完整URL）
     return {
@@ -37,6 +44,29 @@ export class UploadService {
     };
   }
 
+  /**
+   * 最近上传的图片内容（上传后通常紧接着识别），不在内存中时返回 undefined
+   */
+  getRecentUpload(filename: string): Buffer | undefined {
+    const entry = this.recentUploads.get(filename);
+    if (!entry) {
+      return undefined;
+    }
+    if (Date.now() - entry.savedAt > RECENT_UPLOAD_TTL_MS) {
+      this.recentUploads.delete(filename);
+      return undefined;
+    }
+    return entry.buffer;
+  }
+
+  private rememberUpload(filename: string, buffer: Buffer) {
+    this.recentUploads.set(filename, { buffer, savedAt: Date.now() });
+    while (this.recentUploads.size > RECENT_UPLOAD_LIMIT) {
+      const oldest = this.recentUploads.keys().next().value;
+      this.recentUploads.delete(oldest);
+    }
+  }
+
   /**
    * 验证文件类型
    */